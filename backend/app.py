@@ -1,18 +1,55 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Depends, Header, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import Response, PlainTextResponse, FileResponse, StreamingResponse
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 from typing import List, Dict, Any, Optional
 import os
+import json
+import time
+import asyncio
 import httpx
 import base64
 from dotenv import load_dotenv
 from chatbot import ArtGalleryChatbot
+from recommender import AVAILABILITY
+from serialization import FastJSONResponse, dumps, encode_chat_response
+from http_cache import CompressionMiddleware, cached_json, is_not_modified, make_etag, not_modified
+from tenants import DEFAULT_GALLERY, GalleryRegistry, UnknownGallery
+from image_proxy import ImageFetcher
+from image_cache import ImageCache, ImageTooLarge, register_metrics as register_image_cache_metrics
+from image_derivatives import DerivativeStore, DerivativeUnavailable
+from pdf_export import PdfExporter, PDF_MAX_ARTWORKS
+from prewarm import CatalogPrewarmer, PREWARM_ENABLED
+from metrics import REGISTRY, span
+import profiling
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="Art Gallery Chatbot API")
+# Shared upstream client for /proxy-image, opened at startup and closed at shutdown
+image_fetcher = ImageFetcher()
+image_cache = ImageCache(image_fetcher)
+register_image_cache_metrics(image_cache)
+derivatives = DerivativeStore(image_cache)
+pdf_exporter = PdfExporter(derivatives)
+prewarmer = CatalogPrewarmer(image_cache, derivatives)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fork the image worker pool before anything else starts threads
+    await derivatives.start()
+    await image_fetcher.start()
+    # Warm the image cache in the background; the app is ready without waiting for it
+    if galleries and PREWARM_ENABLED:
+        chatbot = await asyncio.to_thread(galleries.get, DEFAULT_GALLERY)
+        await prewarmer.start(chatbot.recommender.artworks)
+    yield
+    await prewarmer.stop()
+    await image_fetcher.close()
+    await derivatives.close()
+
+app = FastAPI(title="Art Gallery Chatbot API", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -23,13 +60,136 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize chatbot
+# gzip/brotli for JSON bodies over COMPRESS_MIN_BYTES (see http_cache.py)
+app.add_middleware(CompressionMiddleware)
+
+# Galleries (one chatbot per catalog), loaded on first use and sharing one LLM gateway
 API_KEY = os.getenv("GEMINI_API_KEY")
 if not API_KEY:
     print("WARNING: GEMINI_API_KEY not set. Please add it to .env file")
-    chatbot = None
+    galleries = None
 else:
-    chatbot = ArtGalleryChatbot(API_KEY)
+    galleries = GalleryRegistry(API_KEY)
+
+# Metrics
+HTTP_REQUESTS = REGISTRY.counter("artgallery_http_requests_total", "HTTP requests by route, method and status")
+HTTP_LATENCY = REGISTRY.histogram("artgallery_http_request_duration_seconds", "HTTP request latency by route")
+HTTP_IN_FLIGHT = REGISTRY.gauge("artgallery_http_requests_in_flight", "HTTP requests currently being served")
+WS_CONNECTIONS = REGISTRY.gauge("artgallery_ws_connections", "Open /ws/chat conversations")
+WS_TURNS = REGISTRY.counter("artgallery_ws_turns_total", "Chat turns answered over /ws/chat by response type")
+WS_TURN_LATENCY = REGISTRY.histogram("artgallery_ws_turn_duration_seconds", "Time from a /ws/chat message to its full response")
+REGISTRY.gauge(
+    "artgallery_catalog_artworks",
+    "Artworks in each loaded gallery's catalog",
+    callback=lambda: {
+        (("gallery", gallery.gallery_id),): gallery.chatbot.recommender.count() for gallery in galleries.loaded()
+    } if galleries else None,
+)
+REGISTRY.gauge(
+    "artgallery_gallery_memory_bytes",
+    "Measured in-memory size of each loaded gallery",
+    callback=lambda: {
+        (("gallery", gallery.gallery_id),): gallery.size for gallery in galleries.loaded()
+    } if galleries else None,
+)
+REGISTRY.counter(
+    "artgallery_gallery_evictions_total",
+    "Galleries dropped from memory to stay within GALLERY_MEMORY_MB since start",
+    callback=lambda: galleries.evictions if galleries else None,
+)
+REGISTRY.gauge(
+    "artgallery_llm_queue_depth",
+    "Chat turns waiting for an LLM rate-limit token",
+    callback=lambda: galleries.gateway.stats()["queue_depth"] if galleries else None,
+)
+REGISTRY.gauge(
+    "artgallery_llm_in_flight",
+    "LLM calls currently waiting on Gemini",
+    callback=lambda: galleries.gateway.stats()["in_flight"] if galleries else None,
+)
+REGISTRY.counter(
+    "artgallery_llm_calls_total",
+    "LLM gateway outcomes since start (requests, succeeded, failed, shed, fallbacks)",
+    callback=lambda: {
+        (("outcome", name),): galleries.gateway.stats()[name]
+        for name in ("requests", "succeeded", "failed", "shed_breaker_open", "shed_queue_full", "shed_deadline", "fallbacks")
+    } if galleries else None,
+)
+REGISTRY.gauge(
+    "artgallery_llm_breaker_open",
+    "1 when the LLM circuit breaker is not closed",
+    callback=lambda: int(galleries.gateway.breaker.state != "closed") if galleries else None,
+)
+
+REGISTRY.gauge(
+    "artgallery_prewarm_progress",
+    "Fraction of catalog images handled by the current pre-warm run",
+    callback=lambda: prewarmer.status()["progress"],
+)
+REGISTRY.gauge(
+    "artgallery_prewarm_dead_urls",
+    "Catalog image URLs that failed to load in the last pre-warm run",
+    callback=lambda: prewarmer.failed,
+)
+
+REGISTRY.gauge(
+    "artgallery_proxy_upstream_active",
+    "Upstream image fetches currently holding a per-host slot",
+    callback=lambda: image_fetcher.stats()["active"],
+)
+
+
+def _route_path(request: Request) -> str:
+    """Route template the router matched, so path parameters don't explode label cardinality"""
+    return getattr(request.scope.get("route"), "path", "other")
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    HTTP_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # The router records the matched route in the scope, so this is only known afterwards
+        path = _route_path(request)
+        HTTP_IN_FLIGHT.dec()
+        HTTP_LATENCY.observe(time.perf_counter() - start, path=path)
+        HTTP_REQUESTS.inc(path=path, method=request.method, status=status)
+
+# Profiling is opt-in; when disabled the middleware isn't installed at all
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+if profiling.PROFILING_ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware, token=ADMIN_TOKEN)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Admin endpoints need ADMIN_TOKEN to be configured and sent as X-Admin-Token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled. Set ADMIN_TOKEN to enable them")
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+# Gallery selection, shared by every endpoint that reads a catalog
+def gallery_chatbot(gallery: Optional[str] = None, x_gallery_id: Optional[str] = Header(None)) -> ArtGalleryChatbot:
+    """Chatbot of the gallery named by ?gallery= or X-Gallery-Id (DEFAULT_GALLERY if neither).
+
+    Sync, so a gallery's first request loads its catalog in the threadpool rather than on the event loop.
+    """
+    if not galleries:
+        raise HTTPException(status_code=500, detail="Chatbot not initialized. Please set GEMINI_API_KEY in .env file")
+    gallery_id = gallery or x_gallery_id or DEFAULT_GALLERY
+    try:
+        chatbot = galleries.get(gallery_id)
+        chatbot.sync_updates()
+        return chatbot
+    except UnknownGallery:
+        raise HTTPException(status_code=404, detail=f"Unknown gallery: {gallery_id}")
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=500, detail=f"Failed to load gallery {gallery_id}: {str(e)}")
 
 # Request/Response models
 class Message(BaseModel):
@@ -52,104 +212,339 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "/chat": "POST - Send chat messages",
+            "/ws/chat": "WebSocket - Chat over one connection with streamed replies",
             "/greeting": "GET - Get initial greeting",
-            "/filters": "GET - Get available filters"
+            "/filters": "GET - Get available filters",
+            "/proxy-images": "POST - Fetch several images at once (NDJSON stream)",
+            "/export/pdf": "GET - Download recommended artworks as a PDF catalogue",
+            "/artworks/{id}": "GET - One artwork; PATCH - Update price or availability (admin)",
+            "/metrics": "GET - Prometheus metrics"
         }
     }
 
 @app.get("/greeting")
-async def get_greeting():
+async def get_greeting(request: Request, chatbot: ArtGalleryChatbot = Depends(gallery_chatbot)):
     """Get initial greeting message"""
-    if not chatbot:
-        raise HTTPException(status_code=500, detail="Chatbot not initialized. Please set GEMINI_API_KEY")
-
-    return {
-        "message": chatbot.get_greeting()
-    }
+    return cached_json(request, chatbot.greeting_json, chatbot.greeting_etag)
 
 @app.get("/filters")
-async def get_filters():
-    """Get available filter options"""
-    if not chatbot:
-        raise HTTPException(status_code=500, detail="Chatbot not initialized")
-
-    return chatbot.available_filters
-
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    """Process chat message"""
-    if not chatbot:
-        raise HTTPException(status_code=500, detail="Chatbot not initialized. Please set GEMINI_API_KEY in .env file")
+async def get_filters(request: Request, chatbot: ArtGalleryChatbot = Depends(gallery_chatbot)):
+    """Get available filter options (serialized once per catalog change; 304 while the client's copy is current)"""
+    return cached_json(request, chatbot.filters_json, chatbot.filters_etag)
 
+# ChatResponse documents the body; the recommender's output isn't re-validated against it
+@app.post("/chat", response_model=None, responses={200: {"model": ChatResponse}})
+def chat(request: ChatRequest, chatbot: ArtGalleryChatbot = Depends(gallery_chatbot)):
+    """Process chat message (sync so the LLM gateway can queue in the threadpool)"""
     try:
         # Convert to dict format
         messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
 
         # Get response from chatbot
-        response = chatbot.chat(messages)
+        response = profiling.run_profiled(chatbot.chat, messages)
 
-        return response
+        return FastJSONResponse(encode_chat_response(response, chatbot.recommender.artwork_bytes))
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Messages of history kept per WebSocket conversation (oldest dropped first)
+WS_MAX_HISTORY = int(os.getenv("WS_MAX_HISTORY", "40"))
+
+@app.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket, gallery: Optional[str] = None):
+    """One conversation per connection; the server keeps the history.
+
+    Client sends {"content": "..."} per user message ({"reset": true} starts
+    over). Server sends {"event": "greeting", "message"} on connect, then per
+    turn any number of {"event": "token", "text"} while the reply streams in
+    and a final {"event": "response", ...} with the same fields as POST /chat,
+    whose message is the complete reply. Problems are {"event": "error", "detail"}.
+    """
+    await websocket.accept()
+    gallery_id = gallery or DEFAULT_GALLERY
+    if not galleries:
+        await websocket.send_json({"event": "error", "detail": "Chatbot not initialized. Please set GEMINI_API_KEY in .env file"})
+        await websocket.close(code=1011)
+        return
+    try:
+        chatbot = await asyncio.to_thread(galleries.get, gallery_id)
+    except UnknownGallery:
+        await websocket.send_json({"event": "error", "detail": f"Unknown gallery: {gallery_id}"})
+        await websocket.close(code=1008)
+        return
+    except (OSError, ValueError) as e:
+        await websocket.send_json({"event": "error", "detail": f"Failed to load gallery {gallery_id}: {str(e)}"})
+        await websocket.close(code=1011)
+        return
+
+    loop = asyncio.get_running_loop()
+    messages: List[Dict[str, str]] = []
+    WS_CONNECTIONS.inc()
+    try:
+        await websocket.send_json({"event": "greeting", "message": chatbot.get_greeting()})
+        while True:
+            try:
+                data = json.loads(await websocket.receive_text())
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                await websocket.send_json({"event": "error", "detail": "Send a JSON object"})
+                continue
+            if data.get("reset"):
+                messages.clear()
+                continue
+            content = data.get("content")
+            if not isinstance(content, str) or not content.strip():
+                await websocket.send_json({"event": "error", "detail": "Send {\"content\": \"your message\"}"})
+                continue
+
+            messages.append({"role": "user", "content": content.strip()})
+            started = time.perf_counter()
+            tokens: asyncio.Queue = asyncio.Queue()
+
+            def run_turn(history=list(messages)):
+                # Runs in the threadpool; tokens hop back to the event loop through the queue
+                try:
+                    chatbot.sync_updates()
+                    return profiling.run_profiled(
+                        chatbot.chat, history, lambda text: loop.call_soon_threadsafe(tokens.put_nowait, text))
+                finally:
+                    loop.call_soon_threadsafe(tokens.put_nowait, None)
+
+            turn = asyncio.ensure_future(asyncio.to_thread(run_turn))
+            while (text := await tokens.get()) is not None:
+                await websocket.send_json({"event": "token", "text": text})
+            try:
+                response = await turn
+            except Exception as e:
+                messages.pop()
+                await websocket.send_json({"event": "error", "detail": str(e)})
+                continue
+
+            messages.append({"role": "assistant", "content": response["message"]})
+            del messages[:-WS_MAX_HISTORY]
+            WS_TURNS.inc(type=response["type"])
+            WS_TURN_LATENCY.observe(time.perf_counter() - started)
+            body = encode_chat_response({"event": "response", **response}, chatbot.recommender.artwork_bytes)
+            await websocket.send_text(body.decode("utf-8"))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        WS_CONNECTIONS.dec()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
-        "chatbot_initialized": chatbot is not None
+        "chatbot_initialized": galleries is not None,
+        "llm_gateway": galleries.gateway.stats() if galleries else None,
+        "galleries": galleries.stats() if galleries else None,
+        "prewarm": prewarmer.status()
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text-format metrics"""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """Recently captured request profiles, newest first"""
+    return {
+        "enabled": profiling.PROFILING_ENABLED,
+        "sample_rate": profiling.PROFILE_SAMPLE_RATE,
+        "profiles": profiling.store.list()
+    }
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str, sort: str = "cumulative", limit: int = 40):
+    """Text report for one captured profile"""
+    profile = profiling.store.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    try:
+        return PlainTextResponse(profile.report(sort=sort, limit=limit))
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Unknown sort key: {sort}")
+
+@app.get("/admin/profiles/{profile_id}/pstats", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str):
+    """Raw pstats dump for one captured profile (open with snakeviz or pstats)"""
+    profile = profiling.store.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(
+        content=profile.dump(),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.prof"'}
+    )
+
+@app.post("/admin/reload", dependencies=[Depends(require_admin)])
+async def reload_catalog(gallery: str = DEFAULT_GALLERY):
+    """Re-read a gallery's catalog and pre-warm images for the new catalog"""
+    if not galleries:
+        raise HTTPException(status_code=500, detail="Chatbot not initialized")
+    try:
+        loaded = await asyncio.to_thread(galleries.reload, gallery)
+    except UnknownGallery:
+        raise HTTPException(status_code=404, detail=f"Unknown gallery: {gallery}")
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=500, detail=f"Failed to reload catalog: {str(e)}")
+    if PREWARM_ENABLED:
+        await prewarmer.start(loaded.chatbot.recommender.artworks)
+    return {"gallery": gallery, "artworks": loaded.chatbot.recommender.count(), "prewarm": prewarmer.status()}
+
+@app.get("/admin/galleries", dependencies=[Depends(require_admin)])
+async def list_galleries():
+    """Galleries with a catalog, and the loaded ones with their measured memory, least recently used first"""
+    if not galleries:
+        raise HTTPException(status_code=500, detail="Chatbot not initialized")
+    return {
+        **galleries.stats(),
+        "available": await asyncio.to_thread(galleries.gallery_ids),
+        "galleries": [gallery.status() for gallery in galleries.loaded()],
+    }
+
+@app.get("/artworks/{artwork_id}")
+def get_artwork(artwork_id: str, request: Request, chatbot: ArtGalleryChatbot = Depends(gallery_chatbot)):
+    """One artwork record, with an ETag that changes when its price or availability does"""
+    artwork = chatbot.recommender.get_artwork(artwork_id)
+    if artwork is None:
+        raise HTTPException(status_code=404, detail="Artwork not found")
+    body = chatbot.recommender.artwork_bytes(artwork)
+    return cached_json(request, body, make_etag(body))
+
+class ArtworkUpdate(BaseModel):
+    price: Optional[int] = None
+    availability: Optional[str] = None
+
+@app.patch("/artworks/{artwork_id}", dependencies=[Depends(require_admin)])
+def update_artwork(artwork_id: str, update: ArtworkUpdate, chatbot: ArtGalleryChatbot = Depends(gallery_chatbot)):
+    """Change an artwork's price or availability; takes effect for the next /chat turn, no reload needed"""
+    changes = update.model_dump(exclude_none=True)
+    if not changes:
+        raise HTTPException(status_code=400, detail="Nothing to update: send price and/or availability")
+    if "price" in changes and changes["price"] <= 0:
+        raise HTTPException(status_code=400, detail="price must be positive")
+    if "availability" in changes and changes["availability"] not in AVAILABILITY:
+        raise HTTPException(status_code=400, detail=f"availability must be one of: {', '.join(AVAILABILITY)}")
+
+    artwork = chatbot.update_artwork(artwork_id, changes)
+    if artwork is None:
+        raise HTTPException(status_code=404, detail="Artwork not found")
+    return FastJSONResponse(chatbot.recommender.artwork_bytes(artwork))
+
+@app.get("/admin/prewarm", dependencies=[Depends(require_admin)])
+async def prewarm_status():
+    """Progress of the image pre-warm run and the catalog URLs found dead"""
+    return {**prewarmer.status(), "dead": prewarmer.dead}
+
+def _image_content_type(content_type: Optional[str], url: str) -> str:
+    """Upstream content type, or a guess from the URL when it isn't an image type"""
+    content_type = content_type or 'image/jpeg'
+    if content_type.startswith('image/'):
+        return content_type
+    if url.endswith('.jpg') or url.endswith('.jpeg'):
+        return 'image/jpeg'
+    elif url.endswith('.png'):
+        return 'image/png'
+    elif url.endswith('.webp'):
+        return 'image/webp'
+    return 'image/jpeg'  # Default to JPEG
+
+def _image_headers(etag: Optional[str], last_modified: Optional[str]) -> Dict[str, str]:
+    headers = {"Cache-Control": f"public, max-age={int(image_cache.ttl)}"}
+    if etag:
+        headers["ETag"] = etag
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+    return headers
+
+async def _binary_image_response(url: str, request: Request) -> Response:
+    """Serve image bytes directly: from the cache when possible, otherwise streamed from upstream"""
+    image = image_cache.lookup_fresh(url)
+    if image is None and image_cache.is_cached(url):
+        # Stale copy - a conditional revalidation is cheaper than a re-download
+        image = await image_cache.get(url, load_body=False)
+
+    if image is not None:
+        headers = _image_headers(image.etag, image.last_modified)
+        if is_not_modified(request.headers, image.etag, image.last_modified):
+            return not_modified(headers)
+        content_type = _image_content_type(image.content_type, url)
+        if image.body is not None:
+            return Response(content=image.body, media_type=content_type, headers=headers)
+        return FileResponse(image_cache.disk_path(image), media_type=content_type, headers=headers)
+
+    with span("proxy_fetch"):
+        stream = await image_cache.stream(url)
+    headers = _image_headers(stream.etag, stream.last_modified)
+    if stream.content_length is not None:
+        headers["Content-Length"] = str(stream.content_length)
+    return StreamingResponse(stream.chunks, media_type=_image_content_type(stream.content_type, url), headers=headers)
+
+async def _load_image(url: str, size: Optional[str] = None, fmt: str = "jpeg"):
+    """An image (or one of its derivatives) through the cache: (cache entry, bytes)"""
+    with span("proxy_fetch"):
+        if size:
+            entry, path = await derivatives.get(url, size, fmt)
+            return entry, await asyncio.to_thread(_read_file, path)
+        entry = await image_cache.get(url)
+        return entry, entry.body
+
+async def _image_data_url(url: str, size: Optional[str] = None, fmt: str = "jpeg") -> Dict[str, Any]:
+    """Load an image (or one of its derivatives) through the cache as a base64 data URL"""
+    entry, body = await _load_image(url, size, fmt)
+    return _data_url(entry, body, url)
+
+def _data_url(entry, body: bytes, url: str) -> Dict[str, Any]:
+    # Convert to base64
+    with span("proxy_encode"):
+        image_base64 = base64.b64encode(body).decode('utf-8')
+
+    content_type = _image_content_type(entry.content_type, url)
+
+    # Return as data URL
+    return {
+        "success": True,
+        "data_url": f"data:{content_type};base64,{image_base64}",
+        "content_type": content_type
+    }
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
 @app.get("/proxy-image")
-async def proxy_image(url: str):
-    """Proxy image requests to avoid CORS issues"""
+async def proxy_image(request: Request, url: str, mode: str = "json", size: Optional[str] = None, fmt: str = "jpeg"):
+    """Proxy image requests to avoid CORS issues.
+
+    mode=json (default) returns a base64 data URL; mode=binary returns the raw
+    image bytes with Content-Type, Content-Length and cache headers. With
+    size=thumb|card|pdf the image is downscaled and re-encoded as fmt=jpeg|webp.
+    Both modes answer If-None-Match / If-Modified-Since with 304.
+    """
     try:
-        # Set up headers to mimic a browser request
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Referer': 'https://www.metmuseum.org/',
-            'Connection': 'keep-alive',
-        }
+        if mode == "binary":
+            if size:
+                entry, path = await derivatives.get(url, size, fmt)
+                headers = _image_headers(entry.etag, None)
+                if is_not_modified(request.headers, entry.etag):
+                    return not_modified(headers)
+                return FileResponse(path, media_type=entry.content_type, headers=headers)
+            return await _binary_image_response(url, request)
 
-        async with httpx.AsyncClient(
-            timeout=60.0,  # Increased timeout
-            follow_redirects=True,  # Follow redirects
-            verify=True,  # Verify SSL certificates
-            headers=headers
-        ) as client:
-            # Fetch the image
-            response = await client.get(url)
-            response.raise_for_status()
-
-            # Convert to base64
-            image_base64 = base64.b64encode(response.content).decode('utf-8')
-
-            # Determine content type
-            content_type = response.headers.get('content-type', 'image/jpeg')
-
-            # If content type is not image, try to guess from URL
-            if not content_type.startswith('image/'):
-                if url.endswith('.jpg') or url.endswith('.jpeg'):
-                    content_type = 'image/jpeg'
-                elif url.endswith('.png'):
-                    content_type = 'image/png'
-                elif url.endswith('.webp'):
-                    content_type = 'image/webp'
-                else:
-                    content_type = 'image/jpeg'  # Default to JPEG
-
-            # Return as data URL
-            data_url = f"data:{content_type};base64,{image_base64}"
-
-            return {
-                "success": True,
-                "data_url": data_url,
-                "content_type": content_type
-            }
+        entry, body = await _load_image(url, size, fmt)
+        headers = _image_headers(entry.etag, entry.last_modified)
+        if is_not_modified(request.headers, entry.etag, entry.last_modified):
+            return not_modified(headers)
+        return FastJSONResponse(dumps(_data_url(entry, body, url)), headers=headers)
+    except DerivativeUnavailable as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except httpx.TimeoutException as e:
         raise HTTPException(status_code=504, detail=f"Image request timed out: {str(e)}")
     except httpx.HTTPError as e:
@@ -157,6 +552,85 @@ async def proxy_image(url: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
+class ImageBatchRequest(BaseModel):
+    urls: List[str]
+    size: Optional[str] = None
+    fmt: str = "jpeg"
+
+BATCH_MAX_URLS = int(os.getenv("BATCH_MAX_URLS", "50"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "6"))
+BATCH_ITEM_TIMEOUT = float(os.getenv("BATCH_ITEM_TIMEOUT", "20"))
+
+def _batch_error(e: Exception) -> str:
+    if isinstance(e, asyncio.TimeoutError):
+        return "Image request timed out"
+    if isinstance(e, httpx.HTTPError):
+        return f"Failed to fetch image: {str(e)}"
+    return f"Error processing image: {str(e)}"
+
+@app.post("/proxy-images")
+async def proxy_images(request: ImageBatchRequest):
+    """Fetch several images concurrently, streaming one NDJSON line per image as each finishes.
+
+    Each line is {"index", "url", "success", "data_url", "content_type"} or
+    {"index", "url", "success": false, "error"}; a final {"done": true, ...} line
+    closes the stream.
+    """
+    if not request.urls:
+        raise HTTPException(status_code=400, detail="No URLs given")
+    if len(request.urls) > BATCH_MAX_URLS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_URLS} URLs per batch")
+    if request.size:
+        try:
+            derivatives.validate(request.size, request.fmt)
+        except DerivativeUnavailable as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def load(index: int, url: str) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                result = await asyncio.wait_for(_image_data_url(url, request.size, request.fmt), BATCH_ITEM_TIMEOUT)
+                return {"index": index, "url": url, **result}
+            except Exception as e:
+                return {"index": index, "url": url, "success": False, "error": _batch_error(e)}
+
+    async def results():
+        tasks = [asyncio.ensure_future(load(i, url)) for i, url in enumerate(request.urls)]
+        succeeded = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                item = await next_done
+                succeeded += item["success"]
+                yield dumps(item) + b"\n"
+            yield dumps({"done": True, "total": len(tasks), "succeeded": succeeded}) + b"\n"
+        finally:
+            # Client went away - stop any fetches still running
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@app.get("/export/pdf")
+async def export_pdf(ids: str, chatbot: ArtGalleryChatbot = Depends(gallery_chatbot)):
+    """Download a PDF catalogue (cover page plus one page per artwork) for comma-separated artwork ids"""
+    artwork_ids = [i.strip() for i in ids.split(",") if i.strip()]
+    if not artwork_ids:
+        raise HTTPException(status_code=400, detail="No artwork ids given")
+    if len(artwork_ids) > PDF_MAX_ARTWORKS:
+        raise HTTPException(status_code=400, detail=f"At most {PDF_MAX_ARTWORKS} artworks per export")
+
+    artworks = [chatbot.recommender.get_artwork(i) for i in artwork_ids]
+    missing = [i for i, art in zip(artwork_ids, artworks) if art is None]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Unknown artwork ids: {', '.join(missing)}")
+
+    path = await pdf_exporter.export(artworks)
+    filename = "Canvas-Curator-AI-Artworks.pdf"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    return FileResponse(path, media_type="application/pdf", headers=headers)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
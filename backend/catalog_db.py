@@ -0,0 +1,238 @@
+"""
+SQLite storage for the artwork catalog
+
+The JSON catalog has to be rewritten whole for any change and loaded whole
+into memory. CatalogDB keeps the same artworks in SQLite (WAL mode, so the API
+keeps reading while an ingestion script writes):
+
+    artworks        one row per artwork: catalog position (the rowid), id,
+                    indexed price, availability and the full record as JSON
+    facets          each distinct (kind, value): style / color / mood
+    artwork_facets  artwork <-> facet links, indexed both ways
+
+query() pushes the recommender's filters down as SQL and returns matches in
+catalog order, so SQLiteArtworkRecommender gives the same results as the JSON
+backend. Build a database from a JSON (or JSON Lines) catalog with:
+
+    python catalog_db.py ../data/artworks.json ../data/artworks.db
+"""
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+CATALOG_DB = os.getenv("CATALOG_DB", "../data/artworks.db")
+
+# Artwork field -> facet kind
+FACET_FIELDS = {"style": "style", "colors": "color", "mood": "mood"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artworks (
+    pk INTEGER PRIMARY KEY,  -- catalog position
+    id TEXT NOT NULL UNIQUE,
+    price NUMERIC NOT NULL,
+    availability TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artworks_price ON artworks (price);
+CREATE TABLE IF NOT EXISTS facets (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    value_lower TEXT NOT NULL,
+    UNIQUE (kind, value)
+);
+CREATE INDEX IF NOT EXISTS facets_lookup ON facets (kind, value_lower);
+CREATE TABLE IF NOT EXISTS artwork_facets (
+    artwork_pk INTEGER NOT NULL REFERENCES artworks (pk) ON DELETE CASCADE,
+    facet_id INTEGER NOT NULL REFERENCES facets (id),
+    PRIMARY KEY (facet_id, artwork_pk)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS artwork_facets_artwork ON artwork_facets (artwork_pk);
+"""
+
+
+class CatalogDB:
+    """Artwork catalog in SQLite; one connection per thread"""
+
+    def __init__(self, path: str = CATALOG_DB):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _facet_ids(self, conn: sqlite3.Connection, artworks: List[Dict]) -> Dict[Tuple[str, str], int]:
+        values = {(kind, value) for art in artworks for field, kind in FACET_FIELDS.items() for value in art.get(field) or []}
+        conn.executemany("INSERT OR IGNORE INTO facets (kind, value, value_lower) VALUES (?, ?, ?)",
+                         [(kind, value, value.lower()) for kind, value in values])
+        return {(kind, value): facet_id for facet_id, kind, value in conn.execute("SELECT id, kind, value FROM facets")}
+
+    def _insert(self, conn: sqlite3.Connection, artworks: List[Dict], first_position: int):
+        facet_ids = self._facet_ids(conn, artworks)
+        conn.executemany(
+            "INSERT INTO artworks (pk, id, price, availability, data) VALUES (?, ?, ?, ?, ?)",
+            [(first_position + i, art["id"], art["price"], art.get("availability"), json.dumps(art, ensure_ascii=False))
+             for i, art in enumerate(artworks)],
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO artwork_facets (artwork_pk, facet_id) VALUES (?, ?)",
+            [(first_position + i, facet_ids[(kind, value)])
+             for i, art in enumerate(artworks) for field, kind in FACET_FIELDS.items() for value in art.get(field) or []],
+        )
+
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection):
+        # Called after the transaction's first write, so the read-modify-write runs under the write lock
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        conn.execute(f"PRAGMA user_version = {version + 1}")
+
+    def version(self) -> int:
+        """Bumped by every committed change to the catalog"""
+        return self._connect().execute("PRAGMA user_version").fetchone()[0]
+
+    def replace_all(self, artworks: Iterable[Dict], batch_size: int = 5000) -> int:
+        """Replace the whole catalog in one transaction; readers see the old catalog until it commits"""
+        conn = self._connect()
+        count = 0
+        with conn:
+            conn.execute("DELETE FROM artwork_facets")
+            conn.execute("DELETE FROM artworks")
+            conn.execute("DELETE FROM facets")
+            batch: List[Dict] = []
+            for art in artworks:
+                batch.append(art)
+                if len(batch) >= batch_size:
+                    self._insert(conn, batch, count)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self._insert(conn, batch, count)
+                count += len(batch)
+            self._bump_version(conn)
+        return count
+
+    def upsert_many(self, artworks: List[Dict]) -> int:
+        """Insert or replace artworks by id; new ones go to the end of the catalog, existing ones keep their place"""
+        if not artworks:
+            return 0
+        conn = self._connect()
+        with conn:
+            positions = {}
+            for art in artworks:
+                row = conn.execute("SELECT pk FROM artworks WHERE id = ?", (art["id"],)).fetchone()
+                if row is not None:
+                    positions[art["id"]] = row[0]
+                    conn.execute("DELETE FROM artworks WHERE pk = ?", (row[0],))
+            next_position = conn.execute("SELECT COALESCE(MAX(pk) + 1, 0) FROM artworks").fetchone()[0]
+            for art in artworks:
+                position = positions.get(art["id"])
+                if position is None:
+                    position = positions[art["id"]] = next_position
+                    next_position += 1
+                self._insert(conn, [art], position)
+            self._bump_version(conn)
+        return len(artworks)
+
+    def update(self, artwork_id: str, changes: Dict[str, Any]) -> Optional[Dict]:
+        """Set price and/or availability of one artwork by id; returns the updated artwork, None if unknown"""
+        columns = [field for field in ("price", "availability") if field in changes]
+        if not columns:
+            return self.get(artwork_id)
+        assignments = ", ".join(f"{field} = ?" for field in columns)
+        paths = ", ".join(f"'$.{field}', ?" for field in columns)
+        values = [changes[field] for field in columns]
+        conn = self._connect()
+        with conn:
+            updated = conn.execute(f"UPDATE artworks SET {assignments}, data = json_set(data, {paths}) WHERE id = ?",
+                                   [*values, *values, artwork_id]).rowcount
+            if updated:
+                self._bump_version(conn)
+        return self.get(artwork_id)
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM artworks").fetchone()[0]
+
+    def get(self, artwork_id: str) -> Optional[Dict]:
+        row = self._connect().execute("SELECT data FROM artworks WHERE id = ?", (artwork_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def all(self) -> List[Dict]:
+        return [json.loads(data) for data, in self._connect().execute("SELECT data FROM artworks ORDER BY pk")]
+
+    def query(self, filters: Dict[str, Any]) -> List[Dict]:
+        """Artworks matching the recommender filters, in catalog order.
+
+        Mirrors ArtworkRecommender.filter_artworks: style and mood match as
+        case-insensitive substrings, colors as any case-insensitive exact
+        match, prices inclusively; falsy filters are ignored. Works that
+        aren't available are never returned.
+        """
+        where, params = ["(a.availability IS NULL OR a.availability = 'available')"], []
+
+        def facet(kind: str, condition: str, values: List[str]):
+            where.append("a.pk IN (SELECT af.artwork_pk FROM artwork_facets af WHERE af.facet_id IN "
+                         f"(SELECT id FROM facets WHERE kind = ? AND {condition}))")
+            params.extend([kind, *values])
+
+        if filters.get('style'):
+            facet("style", "instr(value_lower, ?) > 0", [filters['style'].lower()])
+        if filters.get('colors'):
+            colors = [c.lower() for c in filters['colors']]
+            facet("color", f"value_lower IN ({','.join('?' * len(colors))})", colors)
+        if filters.get('mood'):
+            facet("mood", "instr(value_lower, ?) > 0", [filters['mood'].lower()])
+        if filters.get('max_price'):
+            where.append("a.price <= ?")
+            params.append(filters['max_price'])
+        if filters.get('min_price'):
+            where.append("a.price >= ?")
+            params.append(filters['min_price'])
+
+        sql = "SELECT a.data FROM artworks a WHERE " + " AND ".join(where) + " ORDER BY a.pk"
+        return [json.loads(data) for data, in self._connect().execute(sql, params)]
+
+    def facet_values(self, kind: str) -> List[str]:
+        """Distinct values of one facet kind that are used by at least one artwork"""
+        return [value for value, in self._connect().execute(
+            "SELECT DISTINCT f.value FROM facets f JOIN artwork_facets af ON af.facet_id = f.id WHERE f.kind = ?", (kind,)
+        )]
+
+    def price_range(self) -> Tuple[Any, Any]:
+        """Cheapest and dearest available artwork, read from each end of the price index"""
+        conn = self._connect()
+        available = "availability IS NULL OR availability = 'available'"
+        cheapest = conn.execute(f"SELECT price FROM artworks WHERE {available} ORDER BY price LIMIT 1").fetchone()
+        dearest = conn.execute(f"SELECT price FROM artworks WHERE {available} ORDER BY price DESC LIMIT 1").fetchone()
+        return (cheapest[0] if cheapest else None, dearest[0] if dearest else None)
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Load a JSON or JSON Lines catalog into the SQLite catalog store")
+    parser.add_argument("artworks", nargs="?", default="../data/artworks.json")
+    parser.add_argument("db", nargs="?", default=CATALOG_DB)
+    args = parser.parse_args()
+
+    from catalog_io import iter_catalog
+
+    started = time.time()
+    count = CatalogDB(args.db).replace_all(iter_catalog(args.artworks))
+    print(f"✓ Loaded {count} artworks into {args.db} in {time.time() - started:.2f}s")
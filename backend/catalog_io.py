@@ -0,0 +1,337 @@
+"""
+Streaming, atomically published catalog files
+
+CatalogWriter writes artworks one at a time to a temp file next to the
+catalog, then publishes it with fsync + rename, so a reader never sees a
+half-written catalog and the writer never holds the whole catalog in memory.
+The format follows the extension: ".jsonl" is one artwork per line, anything
+else is the usual indented JSON array (byte-for-byte what json.dump(indent=2)
+writes). After each publish a manifest next to the catalog records its
+version, count and checksum:
+
+    data/artworks.json           the catalog
+    data/artworks.json.manifest  {"version": 7, "count": 23, "sha256": "...", ...}
+
+iter_catalog() reads either format back one artwork at a time. Price and
+availability changes made through the API are appended to
+<catalog>.updates (CatalogUpdates) and replayed over the catalog on load.
+Publishing a catalog folds the log into it and empties the log.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import textwrap
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+CATALOG_PATH = os.getenv("CATALOG_PATH", "../data/artworks.json")
+
+
+def manifest_path(path: str) -> str:
+    return f"{path}.manifest"
+
+
+def read_manifest(path: str) -> Optional[Dict]:
+    """The manifest of the catalog at `path`, or None if it has never been published with one"""
+    try:
+        with open(manifest_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _fsync_dir(path: str):
+    # Make the rename itself durable; not every platform can open a directory
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class CatalogWriter:
+    """Appends artworks to a temp file and publishes them atomically as the catalog at `path`.
+
+        with CatalogWriter("../data/artworks.json") as writer:
+            for artwork in artworks:
+                writer.write(artwork)
+        # published on a clean exit, discarded if the block raised
+
+    Changes logged through the API (CatalogUpdates) are applied to the
+    artworks as they are written, and the log is emptied on publish, so it
+    never outlives the catalog it was made against. Changes logged while
+    the catalog is being written are kept and replayed over it.
+    """
+
+    def __init__(self, path: str = CATALOG_PATH):
+        self.path = path
+        self.jsonl = path.endswith(".jsonl")
+        self.tmp_path = f"{path}.tmp"
+        self.count = 0
+        self.folded = 0
+        self.version: Optional[int] = None
+        self._sha = hashlib.sha256()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.updates = CatalogUpdates(path)
+        self._changes = self.updates.load()
+        self._file = open(self.tmp_path, "wb")
+        if not self.jsonl:
+            self._emit("[")
+
+    def _emit(self, text: str):
+        data = text.encode("utf-8")
+        self._sha.update(data)
+        self._file.write(data)
+
+    def write(self, artwork: Dict):
+        if artwork.get("id") in self._changes:
+            artwork = {**artwork, **self._changes[artwork["id"]]}
+            self.folded += 1
+        if self.jsonl:
+            self._emit(json.dumps(artwork, ensure_ascii=False) + "\n")
+        else:
+            separator = "\n" if self.count == 0 else ",\n"
+            self._emit(separator + textwrap.indent(json.dumps(artwork, indent=2, ensure_ascii=False), "  "))
+        self.count += 1
+
+    def publish(self) -> Dict:
+        """fsync and rename the temp file over the catalog, then write the manifest; returns the manifest"""
+        if not self.jsonl:
+            self._emit("\n]" if self.count else "]")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        # Locked so no API change lands between the rename and emptying the log
+        with self.updates.locked():
+            os.replace(self.tmp_path, self.path)
+            _fsync_dir(self.path)
+            self.updates.reset()
+
+        previous = read_manifest(self.path) or {}
+        manifest = {
+            "version": previous.get("version", 0) + 1,
+            "file": os.path.basename(self.path),
+            "format": "jsonl" if self.jsonl else "json",
+            "count": self.count,
+            "sha256": self._sha.hexdigest(),
+            "bytes": os.path.getsize(self.path),
+            "updates_folded": self.folded,
+            "published_at": time.time(),
+        }
+        tmp_manifest = f"{manifest_path(self.path)}.tmp"
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_manifest, manifest_path(self.path))
+        _fsync_dir(self.path)
+        self.version = manifest["version"]
+        return manifest
+
+    def abort(self):
+        """Discard everything written; the published catalog is untouched"""
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self) -> "CatalogWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.publish()
+        else:
+            self.abort()
+
+
+def write_catalog(path: str, artworks) -> Dict:
+    """Publish an iterable of artworks as the catalog at `path`; returns the manifest"""
+    writer = CatalogWriter(path)
+    try:
+        for artwork in artworks:
+            writer.write(artwork)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.publish()
+
+
+class CatalogReader:
+    """Iterates a catalog (JSON Lines or JSON array) one artwork at a time, checksumming what it reads"""
+
+    def __init__(self, path: str = CATALOG_PATH):
+        self.path = path
+        self.sha256: Optional[str] = None
+
+    def __iter__(self) -> Iterator[Dict]:
+        sha = hashlib.sha256()
+        if self.path.endswith(".jsonl"):
+            with open(self.path, "rb") as f:
+                for line in f:
+                    sha.update(line)
+                    if line.strip():
+                        yield json.loads(line)
+        else:
+            with open(self.path, "rb") as f:
+                data = f.read()
+            sha.update(data)
+            yield from json.loads(data)
+        self.sha256 = sha.hexdigest()
+
+    def version(self) -> str:
+        """The manifest version if the manifest describes what was read, else a checksum prefix.
+
+        Only valid once the reader has been iterated to the end.
+        """
+        manifest = read_manifest(self.path)
+        if manifest is not None and manifest.get("sha256") == self.sha256:
+            return str(manifest["version"])
+        return f"sha-{self.sha256[:12]}"
+
+
+def iter_catalog(path: str = CATALOG_PATH) -> Iterator[Dict]:
+    """Artworks of the catalog at `path`, one at a time"""
+    return iter(CatalogReader(path))
+
+
+def updates_path(path: str) -> str:
+    return f"{path}.updates"
+
+
+class CatalogUpdates:
+    """Append-only JSONL of price / availability changes made through the API, replayed over the catalog on load.
+
+    One {"id", <changed fields>, "at"} per line; later lines win. A line cut
+    off by a crash is dropped on the next load. Several processes can share
+    one log (see serve.py): writers hold an flock, and each process picks up
+    the others' lines with read_new(). CatalogWriter.publish() replaces the
+    log with the lines it could not fold; a process notices by the inode and
+    reads the new log from the start.
+    """
+
+    def __init__(self, catalog_path: str = CATALOG_PATH):
+        self.path = updates_path(catalog_path)
+        self.count = 0
+        self.offset = 0  # bytes of the log applied so far
+        self._inode: Optional[int] = None
+        self._file = None
+
+    def _current_inode(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_ino
+        except OSError:
+            return None
+
+    @contextmanager
+    def locked(self):
+        """Exclusive lock on the log across processes"""
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def load(self) -> Dict[str, Dict]:
+        """artwork id -> the fields changed since the catalog was published, merged in order"""
+        changes: Dict[str, Dict] = {}
+        self.count = self.offset = 0
+        if not os.path.exists(self.path):
+            return changes
+        with self.locked():
+            good_bytes = 0
+            with open(self.path, "rb") as f:
+                self._inode = os.fstat(f.fileno()).st_ino
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    good_bytes += len(line)
+                    self.count += 1
+                    entry.pop("at", None)
+                    changes.setdefault(entry.pop("id"), {}).update(entry)
+            if good_bytes < os.path.getsize(self.path):
+                with open(self.path, "r+b") as f:
+                    f.truncate(good_bytes)
+            self.offset = good_bytes
+        return changes
+
+    def has_new(self) -> bool:
+        """Whether the log has grown or been replaced since we last read or wrote it (one stat)"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return stat.st_ino != self._inode or stat.st_size > self.offset
+
+    def read_new(self) -> List[Tuple[str, Dict]]:
+        """(artwork id, changes) for each complete line appended since we last read or wrote the log"""
+        if not self.has_new():
+            return []
+        with open(self.path, "rb") as f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self._inode:
+                self._inode, self.offset = inode, 0
+            f.seek(self.offset)
+            data = f.read()
+        entries = []
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break  # still being written
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            self.offset += len(line)
+            self.count += 1
+            entry.pop("at", None)
+            entries.append((entry.pop("id"), entry))
+        return entries
+
+    def record(self, artwork_id: str, changes: Dict):
+        """Append a change. With other writers, call read_new() and record() under locked()"""
+        if self._file is None or os.fstat(self._file.fileno()).st_ino != self._current_inode():
+            self.close()
+            self._file = open(self.path, "ab")
+            self._inode = os.fstat(self._file.fileno()).st_ino
+        line = json.dumps({"id": artwork_id, **changes, "at": time.time()}, ensure_ascii=False) + "\n"
+        self._file.write(line.encode("utf-8"))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.offset = self._file.tell()
+        self.count += 1
+
+    def reset(self):
+        """Replace the log with the lines appended since load(), the ones a publish could not fold.
+
+        Call under locked().
+        """
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                remaining = f.read()
+        except FileNotFoundError:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(remaining)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        _fsync_dir(self.path)
+        self.close()
+        self.count = self.offset = 0
+        self._inode = None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -1,22 +1,330 @@
 import json
+import os
+import re
+import threading
+import time
 import requests
-from typing import List, Dict, Any
-from recommender import ArtworkRecommender
+from typing import List, Dict, Any, Callable, Iterator, Optional
+from catalog_io import CATALOG_PATH
+from recommender import create_recommender
+from ratelimit import TokenBucket
+from metrics import span
+from serialization import dumps
+from http_cache import make_etag
+
+GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={api_key}"
+
+# Gateway tuning - defaults match the Gemini free-tier quota (10 requests/minute)
+LLM_RATE_PER_MINUTE = float(os.getenv("LLM_RATE_PER_MINUTE", "10"))
+LLM_BURST = float(os.getenv("LLM_BURST", "3"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "20"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "8"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "20"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+
+class LLMUnavailable(Exception):
+    """Raised when the gateway sheds a call or the upstream call fails"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """Opens after consecutive upstream failures, lets one probe through after a cooldown"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_count = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream right now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def cancel_probe(self):
+        """Release a half-open probe slot that never reached upstream"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.open_count += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class LLMGateway:
+    """Shared admission control for Gemini calls.
+
+    Calls take a token from a bucket sized to the API quota. Callers that can't
+    get one immediately wait in a bounded queue until their deadline; when the
+    queue is full, the deadline passes or the circuit breaker is open the call is
+    shed with LLMUnavailable so the chatbot can degrade instead of failing.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        rate_per_minute: float = LLM_RATE_PER_MINUTE,
+        burst: float = LLM_BURST,
+        max_queue: int = LLM_MAX_QUEUE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+        request_timeout: float = LLM_REQUEST_TIMEOUT,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.api_url = api_url
+        # Same model and key, streamed as server-sent events
+        self.stream_url = api_url.replace(":generateContent?", ":streamGenerateContent?alt=sse&")
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.breaker = breaker or CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN)
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.counters = {
+            "requests": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "shed_breaker_open": 0,
+            "shed_queue_full": 0,
+            "shed_deadline": 0,
+            "fallbacks": 0,
+        }
+
+    def record_fallback(self):
+        """Count a turn answered by the rule-based flow"""
+        self._count("fallbacks")
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _admit(self, deadline: float):
+        """Wait for a rate-limit token, or raise LLMUnavailable"""
+        if not self.breaker.allow():
+            self._count("shed_breaker_open")
+            raise LLMUnavailable("circuit open")
+
+        # Fast path - a token is free, no queueing
+        if self.bucket.try_acquire() == 0.0:
+            return
+
+        with self._lock:
+            if self.queue_depth >= self.max_queue:
+                self.counters["shed_queue_full"] += 1
+                admitted = False
+            else:
+                self.queue_depth += 1
+                admitted = True
+        if not admitted:
+            self.breaker.cancel_probe()
+            raise LLMUnavailable("queue full")
+
+        try:
+            got_token = self.bucket.acquire(timeout=max(0.0, deadline - time.monotonic()))
+        finally:
+            with self._lock:
+                self.queue_depth -= 1
+        if not got_token:
+            self._count("shed_deadline")
+            self.breaker.cancel_probe()
+            raise LLMUnavailable("deadline exceeded")
+
+    def generate(self, prompt: str, deadline: Optional[float] = None) -> str:
+        """Send a prompt to Gemini through admission control and return the reply text"""
+        if deadline is None:
+            deadline = time.monotonic() + self.queue_timeout
+        self._count("requests")
+        self._admit(deadline)
+
+        payload = self._payload(prompt)
+
+        with self._lock:
+            self.in_flight += 1
+        try:
+            response = self.session.post(
+                self.api_url,
+                json=payload,
+                headers={"Content-Type": "application/json"},
+                timeout=self.request_timeout,
+            )
+            if response.status_code == 429 or response.status_code >= 500:
+                raise LLMUnavailable(f"upstream status {response.status_code}")
+            response.raise_for_status()
+            data = response.json()
+        except LLMUnavailable:
+            self.breaker.record_failure()
+            self._count("failed")
+            raise
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            self._count("failed")
+            raise LLMUnavailable(f"upstream error: {e}")
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+        self.breaker.record_success()
+        self._count("succeeded")
+
+        # A safety-blocked or empty candidate comes back without content/parts
+        for candidate in data.get('candidates', [])[:1]:
+            text = "".join(part.get('text', '') for part in candidate.get('content', {}).get('parts', []))
+            if text:
+                return text
+        return "I apologize, but I couldn't process that. Could you rephrase?"
+
+    def generate_stream(self, prompt: str, deadline: Optional[float] = None) -> Iterator[str]:
+        """Like generate, but yields the reply text in pieces as Gemini produces them.
+
+        Admission happens before the first piece. An upstream failure raises
+        LLMUnavailable, possibly after some pieces have been yielded.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.queue_timeout
+        self._count("requests")
+        self._admit(deadline)
+
+        with self._lock:
+            self.in_flight += 1
+        produced = False
+        try:
+            try:
+                response = self.session.post(
+                    self.stream_url,
+                    json=self._payload(prompt),
+                    headers={"Content-Type": "application/json"},
+                    timeout=self.request_timeout,
+                    stream=True,
+                )
+                with response:
+                    if response.status_code == 429 or response.status_code >= 500:
+                        raise LLMUnavailable(f"upstream status {response.status_code}")
+                    response.raise_for_status()
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith("data:"):
+                            continue
+                        for candidate in json.loads(line[5:]).get("candidates", [])[:1]:
+                            for part in candidate.get("content", {}).get("parts", []):
+                                if part.get("text"):
+                                    produced = True
+                                    yield part["text"]
+            except (requests.RequestException, ValueError) as e:
+                raise LLMUnavailable(f"upstream error: {e}")
+        except LLMUnavailable:
+            self.breaker.record_failure()
+            self._count("failed")
+            raise
+        except GeneratorExit:
+            # The consumer stopped reading; that says nothing about upstream health
+            self.breaker.cancel_probe()
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+        self.breaker.record_success()
+        self._count("succeeded")
+        if not produced:
+            yield "I apologize, but I couldn't process that. Could you rephrase?"
+
+    @staticmethod
+    def _payload(prompt: str) -> Dict[str, Any]:
+        return {
+            "contents": [{
+                "parts": [{
+                    "text": prompt
+                }]
+            }]
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, shed counts and breaker state"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats["queue_depth"] = self.queue_depth
+            stats["in_flight"] = self.in_flight
+        stats["max_queue"] = self.max_queue
+        stats["shed_total"] = stats["shed_breaker_open"] + stats["shed_queue_full"] + stats["shed_deadline"]
+        stats["breaker_state"] = self.breaker.state
+        stats["breaker_opened_total"] = self.breaker.open_count
+        stats["tokens_available"] = round(self.bucket.available, 2)
+        return stats
+
 
 class ArtGalleryChatbot:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, gateway: Optional[LLMGateway] = None, artworks_path: str = CATALOG_PATH,
+                 db_path: Optional[str] = None):
         self.api_key = api_key
-        self.api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={api_key}"
-        self.recommender = ArtworkRecommender()
-        self.available_filters = self.recommender.get_available_filters()
+        self.api_url = GEMINI_URL.format(api_key=api_key)
+        self.gateway = gateway or LLMGateway(self.api_url)
+        self.recommender = create_recommender(artworks_path, db_path)
+        self._load_filters()
+
+    def reload_catalog(self) -> int:
+        """Re-read the catalog and rebuild the filters and system prompt; returns the artwork count"""
+        self.recommender.reload()
+        self._load_filters()
+        return self.recommender.count()
+
+    def update_artwork(self, artwork_id: str, changes: Dict[str, Any]) -> Optional[Dict]:
+        """Change one artwork's price/availability; the system prompt is rebuilt only if the price range moved"""
+        artwork = self.recommender.update_artwork(artwork_id, changes)
+        if artwork is not None:
+            price_range = self.recommender.get_available_filters()['price_range']
+            if price_range != self.available_filters['price_range']:
+                self._load_filters()
+        return artwork
+
+    def sync_updates(self):
+        """Pick up price/availability changes other worker processes made (see serve.py)"""
+        if self.recommender.sync_updates():
+            if self.recommender.get_available_filters()['price_range'] != self.available_filters['price_range']:
+                self._load_filters()
+
+    def _load_filters(self):
+        available_filters = self.recommender.get_available_filters()
 
         # Get price range
-        price_range = self.available_filters.get('price_range', {})
+        price_range = available_filters.get('price_range', {})
         min_lakhs = price_range.get('min_lakhs', 2.5)
         max_lakhs = price_range.get('max_lakhs', 4.9)
 
         # System prompt
-        self.system_prompt = f"""You are an art gallery assistant helping buyers discover artwork through natural conversation.
+        system_prompt = f"""You are an art gallery assistant helping buyers discover artwork through natural conversation.
 
 CRITICAL RULE - FOLLOW THIS STRICTLY:
 ⚠️ YOU MUST ASK ONLY ONE QUESTION PER RESPONSE ⚠️
@@ -88,9 +396,9 @@ Always mention our price range in the question. Use this format:
 "Do you have a budget in mind? (We have artworks ranging from ₹{min_lakhs} lakhs to ₹{max_lakhs} lakhs)"
 
 Available options:
-- Styles: {', '.join(self.available_filters['styles'])}
-- Colors: {', '.join(self.available_filters['colors'])}
-- Moods: {', '.join(self.available_filters['moods'])}
+- Styles: {', '.join(available_filters['styles'])}
+- Colors: {', '.join(available_filters['colors'])}
+- Moods: {', '.join(available_filters['moods'])}
 - Price Range: ₹{min_lakhs} lakhs to ₹{max_lakhs} lakhs
 
 When ready to recommend, respond with JSON ONLY (no additional text):
@@ -98,71 +406,167 @@ For "classical" style, use one of: Renaissance, Baroque, or Rococo
 Example: {{"action": "recommend", "filters": {{"max_price": 500000, "style": "Renaissance", "colors": ["brown"]}}}}
 
 Otherwise, continue conversation naturally and ask about preferences."""
+        self.available_filters, self.system_prompt = available_filters, system_prompt
+        # Served as-is by /filters and /greeting until the filters change again
+        self.filters_json, self.greeting_json = dumps(available_filters), dumps({"message": self.get_greeting()})
+        self.filters_etag = make_etag(self.filters_json, self.recommender.version)
+        self.greeting_etag = make_etag(self.greeting_json)
 
     def call_gemini(self, prompt: str) -> str:
-        """Call Gemini API directly via REST"""
-        payload = {
-            "contents": [{
-                "parts": [{
-                    "text": prompt
-                }]
-            }]
-        }
-
+        """Call Gemini through the shared gateway; raises LLMUnavailable when shed"""
+        return self.gateway.generate(prompt)
+
+    def stream_gemini(self, prompt: str, on_token: Callable[[str], None]) -> str:
+        """Call Gemini with a streamed reply, passing conversational text to on_token as it arrives.
+
+        A reply that opens with JSON is a recommend action, not text for the
+        buyer, so nothing of it is passed on. Returns the whole reply.
+        """
+        parts: List[str] = []
+        forward: Optional[bool] = None
+        for piece in self.gateway.generate_stream(prompt):
+            parts.append(piece)
+            if forward is None:
+                head = "".join(parts).lstrip()
+                if not head:
+                    continue
+                forward = not head.startswith(("{", "`"))
+                if forward:
+                    on_token("".join(parts))
+            elif forward:
+                on_token(piece)
+        return "".join(parts)
+
+    def extract_intent(self, messages: List[Dict], on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """Analyze conversation and extract user intent/preferences.
+
+        With on_token the reply is streamed and its text passed on as it
+        arrives; the returned message is always the complete one.
+        """
+
+        with span("build_prompt"):
+            # Build conversation context with system prompt
+            conversation_parts = [self.system_prompt, ""]
+
+            for msg in messages:
+                role = "User" if msg['role'] == 'user' else "Assistant"
+                conversation_parts.append(f"{role}: {msg['content']}")
+
+            # Add instruction for next response
+            conversation_parts.append("\nAssistant:")
+
+            full_prompt = "\n".join(conversation_parts)
+
+        # Generate response, degrading to local slot filling when the LLM is unavailable
         try:
-            response = requests.post(self.api_url, json=payload, headers={"Content-Type": "application/json"})
-            response.raise_for_status()
-            data = response.json()
-
-            if 'candidates' in data and len(data['candidates']) > 0:
-                return data['candidates'][0]['content']['parts'][0]['text']
-            else:
-                return "I apologize, but I couldn't process that. Could you rephrase?"
-
-        except Exception as e:
-            print(f"Error calling Gemini API: {e}")
-            return "I'm having trouble connecting. Please try again."
-
-    def extract_intent(self, messages: List[Dict]) -> Dict[str, Any]:
-        """Analyze conversation and extract user intent/preferences"""
-
-        # Build conversation context with system prompt
-        conversation_parts = [self.system_prompt, ""]
-
-        for msg in messages:
-            role = "User" if msg['role'] == 'user' else "Assistant"
-            conversation_parts.append(f"{role}: {msg['content']}")
-
-        # Add instruction for next response
-        conversation_parts.append("\nAssistant:")
-
-        full_prompt = "\n".join(conversation_parts)
-
-        # Generate response
-        assistant_message = self.call_gemini(full_prompt)
+            with span("llm_call"):
+                if on_token is not None:
+                    assistant_message = self.stream_gemini(full_prompt, on_token)
+                else:
+                    assistant_message = self.call_gemini(full_prompt)
+        except LLMUnavailable as e:
+            print(f"Gemini unavailable ({e.reason}), using rule-based flow")
+            self.gateway.record_fallback()
+            with span("fallback_intent"):
+                return self.fallback_intent(messages)
 
         # Check if it's time to recommend
         if '"action": "recommend"' in assistant_message or '{"action": "recommend"' in assistant_message:
-            try:
-                # Extract JSON from response
-                json_start = assistant_message.find('{')
-                json_end = assistant_message.rfind('}') + 1
-                json_str = assistant_message[json_start:json_end]
-                data = json.loads(json_str)
+            with span("parse_intent"):
+                try:
+                    # Extract JSON from response
+                    json_start = assistant_message.find('{')
+                    json_end = assistant_message.rfind('}') + 1
+                    json_str = assistant_message[json_start:json_end]
+                    data = json.loads(json_str)
+
+                    return {
+                        'action': 'recommend',
+                        'filters': data.get('filters', {}),
+                        'message': "Let me find the perfect artworks for you!"
+                    }
+                except Exception as e:
+                    print(f"Error parsing JSON: {e}")
+                    print(f"Response: {assistant_message}")
+                    pass
+
+        return {
+            'action': 'continue',
+            'message': assistant_message
+        }
 
+    def _parse_budget(self, text: str) -> Optional[int]:
+        """Parse a budget such as "under 3 lakhs", "2.5L", "300k" or "3,00,000" into rupees"""
+        text = text.lower().replace(',', '')
+        match = re.search(r'(\d+(?:\.\d+)?)\s*(lakhs?|lacs?|l\b|k\b|thousand)?', text)
+        if not match:
+            return None
+        amount = float(match.group(1))
+        unit = match.group(2) or ''
+        if unit.startswith('la') or unit == 'l':
+            amount *= 100000
+        elif unit in ('k', 'thousand'):
+            amount *= 1000
+        elif amount < 100:
+            # A bare small number in a budget answer means lakhs
+            amount *= 100000
+        return int(amount)
+
+    def fallback_intent(self, messages: List[Dict]) -> Dict[str, Any]:
+        """Rule-based slot filling used when Gemini is unavailable.
+
+        Follows the same style -> colors -> budget flow as the system prompt. A
+        slot that was asked about but not answered counts as "no preference".
+        """
+        user_text = [m['content'].lower() for m in messages if m['role'] == 'user']
+        asked = " ".join(m['content'].lower() for m in messages if m['role'] != 'user')
+        all_text = " ".join(user_text)
+
+        filters: Dict[str, Any] = {}
+
+        for style in self.available_filters['styles']:
+            if re.search(r'\b' + re.escape(style.lower()) + r'\b', all_text):
+                filters['style'] = style
+                break
+        if 'style' not in filters and re.search(r'\bclassic(al)?\b', all_text):
+            filters['style'] = 'Renaissance'
+
+        colors = [c for c in self.available_filters['colors'] if re.search(r'\b' + re.escape(c.lower()) + r'\b', all_text)]
+        if colors:
+            filters['colors'] = colors
+
+        for mood in self.available_filters['moods']:
+            if re.search(r'\b' + re.escape(mood.lower()) + r'\b', all_text):
+                filters['mood'] = mood
+                break
+
+        budget_asked = 'budget' in asked
+        for text in reversed(user_text):
+            if budget_asked or re.search(r'lakh|lac|budget|under|below|₹|\brs\b', text):
+                budget = self._parse_budget(text)
+                if budget:
+                    filters['max_price'] = budget
+                    break
+
+        wants_results = bool(user_text) and re.search(r'\b(show|recommend|suggest|anything)\b', user_text[-1])
+
+        if not wants_results:
+            if 'style' not in filters and 'style' not in asked:
+                return {'action': 'continue', 'message': self.get_greeting()}
+            if 'colors' not in filters and 'color' not in asked:
+                return {'action': 'continue', 'message': "Lovely! What colors would you like in the artwork?"}
+            if 'max_price' not in filters and not budget_asked:
+                price_range = self.available_filters.get('price_range', {})
                 return {
-                    'action': 'recommend',
-                    'filters': data.get('filters', {}),
-                    'message': "Let me find the perfect artworks for you!"
+                    'action': 'continue',
+                    'message': f"Do you have a budget in mind? (We have artworks ranging from ₹{price_range.get('min_lakhs', 2.5)} lakhs to ₹{price_range.get('max_lakhs', 4.9)} lakhs)"
                 }
-            except Exception as e:
-                print(f"Error parsing JSON: {e}")
-                print(f"Response: {assistant_message}")
-                pass
 
+        filters.setdefault('max_price', 700000)
         return {
-            'action': 'continue',
-            'message': assistant_message
+            'action': 'recommend',
+            'filters': filters,
+            'message': "Let me find the perfect artworks for you!"
         }
 
     def format_artwork_response(self, artworks: List[Dict], filters: Dict) -> str:
@@ -195,8 +599,7 @@ Otherwise, continue conversation naturally and ask about preferences."""
                     return f"I couldn't find artworks with all your preferences ({criteria_str}). Would you like to see artworks that match some of your criteria, or would you like to adjust your preferences?"
                 else:
                     # Check if it's a price issue
-                    min_price = min(art['price'] for art in self.recommender.artworks)
-                    max_price_all = max(art['price'] for art in self.recommender.artworks)
+                    min_price = self.available_filters['price_range']['min']
 
                     if filters.get('max_price') and filters['max_price'] < min_price:
                         return f"I apologize, but we don't have artworks under ₹{filters['max_price']:,}. Our most affordable piece is ₹{min_price:,}. Would you like to see artworks in a different price range?"
@@ -208,19 +611,22 @@ Otherwise, continue conversation naturally and ask about preferences."""
         # Simple message when artworks are found - details shown in cards
         return f"Here are {len(artworks)} stunning artworks that match your preferences! Feel free to explore them below."
 
-    def chat(self, messages: List[Dict]) -> Dict[str, Any]:
-        """Process chat message and return response"""
+    def chat(self, messages: List[Dict], on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """Process chat message and return response; on_token receives reply text as it streams in"""
 
         # Extract intent
-        intent = self.extract_intent(messages)
+        intent = self.extract_intent(messages, on_token)
 
         if intent['action'] == 'recommend':
             # Get recommendations
             artworks = self.recommender.recommend(intent['filters'], limit=5)
 
+            with span("format_response"):
+                message = self.format_artwork_response(artworks, intent['filters'])
+
             return {
                 'type': 'recommendation',
-                'message': self.format_artwork_response(artworks, intent['filters']),
+                'message': message,
                 'artworks': artworks,
                 'filters': intent['filters']
             }
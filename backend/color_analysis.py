@@ -0,0 +1,244 @@
+"""
+Dominant colors from the artwork images themselves
+
+fetch_artworks.py guesses colors from words in the title and medium, and
+Gemini only ever sees the title. This module looks at the pixels instead:
+each image is decoded at a reduced size, its pixels are clustered with
+k-means in CIE Lab (vectorized in NumPy), and every cluster centre is mapped
+to the nearest named color of the catalog vocabulary. A color's weight is the
+share of pixels in its clusters. Images are analysed in a process pool, so a
+catalog of thousands of cached images is tagged in minutes with no API calls.
+
+    python color_analysis.py --input ../data/artworks.json --output ../data/artworks.json
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from catalog_io import iter_catalog, write_catalog
+from image_derivatives import IMAGE_WORKERS, pillow_available
+
+COLOR_SAMPLE_EDGE = int(os.getenv("COLOR_SAMPLE_EDGE", "96"))
+COLOR_CLUSTERS = int(os.getenv("COLOR_CLUSTERS", "6"))
+COLOR_ITERATIONS = int(os.getenv("COLOR_ITERATIONS", "12"))
+COLOR_MIN_WEIGHT = float(os.getenv("COLOR_MIN_WEIGHT", "0.08"))
+COLOR_MAX_TAGS = int(os.getenv("COLOR_MAX_TAGS", "4"))
+
+# Catalog color vocabulary -> reference sRGB
+PALETTE = {
+    "red": (180, 40, 40),
+    "coral": (240, 128, 100),
+    "orange": (225, 120, 40),
+    "ochre": (200, 140, 50),
+    "gold": (212, 175, 55),
+    "yellow": (235, 210, 70),
+    "olive": (120, 115, 50),
+    "green": (60, 140, 70),
+    "dark green": (30, 70, 40),
+    "teal": (30, 120, 120),
+    "turquoise": (70, 190, 190),
+    "blue": (50, 90, 170),
+    "lavender": (180, 160, 210),
+    "purple": (110, 60, 130),
+    "pink": (225, 150, 170),
+    "brown": (110, 70, 40),
+    "sepia": (112, 66, 20),
+    "tan": (190, 150, 110),
+    "beige": (220, 205, 175),
+    "cream": (245, 235, 210),
+    "white": (245, 245, 245),
+    "gray": (128, 128, 128),
+    "charcoal": (60, 60, 60),
+    "black": (15, 15, 15),
+}
+
+
+class ColorAnalysisUnavailable(Exception):
+    """Pillow is not installed"""
+
+
+def _rgb_to_lab(rgb):
+    """sRGB (..., 3) in 0-255 -> CIE Lab (D65), where Euclidean distance tracks perceived difference"""
+    c = rgb / 255.0
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = c @ np.array([[0.4124, 0.2126, 0.0193],
+                        [0.3576, 0.7152, 0.1192],
+                        [0.1805, 0.0722, 0.9505]], dtype=c.dtype)
+    xyz = xyz / np.array([0.95047, 1.0, 1.08883], dtype=c.dtype)
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def _kmeans(points, k: int, iterations: int):
+    """Lloyd's k-means with k-means++ seeding over an (n, 3) array; returns (centres, labels)"""
+    rng = np.random.default_rng(0)
+    centres = [points[rng.integers(len(points))]]
+    closest = ((points - centres[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        if closest.sum() == 0:
+            break  # fewer distinct colors than clusters
+        centres.append(points[rng.choice(len(points), p=closest / closest.sum())])
+        closest = np.minimum(closest, ((points - centres[-1]) ** 2).sum(axis=1))
+    centres = np.array(centres)
+
+    for _ in range(iterations):
+        distances = ((points[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2)
+        labels = distances.argmin(axis=1)
+        counts = np.bincount(labels, minlength=len(centres))
+        sums = np.stack([np.bincount(labels, weights=points[:, axis], minlength=len(centres)) for axis in range(3)], axis=1)
+        moved = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centres)
+        if np.allclose(moved, centres, atol=0.5):
+            break
+        centres = moved
+    labels = ((points[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+    return centres, labels
+
+
+def analyze_image(path: str, sample_edge: int = COLOR_SAMPLE_EDGE, clusters: int = COLOR_CLUSTERS,
+                  iterations: int = COLOR_ITERATIONS) -> Dict[str, float]:
+    """Vocabulary color -> share of the image's pixels, largest first.
+
+    Runs inside a worker process, so it only takes and returns picklable values.
+    """
+    from PIL import Image
+
+    with Image.open(path) as img:
+        # JPEG can decode straight to a reduced scale, which is much cheaper than a full decode
+        img.draft("RGB", (sample_edge * 2, sample_edge * 2))
+        img = img.convert("RGB")
+        img.thumbnail((sample_edge, sample_edge), Image.BILINEAR)
+        pixels = np.asarray(img, dtype=np.float64).reshape(-1, 3)
+
+    points = _rgb_to_lab(pixels)
+    centres, labels = _kmeans(points, clusters, iterations)
+    shares = np.bincount(labels, minlength=len(centres)) / len(labels)
+
+    names = list(PALETTE)
+    references = _rgb_to_lab(np.array(list(PALETTE.values()), dtype=np.float64))
+    nearest = ((centres[:, None, :] - references[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+
+    weights: Dict[str, float] = {}
+    for index, share in zip(nearest, shares):
+        if share > 0:
+            weights[names[index]] = weights.get(names[index], 0.0) + float(share)
+    return {name: round(weight, 3) for name, weight in sorted(weights.items(), key=lambda x: x[1], reverse=True)}
+
+
+def color_tags(weights: Dict[str, float], min_weight: float = COLOR_MIN_WEIGHT,
+               max_tags: int = COLOR_MAX_TAGS) -> List[str]:
+    """Catalog color tags: the heaviest colors covering at least min_weight of the image"""
+    tags = [name for name, weight in weights.items() if weight >= min_weight][:max_tags]
+    return tags or ["multicolor"]
+
+
+def _warm_up() -> int:
+    return os.getpid()
+
+
+class ColorAnalyzer:
+    """Analyses cached catalog images in a process pool"""
+
+    def __init__(self, images, workers: int = IMAGE_WORKERS):
+        self.images = images
+        self.workers = workers
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.analysed = 0
+        self.failed = 0
+
+    async def start(self):
+        if not pillow_available():
+            raise ColorAnalysisUnavailable("Color analysis needs Pillow: pip install Pillow")
+        if self.executor is None:
+            # fork launches every worker on first submit, so do that now while the process is quiet
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("fork"))
+            await asyncio.get_running_loop().run_in_executor(self.executor, _warm_up)
+
+    async def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def analyze(self, url: str) -> Dict[str, float]:
+        """Color weights for one image, fetching it into the image cache if it isn't there yet"""
+        if self.executor is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            entry = await self.images.get(url, load_body=False)
+            try:
+                return await loop.run_in_executor(self.executor, analyze_image, self.images.disk_path(entry))
+            except FileNotFoundError:
+                # The original was evicted between lookup and analysis; fetch it again once
+                if attempt:
+                    raise
+                self.images.forget(entry.key)
+
+    async def analyze_catalog(self, artworks: List[Dict], concurrency: int = 16) -> Dict[str, Dict[str, float]]:
+        """artwork id -> color weights for every artwork with an image_url"""
+        semaphore = asyncio.Semaphore(concurrency)
+        results: Dict[str, Dict[str, float]] = {}
+        jobs = [art for art in artworks if art.get("image_url")]
+
+        async def run(art):
+            async with semaphore:
+                try:
+                    results[art["id"]] = await self.analyze(art["image_url"])
+                    self.analysed += 1
+                except Exception as e:
+                    self.failed += 1
+                    print(f"  ✗ {art['id']}: {e}")
+                if (self.analysed + self.failed) % 100 == 0:
+                    print(f"  {self.analysed + self.failed}/{len(jobs)} images")
+
+        await asyncio.gather(*(run(art) for art in jobs))
+        return results
+
+
+async def tag_catalog(input_path: str, output_path: str, workers: int = IMAGE_WORKERS, concurrency: int = 16):
+    """Replace each artwork's colors with pixel-based tags and store the weights as color_weights"""
+    from image_cache import ImageCache
+    from image_proxy import ImageFetcher
+
+    artworks = list(iter_catalog(input_path))
+
+    fetcher = ImageFetcher()
+    analyzer = ColorAnalyzer(ImageCache(fetcher), workers)
+    await analyzer.start()
+    await fetcher.start()
+    started = time.time()
+    try:
+        results = await analyzer.analyze_catalog(artworks, concurrency)
+    finally:
+        await fetcher.close()
+        await analyzer.close()
+    elapsed = time.time() - started
+
+    for art in artworks:
+        weights = results.get(art.get("id"))
+        if weights:
+            art["colors"] = color_tags(weights)
+            art["color_weights"] = weights
+
+    write_catalog(output_path, artworks)
+
+    rate = analyzer.analysed / elapsed * 60 if elapsed else 0
+    print(f"✓ Tagged {analyzer.analysed} artworks ({analyzer.failed} failed) in {elapsed:.1f}s "
+          f"({rate:.0f}/min, {workers} workers) -> {output_path}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tag artwork colors from their images")
+    parser.add_argument("--input", default="../data/artworks.json")
+    parser.add_argument("--output", default="../data/artworks.json")
+    parser.add_argument("--workers", type=int, default=IMAGE_WORKERS, help="Processes analysing images")
+    parser.add_argument("--concurrency", type=int, default=16, help="Images fetched or analysed at once")
+    args = parser.parse_args()
+
+    asyncio.run(tag_catalog(args.input, args.output, args.workers, args.concurrency))
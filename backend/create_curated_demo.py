@@ -2,19 +2,46 @@
 Create a curated demo collection with working images and diverse metadata
 Uses Met Museum API + manual curation for balanced categories
 """
-import json
-import requests
-from time import sleep
-
-def verify_image(url):
-    """Check if image URL works"""
-    try:
-        response = requests.head(url, timeout=5, allow_redirects=True)
-        return response.status_code == 200
-    except:
-        return False
-
-def create_curated_collection():
+import asyncio
+import argparse
+from typing import Optional
+
+import httpx
+
+from catalog_io import write_catalog
+from image_verify import ImageVerifier, VerificationLog, VERIFY_CONCURRENCY
+from met_api import AsyncMetClient, Checkpoint, MET_CONCURRENCY
+from pipeline import (CollectSink, Pipeline, Stage, id_source, image_verifier,
+                      met_fetch, require_image, transformer)
+
+def curated_artwork(item):
+    """Artwork record from the Met object plus its curated style/colors/mood/price (id is assigned at the end)"""
+    data, config = item["data"], item["config"]
+    title = data.get('title', 'Untitled')
+    artist = data.get('artistDisplayName', '')
+    image_url = data['primaryImage']
+
+    print(f"  ✓ {title[:40]}")
+    return {
+        "title": title[:60],
+        "artist": artist if artist else "",
+        "price": config['price'],
+        "currency": "INR",
+        "style": config['style'],
+        "colors": config['colors'],
+        "medium": data.get('medium', 'Oil on canvas'),
+        "mood": config['mood'],
+        "dimensions": data.get('dimensions', 'N/A'),
+        "period": data.get('objectDate', 'Unknown'),
+        "availability": "available",
+        "image_url": image_url,
+        "thumbnail_url": data.get('primaryImageSmall', image_url),
+        "description": title,
+        "department": data.get('department', ''),
+        "culture": data.get('culture', '')
+    }
+
+def create_curated_collection(checkpoint: Optional[Checkpoint] = None):
     """Create manually curated collection with verified images"""
 
     # Curated list of Met Museum artworks with specific IDs that have good images
@@ -157,88 +184,56 @@ def create_curated_collection():
         },
     ]
 
-    artworks = []
-    seen_ids = set()
-
     print("Fetching curated artworks from Met Museum...")
     print("=" * 80)
 
-    for i, config in enumerate(curated_artworks, 1):
-        met_id = config['met_id']
-
-        # Skip duplicates
-        if met_id in seen_ids:
-            continue
-        seen_ids.add(met_id)
-
-        print(f"[{i}/{len(curated_artworks)}] Fetching artwork #{met_id}...", end=" ")
-
-        # Fetch artwork details
-        try:
-            response = requests.get(f"https://collectionapi.metmuseum.org/public/collection/v1/objects/{met_id}", timeout=10)
-            if response.status_code != 200:
-                print("✗ API Error")
-                continue
-
-            data = response.json()
-            image_url = data.get('primaryImage')
-
-            if not image_url:
-                print("✗ No Image")
-                continue
-
-            # Verify image works
-            if not verify_image(image_url):
-                print("✗ Broken Image")
-                continue
-
-            title = data.get('title', 'Untitled')
-            artist = data.get('artistDisplayName', '')
-
-            artwork = {
-                "id": f"demo_{len(artworks) + 1}",
-                "title": title[:60],
-                "artist": artist if artist else "",
-                "price": config['price'],
-                "currency": "INR",
-                "style": config['style'],
-                "colors": config['colors'],
-                "medium": data.get('medium', 'Oil on canvas'),
-                "mood": config['mood'],
-                "dimensions": data.get('dimensions', 'N/A'),
-                "period": data.get('objectDate', 'Unknown'),
-                "availability": "available",
-                "image_url": image_url,
-                "thumbnail_url": data.get('primaryImageSmall', image_url),
-                "description": title,
-                "department": data.get('department', ''),
-                "culture": data.get('culture', '')
-            }
-
-            artworks.append(artwork)
-            print(f"✓ {title[:40]}")
-
-        except Exception as e:
-            print(f"✗ Error: {str(e)[:30]}")
-
-        sleep(0.5)  # Rate limiting
+    sink = CollectSink()
+
+    async def run():
+        async with AsyncMetClient() as met, httpx.AsyncClient(follow_redirects=True) as http:
+            verifier = ImageVerifier(http, images)
+            pipeline = Pipeline(id_source(curated_artworks), [
+                Stage("fetch", met_fetch(met), MET_CONCURRENCY),
+                Stage("image", require_image),
+                Stage("verify", image_verifier(verifier), VERIFY_CONCURRENCY),
+                Stage("transform", transformer(curated_artwork)),
+            ], sink, checkpoint=checkpoint)
+            await pipeline.run()
+            print("\n" + "=" * 80)
+            print(pipeline.summary())
+            print(f"Met API: {met.requests} requests ({met.cache.stats()})")
+            print(f"Images: {verifier.stats()}")
+
+    images = VerificationLog()
+    try:
+        asyncio.run(run())
+    finally:
+        images.close()
 
-    print("\n" + "=" * 80)
+    # Number in curated order, whatever order the fetches finished in
+    artworks = [dict(record, id=f"demo_{n}") for n, record in enumerate(sink.records(), 1)]
     print(f"Total artworks fetched: {len(artworks)}")
 
     return artworks
 
 if __name__ == "__main__":
-    artworks = create_curated_collection()
+    parser = argparse.ArgumentParser(description="Create the curated demo collection")
+    parser.add_argument("--fresh", action="store_true", help="Ignore the checkpoint of an interrupted run and start over")
+    args = parser.parse_args()
+
+    checkpoint = Checkpoint("create_curated_demo", fresh=args.fresh)
+    if checkpoint.resumed:
+        print(f"Resuming from checkpoint {checkpoint.path} ({checkpoint.entries} entries)")
+    artworks = create_curated_collection(checkpoint)
 
     if len(artworks) < 10:
         print("\n⚠️  Warning: Only fetched {len(artworks)} artworks. Needs at least 10.")
 
     # Save to file
-    with open('../data/artworks_demo_new.json', 'w', encoding='utf-8') as f:
-        json.dump(artworks, f, indent=2, ensure_ascii=False)
+    write_catalog('../data/artworks_demo_new.json', artworks)
 
     print(f"\n✓ Saved {len(artworks)} artworks to artworks_demo_new.json")
+    checkpoint.complete()
 
     # Print distributions
     styles = {}
@@ -1,115 +1,242 @@
 """
 Enrich artwork metadata using Gemini AI vision capabilities
 This script analyzes artwork images to add accurate color and mood tags
+
+Artworks are sent in batches (many per prompt), several batches at a time,
+through the same rate-limited LLMGateway the chatbot uses. Every analysis is
+appended to ENRICH_LOG keyed by artwork id and a hash of its enrichment
+inputs, so a restarted run continues where it stopped and artworks whose
+inputs haven't changed are never sent again.
 """
+import argparse
+import hashlib
 import json
-import requests
 import os
-from dotenv import load_dotenv
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from catalog_io import iter_catalog, write_catalog
+from chatbot import GEMINI_URL, LLM_RATE_PER_MINUTE, CircuitBreaker, LLMGateway, LLMUnavailable
 
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={GEMINI_API_KEY}"
 
-def analyze_artwork_with_ai(image_url, title, artist):
-    """Use Gemini to analyze artwork and extract colors, moods, and styles"""
+ENRICH_BATCH_SIZE = int(os.getenv("ENRICH_BATCH_SIZE", "20"))
+ENRICH_CONCURRENCY = int(os.getenv("ENRICH_CONCURRENCY", "4"))
+ENRICH_RATE_PER_MINUTE = float(os.getenv("ENRICH_RATE_PER_MINUTE", str(LLM_RATE_PER_MINUTE)))
+ENRICH_MAX_RETRIES = int(os.getenv("ENRICH_MAX_RETRIES", "3"))
+ENRICH_LOG = os.getenv("ENRICH_LOG", "../cache/enrichment.jsonl")
+
+COLORS = ["red", "blue", "green", "yellow", "orange", "purple", "pink", "brown", "black", "white", "multicolor"]
+MOODS = ["calming", "energetic", "serene", "peaceful", "dramatic", "bold", "elegant", "contemplative",
+         "expressive", "intimate", "mysterious", "joyful"]
+STYLES = ["abstract", "classical", "contemporary", "impressionist", "landscape", "portrait", "fine-art",
+          "minimalist", "surreal"]
+
+# Bump when the prompt changes, so every artwork is analysed again
+PROMPT_VERSION = 2
+
+# Fields the analysis is based on; a change to any of them invalidates the stored result
+ENRICH_INPUTS = ("title", "artist", "medium", "period", "culture", "image_url")
+
+
+def input_hash(artwork: Dict) -> str:
+    """Content hash of the fields (and prompt version) an enrichment depends on"""
+    inputs = {field: artwork.get(field) for field in ENRICH_INPUTS}
+    inputs["prompt_version"] = PROMPT_VERSION
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:16]
 
-    prompt = f"""Analyze this artwork titled "{title}" by {artist if artist else 'Unknown Artist'}.
 
-Provide ONLY a JSON response with these fields (no additional text):
+def build_prompt(artworks: List[Dict]) -> str:
+    """One structured prompt analysing a whole batch of artworks"""
+    lines = []
+    for artwork in artworks:
+        details = "; ".join(f"{field}: {artwork[field]}" for field in ("medium", "period", "culture") if artwork.get(field))
+        lines.append(f'- id "{artwork["id"]}": "{artwork["title"]}" by '
+                     f'{artwork.get("artist") or "Unknown Artist"}' + (f" ({details})" if details else ""))
+
+    return f"""Analyze each of these artworks.
+
+{chr(10).join(lines)}
+
+Provide ONLY a JSON response (no additional text) with one entry per artwork id:
 {{
-    "dominant_colors": ["color1", "color2", "color3"],
-    "mood": ["mood1", "mood2"],
-    "style": ["style1"]
+    "<id>": {{"dominant_colors": ["color1", "color2", "color3"], "mood": ["mood1", "mood2"], "style": ["style1"]}}
 }}
 
 Guidelines:
-- dominant_colors: Choose 2-4 from [red, blue, green, yellow, orange, purple, pink, brown, black, white, multicolor]
-- mood: Choose 2-3 from [calming, energetic, serene, peaceful, dramatic, bold, elegant, contemplative, expressive, intimate, mysterious, joyful]
-- style: Choose 1-2 from [abstract, classical, contemporary, impressionist, landscape, portrait, fine-art, minimalist, surreal]
+- dominant_colors: Choose 2-4 from [{", ".join(COLORS)}]
+- mood: Choose 2-3 from [{", ".join(MOODS)}]
+- style: Choose 1-2 from [{", ".join(STYLES)}]
 
-Base your analysis on the actual visual appearance of the artwork."""
+Base your analysis on what each artwork is known to look like."""
 
-    # For text-only analysis (since we can't easily send image URLs to Gemini via REST)
-    # We'll use a simplified approach based on title and existing metadata
-
-    payload = {
-        "contents": [{
-            "parts": [{
-                "text": prompt
-            }]
-        }]
-    }
 
+def parse_analyses(text: str, ids: List[str]) -> Dict[str, Dict]:
+    """Per-artwork analyses from a batch reply; unknown ids and tags outside the vocabularies are dropped"""
+    json_start = text.find('{')
+    json_end = text.rfind('}') + 1
+    if json_start < 0 or json_end <= json_start:
+        return {}
     try:
-        response = requests.post(GEMINI_URL, json=payload)
-        if response.status_code == 200:
-            data = response.json()
-            text = data['candidates'][0]['content']['parts'][0]['text']
-
-            # Extract JSON from response
-            json_start = text.find('{')
-            json_end = text.rfind('}') + 1
-            if json_start >= 0 and json_end > json_start:
-                result = json.loads(text[json_start:json_end])
-                return result
-    except Exception as e:
-        print(f"Error analyzing artwork: {e}")
-
-    return None
-
-def enrich_metadata():
-    """Enrich all artworks with better metadata"""
+        reply = json.loads(text[json_start:json_end])
+    except ValueError:
+        return {}
 
-    # Load existing artworks
-    with open('../data/artworks.json', 'r', encoding='utf-8') as f:
-        artworks = json.load(f)
+    analyses = {}
+    for artwork_id in ids:
+        entry = reply.get(artwork_id)
+        if not isinstance(entry, dict):
+            continue
+        analysis = {}
+        for field, vocabulary in (("dominant_colors", COLORS), ("mood", MOODS), ("style", STYLES)):
+            values = [v.lower() for v in entry.get(field) or [] if isinstance(v, str) and v.lower() in vocabulary]
+            if values:
+                analysis[field] = values
+        if analysis:
+            analyses[artwork_id] = analysis
+    return analyses
 
-    print(f"Enriching metadata for {len(artworks)} artworks...")
-    print("=" * 60)
 
-    enriched = []
+def apply_analysis(artwork: Dict, analysis: Dict) -> Dict:
+    """Update artwork with AI analysis"""
+    artwork['colors'] = analysis.get('dominant_colors', artwork['colors'])
+    artwork['mood'] = analysis.get('mood', artwork['mood'])
 
-    for i, artwork in enumerate(artworks, 1):
-        print(f"\n[{i}/{len(artworks)}] {artwork['title']}")
+    # Merge AI style with existing, prefer AI
+    ai_style = analysis.get('style', [])
+    if ai_style and ai_style != ['fine-art']:
+        artwork['style'] = ai_style
+    return artwork
 
-        # Analyze with AI
-        analysis = analyze_artwork_with_ai(
-            artwork['image_url'],
-            artwork['title'],
-            artwork.get('artist', '')
-        )
 
-        if analysis:
-            # Update artwork with AI analysis
-            artwork['colors'] = analysis.get('dominant_colors', artwork['colors'])
-            artwork['mood'] = analysis.get('mood', artwork['mood'])
+class EnrichmentLog:
+    """Append-only JSONL of analyses: {"id", "hash", "analysis"} per line, latest line wins"""
+
+    def __init__(self, path: str = ENRICH_LOG, fresh: bool = False):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if fresh and os.path.exists(path):
+            os.remove(path)
+        self.entries: Dict[str, Dict] = {}
+        self._load()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        good_bytes = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                good_bytes += len(line)
+                self.entries[entry["id"]] = entry
+        if good_bytes < os.path.getsize(self.path):
+            # Drop a line cut off by a crash; its batch is analysed again
+            with open(self.path, "r+b") as f:
+                f.truncate(good_bytes)
+
+    def lookup(self, artwork: Dict) -> Optional[Dict]:
+        """Stored analysis for this artwork, if its inputs haven't changed since"""
+        entry = self.entries.get(str(artwork["id"]))
+        if entry is not None and entry["hash"] == input_hash(artwork):
+            return entry["analysis"]
+        return None
+
+    def record(self, artwork: Dict, analysis: Dict):
+        entry = {"id": str(artwork["id"]), "hash": input_hash(artwork), "analysis": analysis}
+        self.entries[entry["id"]] = entry
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
 
-            # Merge AI style with existing, prefer AI
-            ai_style = analysis.get('style', [])
-            if ai_style and ai_style != ['fine-art']:
-                artwork['style'] = ai_style
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
 
-            print(f"  ✓ Colors: {', '.join(artwork['colors'])}")
-            print(f"  ✓ Mood: {', '.join(artwork['mood'])}")
-            print(f"  ✓ Style: {', '.join(artwork['style'])}")
-        else:
-            print(f"  ✗ Failed to analyze, keeping original metadata")
+    def close(self):
+        self._file.close()
 
-        enriched.append(artwork)
 
-        # Rate limiting - wait 2 seconds between requests
-        if i < len(artworks):
-            time.sleep(2)
+def analyze_batch(gateway: LLMGateway, batch: List[Dict], max_retries: int = ENRICH_MAX_RETRIES) -> Dict[str, Dict]:
+    """Analyses for one batch; retries throttling and upstream failures with backoff"""
+    prompt = build_prompt(batch)
+    ids = [str(artwork["id"]) for artwork in batch]
+    for attempt in range(max_retries + 1):
+        try:
+            # Batch jobs can wait for a rate-limit token far longer than a chat turn
+            text = gateway.generate(prompt, deadline=time.monotonic() + 300)
+            return parse_analyses(text, ids)
+        except LLMUnavailable as e:
+            if attempt == max_retries:
+                print(f"  ✗ Batch of {len(batch)} failed ({e.reason}), will retry on the next run")
+                return {}
+            delay = 2 ** attempt
+            if gateway.breaker.state != CircuitBreaker.CLOSED:
+                # Long enough for the open circuit breaker to let a probe through
+                delay = max(delay, gateway.breaker.recovery_timeout)
+            time.sleep(delay)
+    return {}
+
+
+def enrich_metadata(input_path='../data/artworks.json', output_path='../data/artworks_enriched.json',
+                    batch_size=ENRICH_BATCH_SIZE, concurrency=ENRICH_CONCURRENCY,
+                    rate_per_minute=ENRICH_RATE_PER_MINUTE, fresh=False):
+    """Enrich all artworks with better metadata"""
+
+    # Load existing artworks
+    artworks = list(iter_catalog(input_path))
+
+    log = EnrichmentLog(fresh=fresh)
+    pending = [artwork for artwork in artworks if log.lookup(artwork) is None]
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+
+    print(f"Enriching metadata for {len(artworks)} artworks...")
+    print(f"{len(artworks) - len(pending)} unchanged since their last analysis, "
+          f"{len(pending)} to analyse in {len(batches)} batches of up to {batch_size}")
+    print("=" * 60)
+
+    gateway = LLMGateway(GEMINI_URL.format(api_key=GEMINI_API_KEY), rate_per_minute=rate_per_minute,
+                         burst=concurrency, max_queue=concurrency)
+    analysed = failed = 0
+    started = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            futures = {pool.submit(analyze_batch, gateway, batch): batch for batch in batches}
+            for done, future in enumerate(as_completed(futures), 1):
+                batch = futures[future]
+                analyses = future.result()
+                for artwork in batch:
+                    analysis = analyses.get(str(artwork["id"]))
+                    if analysis:
+                        log.record(artwork, analysis)
+                        analysed += 1
+                    else:
+                        failed += 1
+                log.flush()
+                print(f"[{done}/{len(batches)}] {analysed} analysed, {failed} failed "
+                      f"({time.time() - started:.0f}s)")
+    finally:
+        log.close()
+
+    enriched = []
+    for artwork in artworks:
+        analysis = log.lookup(artwork)
+        enriched.append(apply_analysis(artwork, analysis) if analysis else artwork)
 
     # Save enriched data
-    with open('../data/artworks_enriched.json', 'w', encoding='utf-8') as f:
-        json.dump(enriched, f, indent=2, ensure_ascii=False)
+    write_catalog(output_path, enriched)
 
     print("\n" + "=" * 60)
-    print(f"✓ Enriched metadata saved to artworks_enriched.json")
+    print(f"✓ Enriched metadata saved to {os.path.basename(output_path)}")
+    if failed:
+        print(f"  {failed} artworks kept their original metadata; re-run to retry them")
+    print(f"  Gemini: {gateway.stats()['succeeded']} requests")
 
     # Print new distribution
     all_colors = {}
@@ -129,4 +256,13 @@ def enrich_metadata():
         print(f"  {mood}: {count}")
 
 if __name__ == "__main__":
-    enrich_metadata()
+    parser = argparse.ArgumentParser(description="Enrich artwork colors, moods and styles with Gemini")
+    parser.add_argument("--input", default="../data/artworks.json")
+    parser.add_argument("--output", default="../data/artworks_enriched.json")
+    parser.add_argument("--batch-size", type=int, default=ENRICH_BATCH_SIZE, help="Artworks per Gemini request")
+    parser.add_argument("--concurrency", type=int, default=ENRICH_CONCURRENCY, help="Batches in flight at once")
+    parser.add_argument("--rate", type=float, default=ENRICH_RATE_PER_MINUTE, help="Max Gemini requests per minute")
+    parser.add_argument("--fresh", action="store_true", help="Ignore earlier analyses and enrich every artwork again")
+    args = parser.parse_args()
+
+    enrich_metadata(args.input, args.output, args.batch_size, args.concurrency, args.rate, args.fresh)
@@ -1,20 +1,13 @@
-import requests
-import json
 import time
 import random
+import asyncio
+import argparse
+from typing import Dict, List, Optional
 
-# Met Museum API endpoint
-BASE_URL = "https://collectionapi.metmuseum.org/public/collection/v1"
-
-def fetch_artwork_details(object_id):
-    """Fetch detailed information for a specific artwork"""
-    try:
-        response = requests.get(f"{BASE_URL}/objects/{object_id}")
-        if response.status_code == 200:
-            return response.json()
-    except Exception as e:
-        print(f"Error fetching object {object_id}: {e}")
-    return None
+from met_api import AsyncMetClient, Checkpoint, MET_CONCURRENCY, MET_RATE_PER_SECOND
+from catalog_io import CatalogWriter, iter_catalog
+from pipeline import (CollectSink, Pipeline, Stage, csv_source, dump_source, image_lookup, met_fetch, search_source,
+                      transformer)
 
 def categorize_style(artwork):
     """Categorize artwork style based on metadata"""
@@ -120,83 +113,111 @@ def transform_to_schema(artwork):
         "culture": artwork.get('culture', 'Various')
     }
 
-def fetch_diverse_artworks(target_count=40):
-    """Fetch diverse artworks from different departments"""
-
-    # Search queries for diverse artwork types
-    search_queries = [
-        'painting',
-        'abstract',
-        'landscape',
-        'portrait',
-        'modern',
-        'contemporary',
-        'floral',
-        'still life'
+SEARCH_QUERIES = [
+    'painting',
+    'abstract',
+    'landscape',
+    'portrait',
+    'modern',
+    'contemporary',
+    'floral',
+    'still life'
+]
+
+def build_pipeline(met: AsyncMetClient, sink: CollectSink, target_count=40, queries=SEARCH_QUERIES,
+                   per_query=10, concurrency=MET_CONCURRENCY, dump_path: Optional[str] = None,
+                   checkpoint: Optional[Checkpoint] = None, csv_path: Optional[str] = None,
+                   csv_filters: Optional[Dict] = None) -> Pipeline:
+    """Search (or local dump / MetObjects.csv) -> fetch -> transform -> sink, stopping at target_count artworks"""
+    if csv_path:
+        # The CSV has every field but the image URLs, so only those are looked up
+        source = csv_source(csv_path, **(csv_filters or {}))
+        fetch = Stage("images", image_lookup(met), concurrency)
+    elif dump_path:
+        source = dump_source(dump_path)
+        fetch = Stage("fetch", met_fetch(met), concurrency)
+    else:
+        source = search_source(met, queries, per_query, checkpoint, hasImages='true')
+        fetch = Stage("fetch", met_fetch(met), concurrency)
+    stages = [
+        fetch,
+        Stage("transform", transformer(lambda item: transform_to_schema(item["data"]))),
     ]
-
-    artworks = []
-    seen_ids = set()
-
-    for query in search_queries:
-        if len(artworks) >= target_count:
-            break
-
-        print(f"Searching for: {query}")
-        try:
-            # Search for artworks
-            response = requests.get(f"{BASE_URL}/search", params={
-                'q': query,
-                'hasImages': 'true'
-            })
-
-            if response.status_code == 200:
-                data = response.json()
-                object_ids = data.get('objectIDs', [])
-
-                if object_ids:
-                    # Sample random artworks from results
-                    sample_size = min(10, len(object_ids))
-                    sampled_ids = random.sample(object_ids, sample_size)
-
-                    for obj_id in sampled_ids:
-                        if len(artworks) >= target_count:
-                            break
-
-                        if obj_id in seen_ids:
-                            continue
-
-                        print(f"Fetching artwork {obj_id}...")
-                        artwork_data = fetch_artwork_details(obj_id)
-
-                        if artwork_data:
-                            transformed = transform_to_schema(artwork_data)
-                            if transformed:
-                                artworks.append(transformed)
-                                seen_ids.add(obj_id)
-                                print(f"✓ Added: {transformed['title']}")
-
-                        time.sleep(0.5)  # Rate limiting
-
-        except Exception as e:
-            print(f"Error searching for {query}: {e}")
-
-    return artworks
+    return Pipeline(source, stages, sink, checkpoint=checkpoint, limit=target_count)
+
+async def fetch_diverse_artworks_async(target_count=40, queries=SEARCH_QUERIES, per_query=10,
+                                       concurrency=MET_CONCURRENCY, rate=MET_RATE_PER_SECOND,
+                                       jsonl_path: Optional[str] = None, dump_path: Optional[str] = None,
+                                       checkpoint: Optional[Checkpoint] = None, csv_path: Optional[str] = None,
+                                       csv_filters: Optional[Dict] = None,
+                                       writer: Optional[CatalogWriter] = None) -> List[Dict]:
+    """Fetch diverse artworks from different search queries, optionally appending each record to a JSONL file as it arrives.
+
+    With a writer the artworks are streamed into it as they arrive and an empty list is returned.
+    """
+    sink = CollectSink(jsonl_path, writer=writer)
+    started = time.time()
+    try:
+        async with AsyncMetClient(rate=rate, concurrency=concurrency) as met:
+            pipeline = build_pipeline(met, sink, target_count, queries, per_query, concurrency, dump_path, checkpoint,
+                                      csv_path, csv_filters)
+            await pipeline.run()
+            elapsed = time.time() - started
+            print(pipeline.summary())
+            print(f"{met.requests} API requests ({met.retries} retries, {met.cache.stats()}) in {elapsed:.1f}s")
+    finally:
+        sink.close()
+    return sink.records()
+
+def fetch_diverse_artworks(target_count=40, checkpoint: Optional[Checkpoint] = None, **options) -> List[Dict]:
+    """Fetch diverse artworks from different search queries"""
+    return asyncio.run(fetch_diverse_artworks_async(target_count, checkpoint=checkpoint, **options))
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch artworks from The Met Museum")
+    parser.add_argument("--count", type=int, default=40)
+    parser.add_argument("--output", default="../data/artworks.json",
+                        help="Catalog to publish; a .jsonl path writes JSON Lines")
+    parser.add_argument("--per-query", type=int, default=10, help="Objects sampled per search query")
+    parser.add_argument("--concurrency", type=int, default=MET_CONCURRENCY,
+                        help="Objects fetched at once (1 fetches one object at a time)")
+    parser.add_argument("--rate", type=float, default=MET_RATE_PER_SECOND, help="Max API requests per second")
+    parser.add_argument("--jsonl", help="Also append each artwork to this JSONL file as soon as it is fetched")
+    parser.add_argument("--dump", help="Read Met object records from this JSON/JSONL file instead of searching the API")
+    parser.add_argument("--csv", help="Read objects from a local copy of the Met's MetObjects.csv dump")
+    parser.add_argument("--classification", action="append", default=[],
+                        help="With --csv, keep only this classification (e.g. Paintings); repeatable")
+    parser.add_argument("--department", action="append", default=[],
+                        help="With --csv, keep only this department (e.g. 'European Paintings'); repeatable")
+    parser.add_argument("--keywords", help="With --csv, keep rows whose title, object name or tags match this regex")
+    parser.add_argument("--db", help="Also load the catalog into this SQLite catalog store (see catalog_db.py)")
+    parser.add_argument("--fresh", action="store_true", help="Ignore the checkpoint of an interrupted run and start over")
+    args = parser.parse_args()
+
     print("Fetching artworks from The Met Museum...")
     print("=" * 50)
 
-    artworks = fetch_diverse_artworks(40)
+    checkpoint = Checkpoint("fetch_artworks", fresh=args.fresh)
+    if checkpoint.resumed:
+        print(f"Resuming from checkpoint {checkpoint.path} ({checkpoint.entries} entries)")
 
-    print(f"\n✓ Successfully fetched {len(artworks)} artworks")
+    # Artworks are written as they arrive and the catalog is only replaced once the run completes
+    with CatalogWriter(args.output) as writer:
+        fetch_diverse_artworks(
+            args.count, checkpoint, per_query=args.per_query, concurrency=args.concurrency, rate=args.rate,
+            jsonl_path=args.jsonl, dump_path=args.dump, csv_path=args.csv,
+            csv_filters={"classifications": args.classification, "departments": args.department,
+                         "keywords": args.keywords},
+            writer=writer
+        )
 
-    # Save to JSON
-    output_path = "../data/artworks.json"
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(artworks, f, indent=2, ensure_ascii=False)
+    print(f"\n✓ Successfully fetched {writer.count} artworks")
+    print(f"✓ Saved to {args.output} (catalog version {writer.version})")
 
-    print(f"✓ Saved to {output_path}")
+    if args.db:
+        from catalog_db import CatalogDB
+        print(f"✓ Loaded {CatalogDB(args.db).replace_all(iter_catalog(args.output))} artworks into {args.db}")
+    checkpoint.complete()
 
     # Print summary
     print("\n" + "=" * 50)
@@ -206,15 +227,17 @@ if __name__ == "__main__":
     all_styles = set()
     all_colors = set()
     all_moods = set()
-    price_range = [artwork['price'] for artwork in artworks]
+    prices = []
 
-    for artwork in artworks:
+    for artwork in iter_catalog(args.output):
         all_styles.update(artwork['style'])
         all_colors.update(artwork['colors'])
         all_moods.update(artwork['mood'])
+        prices.append(artwork['price'])
 
-    print(f"Total artworks: {len(artworks)}")
+    print(f"Total artworks: {writer.count}")
     print(f"Styles: {', '.join(sorted(all_styles))}")
     print(f"Colors: {', '.join(sorted(all_colors))}")
     print(f"Moods: {', '.join(sorted(all_moods))}")
-    print(f"Price range: ₹{min(price_range):,} - ₹{max(price_range):,}")
+    if prices:
+        print(f"Price range: ₹{min(prices):,} - ₹{max(prices):,}")
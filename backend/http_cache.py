@@ -0,0 +1,173 @@
+"""
+HTTP caching and compression
+
+/filters, /greeting and artwork records only change when the catalog does, so
+they are sent with an ETag (catalog version + digest of the body) and
+Cache-Control; a request whose If-None-Match matches gets 304 Not Modified
+and no body. /proxy-image does the same with the image's own validators.
+
+CompressionMiddleware compresses JSON and text responses of at least
+COMPRESS_MIN_BYTES: brotli when the client accepts it and the brotli package
+is installed, gzip otherwise. Compressed copies of responses that carry an
+ETag are kept, so an unchanged payload is compressed once, not per request.
+That cache is bounded by COMPRESS_CACHE_MB, and a body bigger than a
+sixteenth of it (an image data URL, say) is compressed but not kept.
+Streamed responses (NDJSON, images) are passed through as they are.
+"""
+import gzip
+import hashlib
+import os
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from starlette.datastructures import Headers, MutableHeaders
+
+from serialization import FastJSONResponse
+
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", "60"))
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+COMPRESS_CACHE_MB = float(os.getenv("COMPRESS_CACHE_MB", "16"))
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+def brotli_available() -> bool:
+    try:
+        import brotli  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def make_etag(body: bytes, version: Optional[str] = None) -> str:
+    """Strong ETag for a response body, prefixed with the catalog version it was built from"""
+    digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+    return f'"{version}-{digest}"' if version else f'"{digest}"'
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(headers: Headers, etag: Optional[str], last_modified: Optional[str] = None) -> bool:
+    """Whether the client's copy is current. If-None-Match (weak comparison) wins over If-Modified-Since"""
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        return if_none_match.strip() == "*" or _opaque(etag) in {_opaque(tag) for tag in if_none_match.split(",")}
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def not_modified(headers: dict) -> Response:
+    """304 carrying the validators and caching headers the full response would have had"""
+    return Response(status_code=304, headers=headers)
+
+
+def cached_json(request: Request, body: bytes, etag: str, max_age: int = CATALOG_MAX_AGE) -> Response:
+    """Serialized JSON with an ETag, or 304 if the client already has it"""
+    # The same URL serves every gallery, compressed or not
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}", "Vary": "X-Gallery-Id, Accept-Encoding"}
+    if is_not_modified(request.headers, etag):
+        return not_modified(headers)
+    return FastJSONResponse(body, headers=headers)
+
+
+def _accepted(accept_encoding: str, coding: str) -> bool:
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip() == coding:
+            quality = params.strip()
+            return not (quality.startswith("q=") and float(quality[2:] or 0) == 0)
+    return False
+
+
+class CompressionMiddleware:
+    """ASGI middleware: gzip/brotli for complete JSON and text bodies of at least minimum_size bytes"""
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES, cache_bytes: int = int(COMPRESS_CACHE_MB * 2**20)):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.brotli = brotli_available()
+        self._cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+
+    def choose(self, accept_encoding: str) -> Optional[str]:
+        try:
+            if self.brotli and _accepted(accept_encoding, "br"):
+                return "br"
+            if _accepted(accept_encoding, "gzip"):
+                return "gzip"
+        except ValueError:
+            pass  # malformed q-value; send it uncompressed
+        return None
+
+    def compress(self, body: bytes, coding: str, etag: Optional[str]) -> bytes:
+        key = (etag, len(body), coding)
+        if etag is not None and key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        if coding == "br":
+            import brotli
+            compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+        else:
+            compressed = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+        if etag is not None and len(compressed) <= self.cache_bytes // 16:
+            self._cache[key] = compressed
+            self.cached_bytes += len(compressed)
+            while self.cached_bytes > self.cache_bytes:
+                self.cached_bytes -= len(self._cache.popitem(last=False)[1])
+        return compressed
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        coding = self.choose(Headers(scope=scope).get("accept-encoding", ""))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message  # held until we know whether the body comes in one piece
+                return
+            if start is None:
+                await send(message)
+                return
+            held, start = start, None
+            headers = MutableHeaders(raw=held["headers"])
+            body = message.get("body", b"")
+            if (message["type"] == "http.response.body" and not message.get("more_body", False)
+                    and held["status"] == 200 and len(body) >= self.minimum_size
+                    and "content-encoding" not in headers
+                    and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)):
+                etag = headers.get("etag")
+                body = self.compress(body, coding, etag)
+                headers["Content-Encoding"] = coding
+                headers["Content-Length"] = str(len(body))
+                if "accept-encoding" not in headers.get("vary", "").lower():
+                    headers.add_vary_header("Accept-Encoding")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = f"W/{etag}"  # the encoded bytes differ from what the strong tag names
+                message = {**message, "body": body}
+            await send(held)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
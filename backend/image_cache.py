@@ -0,0 +1,497 @@
+"""
+Two-tier content cache for proxied images
+
+Images are keyed by the SHA-256 of their URL and kept in a byte-bounded
+in-memory LRU in front of a byte-bounded on-disk store. Entries are served
+without contacting upstream while fresh (IMAGE_CACHE_TTL); after that they are
+revalidated with If-None-Match / If-Modified-Since, so an unchanged image
+costs a 304 instead of a full download. Concurrent misses for the same URL
+share a single upstream fetch.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import AsyncExitStack
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from image_proxy import ImageFetcher
+from metrics import REGISTRY, record_cache
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "../cache/images")
+IMAGE_CACHE_MEMORY_MB = float(os.getenv("IMAGE_CACHE_MEMORY_MB", "128"))
+IMAGE_CACHE_DISK_MB = float(os.getenv("IMAGE_CACHE_DISK_MB", "2048"))
+IMAGE_CACHE_TTL = float(os.getenv("IMAGE_CACHE_TTL", str(7 * 24 * 3600)))
+PROXY_MAX_IMAGE_MB = float(os.getenv("PROXY_MAX_IMAGE_MB", "40"))
+PROXY_STREAM_CHUNK_KB = float(os.getenv("PROXY_STREAM_CHUNK_KB", "64"))
+# Chunks are written to the temp file from the threadpool in batches of about this size
+WRITE_BATCH_BYTES = 256 * 1024
+
+
+def _write_and_close(f, chunks: List[bytes]):
+    f.writelines(chunks)
+    f.close()
+
+
+def cache_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+class CachedImage:
+    """Cache metadata for one URL; `body` is only set while the bytes are loaded"""
+
+    def __init__(self, key: str, url: str, content_type: str, size: int,
+                 etag: Optional[str] = None, last_modified: Optional[str] = None,
+                 validated_at: Optional[float] = None, body: Optional[bytes] = None):
+        self.key = key
+        self.url = url
+        self.content_type = content_type
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.validated_at = validated_at if validated_at is not None else time.time()
+        self.body = body
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.validated_at < ttl
+
+    def meta(self) -> Dict:
+        return {
+            "url": self.url,
+            "content_type": self.content_type,
+            "size": self.size,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "validated_at": self.validated_at,
+        }
+
+    def with_body(self, body: bytes) -> "CachedImage":
+        return CachedImage(self.key, self.url, self.content_type, self.size,
+                           self.etag, self.last_modified, self.validated_at, body)
+
+
+class MemoryLRU:
+    """Byte-bounded LRU of CachedImage objects holding their bodies"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        # Single items larger than this would just flush everything else out
+        self.max_item_bytes = max_bytes // 4
+        self.bytes = 0
+        self._items: "OrderedDict[str, CachedImage]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedImage]:
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+            return entry
+
+    def put(self, entry: CachedImage):
+        if entry.body is None or entry.size > self.max_item_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(entry.key, None)
+            if old is not None:
+                self.bytes -= old.size
+            self._items[entry.key] = entry
+            self.bytes += entry.size
+            while self.bytes > self.max_bytes and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self.bytes -= evicted.size
+
+    def remove(self, key: str):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskCache:
+    """Byte-bounded on-disk store: <key>.bin holds the body, <key>.json the metadata"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        # key -> CachedImage without body, ordered least- to most-recently used
+        self._index: "OrderedDict[str, CachedImage]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _paths(self, key: str):
+        return os.path.join(self.directory, key + ".bin"), os.path.join(self.directory, key + ".json")
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-5]
+            body_path, meta_path = self._paths(key)
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                atime = os.path.getatime(body_path)
+            except (OSError, ValueError):
+                continue
+            entries.append((atime, CachedImage(key, meta["url"], meta["content_type"], meta["size"],
+                                               meta.get("etag"), meta.get("last_modified"), meta.get("validated_at"))))
+        for _, entry in sorted(entries, key=lambda e: e[0]):
+            self._index[entry.key] = entry
+            self.bytes += entry.size
+
+    def lookup(self, key: str) -> Optional[CachedImage]:
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None:
+                self._index.move_to_end(key)
+            return entry
+
+    def read(self, entry: CachedImage) -> Optional[bytes]:
+        body_path, _ = self._paths(entry.key)
+        try:
+            with open(body_path, "rb") as f:
+                return f.read()
+        except OSError:
+            self.remove(entry.key)
+            return None
+
+    def body_path(self, key: str) -> str:
+        return self._paths(key)[0]
+
+    def temp_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.{uuid.uuid4().hex}.part")
+
+    def commit(self, entry: CachedImage, tmp_path: str):
+        """Move a fully downloaded temp file into place and record its metadata"""
+        body_path, meta_path = self._paths(entry.key)
+        os.replace(tmp_path, body_path)
+        self._write_atomic(meta_path, json.dumps(entry.meta()).encode("utf-8"))
+        self._add(entry)
+
+    def _write_atomic(self, path: str, data: bytes):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def write(self, entry: CachedImage, body: Optional[bytes] = None):
+        """Store metadata, plus the body when given (metadata-only writes record a revalidation)"""
+        body_path, meta_path = self._paths(entry.key)
+        if body is not None:
+            self._write_atomic(body_path, body)
+        self._write_atomic(meta_path, json.dumps(entry.meta()).encode("utf-8"))
+        self._add(entry)
+
+    def _add(self, entry: CachedImage):
+        stored = CachedImage(entry.key, entry.url, entry.content_type, entry.size,
+                             entry.etag, entry.last_modified, entry.validated_at)
+        with self._lock:
+            old = self._index.pop(entry.key, None)
+            if old is not None:
+                self.bytes -= old.size
+            self._index[entry.key] = stored
+            self.bytes += stored.size
+            evicted = []
+            while self.bytes > self.max_bytes and len(self._index) > 1:
+                key, old_entry = self._index.popitem(last=False)
+                self.bytes -= old_entry.size
+                evicted.append(key)
+        for key in evicted:
+            self._unlink(key)
+
+    def remove(self, key: str):
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+        self._unlink(key)
+
+    def _unlink(self, key: str):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self._index)
+
+
+class ImageTooLarge(Exception):
+    """Upstream image exceeds PROXY_MAX_IMAGE_MB"""
+
+
+class StreamedImage:
+    """Upstream response headers plus an async iterator over its body chunks"""
+
+    def __init__(self, content_type: str, content_length: Optional[int], etag: Optional[str],
+                 last_modified: Optional[str], chunks: AsyncIterator[bytes]):
+        self.content_type = content_type
+        self.content_length = content_length
+        self.etag = etag
+        self.last_modified = last_modified
+        self.chunks = chunks
+
+
+class ImageCache:
+    """Memory LRU + disk cache in front of an ImageFetcher
+
+    Upstream bodies are always streamed to a temp file in PROXY_STREAM_CHUNK_KB
+    reads and committed to the disk tier, so a download never holds more than
+    one chunk plus (for images small enough for the memory tier) the body.
+    """
+
+    def __init__(self, fetcher: ImageFetcher, directory: str = IMAGE_CACHE_DIR,
+                 memory_bytes: int = int(IMAGE_CACHE_MEMORY_MB * 1024 * 1024),
+                 disk_bytes: int = int(IMAGE_CACHE_DISK_MB * 1024 * 1024),
+                 ttl: float = IMAGE_CACHE_TTL,
+                 max_image_bytes: int = int(PROXY_MAX_IMAGE_MB * 1024 * 1024),
+                 chunk_size: int = int(PROXY_STREAM_CHUNK_KB * 1024)):
+        self.fetcher = fetcher
+        self.memory = MemoryLRU(memory_bytes)
+        self.disk = DiskCache(directory, disk_bytes)
+        self.ttl = ttl
+        self.max_image_bytes = max_image_bytes
+        self.chunk_size = chunk_size
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.upstream_fetches = 0
+        self.revalidations = 0
+
+    def lookup_fresh(self, url: str) -> Optional[CachedImage]:
+        """Fresh entry without touching upstream: from memory with its body, or disk metadata only"""
+        key = cache_key(url)
+        entry = self.memory.get(key)
+        if entry is not None and entry.is_fresh(self.ttl):
+            record_cache("image_memory", True)
+            return entry
+        record_cache("image_memory", False)
+        disk_entry = self.disk.lookup(key)
+        hit = disk_entry is not None and disk_entry.is_fresh(self.ttl)
+        record_cache("image_disk", hit)
+        return disk_entry if hit else None
+
+    def is_cached(self, url: str) -> bool:
+        """Whether any copy (fresh or stale) of the URL is cached"""
+        key = cache_key(url)
+        return self.memory.get(key) is not None or self.disk.lookup(key) is not None
+
+    async def _load_body(self, entry: CachedImage) -> CachedImage:
+        if entry.body is not None:
+            return entry
+        body = await asyncio.to_thread(self.disk.read, entry)
+        if body is None:
+            raise FileNotFoundError(f"Cached image for {entry.url} is missing from disk")
+        loaded = entry.with_body(body)
+        self.memory.put(loaded)
+        return loaded
+
+    async def get(self, url: str, load_body: bool = True) -> CachedImage:
+        """Return the image for `url`, fetching or revalidating as needed.
+
+        With load_body=False a disk-tier entry comes back without its body so
+        callers can stream it from disk_path() instead.
+        """
+        entry = self.lookup_fresh(url)
+        if entry is not None:
+            return await self._load_body(entry) if load_body else entry
+
+        key = cache_key(url)
+        stale = self.memory.get(key) or self.disk.lookup(key)
+        entry = await self._single_flight(key, lambda: self._refresh(key, url, stale))
+        return await self._load_body(entry) if load_body else entry
+
+    def disk_path(self, entry: CachedImage) -> str:
+        return self.disk.body_path(entry.key)
+
+    def forget(self, key: str):
+        """Drop an entry from both tiers"""
+        self.memory.remove(key)
+        self.disk.remove(key)
+
+    async def _single_flight(self, key: str, work):
+        """Run work() once per key; concurrent callers for the same key share its result"""
+        pending = self._inflight.get(key)
+        if pending is None:
+            # A task of its own, so a caller that is cancelled doesn't cancel it for the others
+            pending = self._inflight[key] = asyncio.ensure_future(work())
+            pending.add_done_callback(lambda task: self._flight_done(key, task))
+        return await asyncio.shield(pending)
+
+    def _flight_done(self, key: str, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Every waiter may have given up; don't leave the error unretrieved
+        if not task.cancelled():
+            task.exception()
+
+    async def _refresh(self, key: str, url: str, stale: Optional[CachedImage]) -> CachedImage:
+        headers = {}
+        if stale is not None:
+            if stale.etag:
+                headers["If-None-Match"] = stale.etag
+            if stale.last_modified:
+                headers["If-Modified-Since"] = stale.last_modified
+
+        async with self.fetcher.stream(url, headers=headers or None) as response:
+            if response.status_code == 304 and stale is not None:
+                self.revalidations += 1
+                entry = CachedImage(stale.key, stale.url, stale.content_type, stale.size,
+                                    response.headers.get("etag", stale.etag),
+                                    response.headers.get("last-modified", stale.last_modified),
+                                    body=stale.body)
+                await asyncio.to_thread(self.disk.write, entry)
+                self.memory.put(entry)
+                return entry
+
+            response.raise_for_status()
+            result: List[CachedImage] = []
+            async for _ in self._tee(key, url, response, result):
+                pass
+            return result[0]
+
+    def _check_length(self, response: httpx.Response) -> Optional[int]:
+        """Length of the body we will pass on, if upstream states it; raises ImageTooLarge early"""
+        length = response.headers.get("content-length")
+        if length is None or not length.isdigit():
+            return None
+        if int(length) > self.max_image_bytes:
+            raise ImageTooLarge(f"Image is {int(length)} bytes, limit is {self.max_image_bytes}")
+        if response.headers.get("content-encoding", "identity").lower() != "identity":
+            return None  # httpx decodes the body, so the upstream length isn't ours
+        return int(length)
+
+    async def _tee(self, key: str, url: str, response: httpx.Response, result: List[CachedImage]):
+        """Yield body chunks while writing them to the disk tier; append the stored entry to `result`.
+
+        File I/O runs in the threadpool, batched, so a burst of downloads
+        doesn't block the event loop on disk writes.
+        """
+        self._check_length(response)
+        self.upstream_fetches += 1
+        tmp_path = self.disk.temp_path(key)
+        chunks: Optional[List[bytes]] = []
+        batch: List[bytes] = []
+        batch_bytes = 0
+        size = 0
+        committed = False
+        f = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            async for chunk in response.aiter_bytes(self.chunk_size):
+                size += len(chunk)
+                if size > self.max_image_bytes:
+                    raise ImageTooLarge(f"Image exceeded {self.max_image_bytes} bytes while streaming")
+                batch.append(chunk)
+                batch_bytes += len(chunk)
+                if batch_bytes >= WRITE_BATCH_BYTES:
+                    await asyncio.to_thread(f.writelines, batch)
+                    batch, batch_bytes = [], 0
+                if chunks is not None:
+                    # Only keep the body around if it will fit the memory tier
+                    if size <= self.memory.max_item_bytes:
+                        chunks.append(chunk)
+                    else:
+                        chunks = None
+                yield chunk
+            await asyncio.to_thread(_write_and_close, f, batch)
+            entry = CachedImage(
+                key, url,
+                response.headers.get("content-type", ""),
+                size,
+                response.headers.get("etag"),
+                response.headers.get("last-modified"),
+                body=b"".join(chunks) if chunks is not None else None,
+            )
+            await asyncio.to_thread(self.disk.commit, entry, tmp_path)
+            committed = True
+            self.memory.put(entry)
+            result.append(entry)
+        finally:
+            f.close()
+            if not committed:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    async def stream(self, url: str) -> StreamedImage:
+        """Open an upstream fetch whose chunks go to the caller and into the cache at once.
+
+        Concurrent get() calls for the same URL wait for this download to finish
+        instead of starting their own.
+        """
+        key = cache_key(url)
+        stack = AsyncExitStack()
+        response = await stack.enter_async_context(self.fetcher.stream(url))
+        try:
+            response.raise_for_status()
+            content_length = self._check_length(response)
+        except BaseException:
+            await stack.aclose()
+            raise
+
+        async def chunks():
+            # Registered only once the body is being read: if the response is never
+            # iterated (client gone before the body), nothing is left for get() to wait on
+            future = asyncio.get_running_loop().create_future()
+            owns_flight = key not in self._inflight
+            if owns_flight:
+                self._inflight[key] = future
+            result: List[CachedImage] = []
+            try:
+                async for chunk in self._tee(key, url, response, result):
+                    yield chunk
+            finally:
+                await stack.aclose()
+                if owns_flight:
+                    del self._inflight[key]
+                    if result:
+                        future.set_result(result[0])
+                    else:
+                        future.set_exception(httpx.StreamError("Streaming download did not complete"))
+                        future.exception()
+
+        return StreamedImage(
+            response.headers.get("content-type", ""),
+            content_length,
+            response.headers.get("etag"),
+            response.headers.get("last-modified"),
+            chunks(),
+        )
+
+    def stats(self) -> Dict:
+        return {
+            "memory_items": len(self.memory),
+            "memory_bytes": self.memory.bytes,
+            "disk_items": len(self.disk),
+            "disk_bytes": self.disk.bytes,
+            "upstream_fetches": self.upstream_fetches,
+            "revalidations": self.revalidations,
+            "inflight": len(self._inflight),
+        }
+
+
+def register_metrics(cache: ImageCache):
+    """Expose cache size gauges on /metrics"""
+    REGISTRY.gauge(
+        "artgallery_image_cache_bytes",
+        "Bytes held by the image cache per tier",
+        callback=lambda: {(("tier", "memory"),): cache.memory.bytes, (("tier", "disk"),): cache.disk.bytes},
+    )
+    REGISTRY.gauge(
+        "artgallery_image_cache_items",
+        "Images held by the image cache per tier",
+        callback=lambda: {(("tier", "memory"),): len(cache.memory), (("tier", "disk"),): len(cache.disk)},
+    )
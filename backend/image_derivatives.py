@@ -0,0 +1,240 @@
+"""
+Resized image renditions for cards, thumbnails and PDF pages
+
+Originals come from the proxy's ImageCache. A derivative is the original
+downscaled to a named size and re-encoded as WebP or progressive JPEG. It is
+rendered in a process pool on first request and then stored in its own disk
+cache, so CPU work stays off the event loop and happens once per URL/size/format.
+The cache key and ETag include the original's validator (its ETag, else
+Last-Modified, else size), so when the image cache revalidates an original
+and it has changed upstream, its derivatives are rendered again.
+
+Run directly to pre-generate derivatives for the whole catalog:
+    python image_derivatives.py --sizes thumb,card,pdf --formats jpeg
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from image_cache import CachedImage, DiskCache, ImageCache, cache_key
+from metrics import record_cache, span
+
+IMAGE_DERIVATIVE_DIR = os.getenv("IMAGE_DERIVATIVE_DIR", "../cache/derivatives")
+IMAGE_DERIVATIVE_DISK_MB = float(os.getenv("IMAGE_DERIVATIVE_DISK_MB", "1024"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) - 1)))))
+
+# Named sizes -> longest edge in pixels
+SIZES = {
+    "thumb": 240,
+    "card": 640,
+    "pdf": 1400,
+}
+
+FORMATS = {
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+
+def pillow_available() -> bool:
+    try:
+        import PIL  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def render_derivative(src_path: str, dst_path: str, max_edge: int, fmt: str) -> Tuple[int, int, int]:
+    """Downscale src to fit max_edge and encode it to dst; returns (width, height, bytes).
+
+    Runs inside a worker process, so it only takes and returns picklable values.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(src_path) as img:
+        # JPEG can decode straight to a reduced scale, which is much cheaper than a full decode
+        img.draft("RGB", (max_edge, max_edge))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if fmt == "webp":
+            img.save(dst_path, "WEBP", quality=WEBP_QUALITY, method=4)
+        else:
+            img.save(dst_path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        width, height = img.size
+    return width, height, os.path.getsize(dst_path)
+
+
+def _warm_up() -> int:
+    return os.getpid()
+
+
+class DerivativeUnavailable(Exception):
+    """Pillow is not installed, or the size/format is unknown"""
+
+
+def original_version(original: CachedImage) -> str:
+    """Validator of the original a derivative is rendered from"""
+    return original.etag or original.last_modified or f"size-{original.size}"
+
+
+class DerivativeStore:
+    """Lazily rendered, disk-cached image derivatives"""
+
+    def __init__(self, images: ImageCache, directory: str = IMAGE_DERIVATIVE_DIR,
+                 disk_bytes: int = int(IMAGE_DERIVATIVE_DISK_MB * 1024 * 1024),
+                 workers: int = IMAGE_WORKERS):
+        self.images = images
+        self.disk = DiskCache(directory, disk_bytes)
+        self.workers = workers
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.rendered = 0
+
+    async def start(self):
+        """Create the process pool; call at startup, before the app has spawned threads"""
+        if self.executor is not None or not pillow_available():
+            return
+        # fork launches every worker on first submit, so do that now while the process is quiet
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("fork"))
+        await asyncio.get_running_loop().run_in_executor(self.executor, _warm_up)
+
+    async def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def validate(self, size: str, fmt: str):
+        if size not in SIZES:
+            raise DerivativeUnavailable(f"Unknown size '{size}'. Use one of: {', '.join(SIZES)}")
+        if fmt not in FORMATS:
+            raise DerivativeUnavailable(f"Unknown format '{fmt}'. Use one of: {', '.join(FORMATS)}")
+        if not pillow_available():
+            raise DerivativeUnavailable("Image derivatives need Pillow: pip install Pillow")
+
+    async def get(self, url: str, size: str, fmt: str = "jpeg") -> Tuple[CachedImage, str]:
+        """Return (entry, path) of the derivative, rendering it on first request"""
+        self.validate(size, fmt)
+        derivative_url = f"{url}#{size}.{fmt}"
+        # Only revalidates upstream once the original's cache entry is stale
+        original = await self.images.get(url, load_body=False)
+        key = cache_key(f"{derivative_url}@{original_version(original)}")
+
+        entry = self.disk.lookup(key)
+        if entry is not None and os.path.exists(self.disk.body_path(key)):
+            record_cache("image_derivative", True)
+            return entry, self.disk.body_path(key)
+        record_cache("image_derivative", False)
+
+        pending = self._inflight.get(key)
+        if pending is None:
+            pending = self._inflight[key] = asyncio.ensure_future(self._render(key, url, original, derivative_url, size, fmt))
+            pending.add_done_callback(lambda task: self._render_done(key, task))
+        entry = await asyncio.shield(pending)
+        return entry, self.disk.body_path(key)
+
+    def _render_done(self, key: str, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        # Every waiter may have given up (e.g. a batch item timeout); don't leave the error unretrieved
+        if not task.cancelled():
+            task.exception()
+
+    async def _render(self, key: str, url: str, original: CachedImage, derivative_url: str,
+                      size: str, fmt: str) -> CachedImage:
+        if self.executor is None:
+            await self.start()
+        tmp_path = self.disk.temp_path(key)
+        loop = asyncio.get_running_loop()
+        try:
+            for attempt in range(2):
+                if attempt:
+                    original = await self.images.get(url, load_body=False)
+                try:
+                    with span("derivative_render"):
+                        _, _, nbytes = await loop.run_in_executor(
+                            self.executor, render_derivative,
+                            self.images.disk_path(original), tmp_path, SIZES[size], fmt
+                        )
+                    break
+                except FileNotFoundError:
+                    # The original was evicted between lookup and render; fetch it again once
+                    if attempt:
+                        raise
+                    self.images.forget(original.key)
+            entry = CachedImage(key, derivative_url, FORMATS[fmt], nbytes, etag=f'"{key[:32]}"')
+            await asyncio.to_thread(self.disk.commit, entry, tmp_path)
+            self.rendered += 1
+            return entry
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def stats(self) -> Dict:
+        return {
+            "items": len(self.disk),
+            "bytes": self.disk.bytes,
+            "rendered": self.rendered,
+            "inflight": len(self._inflight),
+            "workers": self.workers if self.executor else 0,
+        }
+
+
+async def pregenerate(artworks_path: str, sizes, formats, concurrency: int = 8):
+    """Render every size/format for every artwork image in the catalog"""
+    from image_proxy import ImageFetcher
+
+    from catalog_io import iter_catalog
+
+    fetcher = ImageFetcher()
+    store = DerivativeStore(ImageCache(fetcher))
+    await store.start()
+    await fetcher.start()
+    semaphore = asyncio.Semaphore(concurrency)
+    done = failed = 0
+    jobs = [(art["image_url"], size, fmt) for art in iter_catalog(artworks_path) if art.get("image_url")
+            for size in sizes for fmt in formats]
+    started = time.time()
+
+    async def run(job):
+        nonlocal done, failed
+        async with semaphore:
+            try:
+                await store.get(*job)
+                done += 1
+            except Exception as e:
+                failed += 1
+                print(f"  ✗ {job[0]} [{job[1]}.{job[2]}]: {e}")
+            if (done + failed) % 20 == 0:
+                print(f"  {done + failed}/{len(jobs)} derivatives")
+
+    try:
+        await asyncio.gather(*(run(job) for job in jobs))
+    finally:
+        await fetcher.close()
+        await store.close()
+    print(f"✓ {done} derivatives ready, {failed} failed in {time.time() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pre-generate image derivatives for the catalog")
+    parser.add_argument("--artworks", default="../data/artworks.json")
+    parser.add_argument("--sizes", default=",".join(SIZES))
+    parser.add_argument("--formats", default="jpeg")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    asyncio.run(pregenerate(
+        args.artworks,
+        [s for s in args.sizes.split(",") if s],
+        [f for f in args.formats.split(",") if f],
+        args.concurrency,
+    ))
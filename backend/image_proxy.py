@@ -0,0 +1,128 @@
+"""
+Upstream image fetching for the /proxy-image endpoint
+
+One pooled httpx.AsyncClient lives for the lifetime of the app, so repeated
+image requests reuse DNS results and keep-alive TLS connections to the Met
+image servers instead of paying a fresh handshake each time. A per-host
+semaphore caps concurrent fetches so a burst of PDF exports can't exhaust
+sockets or hammer a single origin.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+PROXY_MAX_CONNECTIONS = int(os.getenv("PROXY_MAX_CONNECTIONS", "50"))
+PROXY_MAX_KEEPALIVE = int(os.getenv("PROXY_MAX_KEEPALIVE", "20"))
+PROXY_KEEPALIVE_EXPIRY = float(os.getenv("PROXY_KEEPALIVE_EXPIRY", "60"))
+PROXY_PER_HOST_LIMIT = int(os.getenv("PROXY_PER_HOST_LIMIT", "8"))
+PROXY_CONNECT_TIMEOUT = float(os.getenv("PROXY_CONNECT_TIMEOUT", "5"))
+PROXY_READ_TIMEOUT = float(os.getenv("PROXY_READ_TIMEOUT", "30"))
+PROXY_POOL_TIMEOUT = float(os.getenv("PROXY_POOL_TIMEOUT", "10"))
+PROXY_HTTP2 = os.getenv("PROXY_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Headers that mimic a browser request - the Met image servers reject bare clients
+UPSTREAM_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Referer': 'https://www.metmuseum.org/',
+    # Images are compressed already; an encoded body would also make the upstream length wrong for ours
+    'Accept-Encoding': 'identity',
+}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class ImageFetcher:
+    """Application-lifetime pooled client with per-host concurrency limits"""
+
+    def __init__(
+        self,
+        max_connections: int = PROXY_MAX_CONNECTIONS,
+        max_keepalive: int = PROXY_MAX_KEEPALIVE,
+        keepalive_expiry: float = PROXY_KEEPALIVE_EXPIRY,
+        per_host_limit: int = PROXY_PER_HOST_LIMIT,
+        http2: bool = PROXY_HTTP2,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(
+            connect=PROXY_CONNECT_TIMEOUT,
+            read=PROXY_READ_TIMEOUT,
+            write=PROXY_READ_TIMEOUT,
+            pool=PROXY_POOL_TIMEOUT,
+        )
+        self.per_host_limit = per_host_limit
+        self.http2 = http2
+        self.client: Optional[httpx.AsyncClient] = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    async def start(self):
+        if self.client is not None:
+            return
+        if self.http2 and not _http2_available():
+            print("WARNING: PROXY_HTTP2 is set but the 'h2' package is not installed; using HTTP/1.1")
+            self.http2 = False
+        self.client = httpx.AsyncClient(
+            headers=UPSTREAM_HEADERS,
+            limits=self.limits,
+            timeout=self.timeout,
+            http2=self.http2,
+            follow_redirects=True,
+            verify=True,
+        )
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def host_semaphore(self, url: str) -> asyncio.Semaphore:
+        """Concurrency cap shared by all requests to the URL's host"""
+        host = urlsplit(url).netloc.lower()
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._host_semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        return semaphore
+
+    async def fetch(self, url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        """GET an upstream URL through the shared pool without checking the status"""
+        if self.client is None:
+            await self.start()
+        async with self.host_semaphore(url):
+            return await self.client.get(url, headers=headers)
+
+    @asynccontextmanager
+    async def stream(self, url: str, headers: Optional[Dict[str, str]] = None) -> AsyncIterator[httpx.Response]:
+        """Streaming GET; the per-host slot is held until the body has been read or closed"""
+        if self.client is None:
+            await self.start()
+        async with self.host_semaphore(url):
+            async with self.client.stream("GET", url, headers=headers) as response:
+                yield response
+
+    async def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        """GET an upstream URL through the shared pool; raises httpx errors on failure"""
+        response = await self.fetch(url, headers=headers)
+        response.raise_for_status()
+        return response
+
+    def stats(self) -> Dict[str, int]:
+        """Hosts seen and fetches currently holding a per-host slot"""
+        return {
+            "hosts": len(self._host_semaphores),
+            "active": sum(self.per_host_limit - s._value for s in self._host_semaphores.values()),
+        }
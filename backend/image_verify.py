@@ -0,0 +1,216 @@
+"""
+Bulk image URL verification with a persistent result log
+
+Checking image URLs one HEAD request at a time, and forgetting the answer,
+made every catalog build recheck the same URLs. ImageVerifier checks many
+URLs concurrently (with a cap per host, so one image server isn't flooded)
+and appends each result - status, content type, size, checked-at - to a JSONL
+log. URLs checked within VERIFY_TTL (VERIFY_FAILED_TTL for failures) are
+answered from the log without a request.
+
+    python image_verify.py ../data/artworks.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from catalog_io import iter_catalog
+
+VERIFY_CONCURRENCY = int(os.getenv("VERIFY_CONCURRENCY", "32"))
+VERIFY_PER_HOST = int(os.getenv("VERIFY_PER_HOST", "8"))
+VERIFY_TIMEOUT = float(os.getenv("VERIFY_TIMEOUT", "5"))
+VERIFY_TTL = int(os.getenv("VERIFY_TTL", str(7 * 24 * 3600)))
+VERIFY_FAILED_TTL = int(os.getenv("VERIFY_FAILED_TTL", "3600"))
+VERIFY_LOG = os.getenv("VERIFY_LOG", "../cache/image_verify.jsonl")
+
+# Servers that refuse HEAD get a one-byte ranged GET instead
+HEAD_UNSUPPORTED = {403, 405, 501}
+
+
+class VerificationLog:
+    """Latest verification result per URL, persisted as an append-only JSONL file"""
+
+    def __init__(self, path: Optional[str] = VERIFY_LOG):
+        self.path = path
+        self.results: Dict[str, Dict] = {}
+        self._lines = 0
+        self._file = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._load()
+            self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        good_bytes = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    break
+                good_bytes += len(line)
+                self._lines += 1
+                self.results[result["url"]] = result
+        if good_bytes < os.path.getsize(self.path):
+            # Drop a line cut off by a crash so new results start on a clean line
+            with open(self.path, "r+b") as f:
+                f.truncate(good_bytes)
+
+    def get(self, url: str) -> Optional[Dict]:
+        return self.results.get(url)
+
+    def record(self, result: Dict):
+        self.results[result["url"]] = result
+        if self._file is not None:
+            self._file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self._lines += 1
+
+    def compact(self):
+        """Rewrite the log with one line per URL once superseded lines outnumber live ones"""
+        if not self.path or self._lines <= 2 * len(self.results):
+            return
+        self._file.close()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for result in self.results.values():
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+        self._lines = len(self.results)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        if self._file is not None:
+            self.compact()
+            self._file.close()
+            self._file = None
+
+
+class ImageVerifier:
+    """Checks image URLs concurrently, at most `per_host` at a time per host, remembering the results"""
+
+    def __init__(self, http: httpx.AsyncClient, log: Optional[VerificationLog] = None,
+                 concurrency: int = VERIFY_CONCURRENCY, per_host: int = VERIFY_PER_HOST,
+                 timeout: float = VERIFY_TIMEOUT, ttl: int = VERIFY_TTL, failed_ttl: int = VERIFY_FAILED_TTL):
+        self.http = http
+        self.log = log if log is not None else VerificationLog(None)
+        self.per_host = per_host
+        self.timeout = timeout
+        self.ttl = ttl
+        self.failed_ttl = failed_ttl
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.checked = 0
+        self.reused = 0
+
+    def is_fresh(self, result: Dict) -> bool:
+        ttl = self.ttl if result["ok"] else self.failed_ttl
+        return time.time() - result["checked_at"] < ttl
+
+    async def check(self, url: str) -> Dict:
+        """Verification result for `url`: {"url", "ok", "status", "content_type", "size", "checked_at", "error"}"""
+        result = self.log.get(url)
+        if result is not None and self.is_fresh(result):
+            self.reused += 1
+            return result
+
+        # Concurrent checks of one URL share a single request, run as its own task
+        # so a caller that is cancelled doesn't cancel it for the others
+        pending = self._inflight.get(url)
+        if pending is None:
+            pending = self._inflight[url] = asyncio.ensure_future(self._check(url))
+            pending.add_done_callback(lambda task: self._check_done(url, task))
+        return await asyncio.shield(pending)
+
+    async def _check(self, url: str) -> Dict:
+        result = await self._request(url)
+        self.checked += 1
+        self.log.record(result)
+        return result
+
+    def _check_done(self, url: str, task: asyncio.Future):
+        self._inflight.pop(url, None)
+        if not task.cancelled():
+            task.exception()  # nobody else may be waiting; don't warn about it
+
+    async def _request(self, url: str) -> Dict:
+        host = urlsplit(url).netloc
+        host_slots = self._hosts.setdefault(host, asyncio.Semaphore(max(1, self.per_host)))
+        result = {"url": url, "ok": False, "status": None, "content_type": None, "size": None, "error": None}
+        # Host slot first, so requests queued for a busy host don't hold global slots
+        async with host_slots, self._slots:
+            try:
+                response = await self.http.head(url, timeout=self.timeout)
+                if response.status_code in HEAD_UNSUPPORTED:
+                    response = await self.http.get(url, headers={"Range": "bytes=0-0"}, timeout=self.timeout)
+            except (httpx.HTTPError, httpx.InvalidURL) as e:
+                result["error"] = f"{type(e).__name__}: {e}"[:200]
+            else:
+                content_type = response.headers.get("content-type", "").split(";")[0].strip() or None
+                result.update(status=response.status_code, content_type=content_type,
+                              size=_content_size(response.headers))
+                result["ok"] = response.status_code in (200, 206) and (content_type or "image/").startswith("image/")
+        result["checked_at"] = time.time()
+        return result
+
+    async def verify_many(self, urls: Iterable[str]) -> Dict[str, Dict]:
+        """Results for all distinct `urls`; fresh ones come from the log"""
+        distinct = list(dict.fromkeys(url for url in urls if url))
+        results = await asyncio.gather(*(self.check(url) for url in distinct))
+        return dict(zip(distinct, results))
+
+    def stats(self) -> str:
+        return f"{self.checked} checked, {self.reused} reused from log"
+
+
+def _content_size(headers: httpx.Headers) -> Optional[int]:
+    # A ranged GET reports the full size after the slash: "bytes 0-0/123456"
+    total = headers.get("content-range", "").rpartition("/")[2]
+    value = total if total.isdigit() else headers.get("content-length", "")
+    return int(value) if value.isdigit() else None
+
+
+async def verify_catalog(artworks: List[Dict], **options) -> Dict[str, Dict]:
+    """Verify every image_url and thumbnail_url in a catalog"""
+    urls = [art.get(field) for art in artworks for field in ("image_url", "thumbnail_url")]
+    log = VerificationLog()
+    try:
+        async with httpx.AsyncClient(follow_redirects=True) as http:
+            verifier = ImageVerifier(http, log, **options)
+            results = await verifier.verify_many(urls)
+            print(f"Verified {len(results)} image URLs ({verifier.stats()})")
+    finally:
+        log.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that every image URL in a catalog loads")
+    parser.add_argument("catalog", nargs="?", default="../data/artworks.json")
+    parser.add_argument("--concurrency", type=int, default=VERIFY_CONCURRENCY)
+    parser.add_argument("--per-host", type=int, default=VERIFY_PER_HOST)
+    parser.add_argument("--recheck", action="store_true", help="Ignore earlier results and check every URL again")
+    args = parser.parse_args()
+
+    catalog = list(iter_catalog(args.catalog))
+
+    started = time.time()
+    ttl = {"ttl": 0, "failed_ttl": 0} if args.recheck else {}
+    results = asyncio.run(verify_catalog(catalog, concurrency=args.concurrency, per_host=args.per_host, **ttl))
+    broken = {url: result for url, result in results.items() if not result["ok"]}
+
+    for art in catalog:
+        for field in ("image_url", "thumbnail_url"):
+            result = broken.get(art.get(field))
+            if result:
+                print(f"  ✗ {art.get('id')} {field}: {result['status'] or result['error']}")
+    print(f"✓ {len(results) - len(broken)} ok, {len(broken)} broken in {time.time() - started:.1f}s")
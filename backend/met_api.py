@@ -0,0 +1,368 @@
+"""
+Met Collection API clients shared by the ingestion scripts
+
+AsyncMetClient shares one pooled httpx.AsyncClient across all requests.
+Concurrency is bounded by a semaphore and the request rate by a token bucket
+sized to the Met's published limit (80 requests/second), so a big run goes
+as fast as the API allows without fixed sleeps. MetClient is the blocking
+equivalent for the serial scripts. Both retry throttling (429), 5xx
+responses and transport errors with exponential backoff and jitter; a 404 is
+an expected "object not found" and returns None.
+
+Both also go through ResponseCache, an on-disk cache of decoded responses.
+Within MET_CACHE_TTL an entry is used without touching the network; after
+that it is revalidated with If-None-Match / If-Modified-Since. Re-running a
+script over an unchanged catalog is served almost entirely from disk.
+Checkpoint records per-item progress so an interrupted run resumes where it
+stopped.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from urllib.parse import urlencode
+
+import httpx
+import requests
+
+from ratelimit import TokenBucket
+
+MET_API_BASE = "https://collectionapi.metmuseum.org/public/collection/v1"
+MET_RATE_PER_SECOND = float(os.getenv("MET_RATE_PER_SECOND", "80"))
+MET_CONCURRENCY = int(os.getenv("MET_CONCURRENCY", "16"))
+MET_MAX_RETRIES = int(os.getenv("MET_MAX_RETRIES", "4"))
+MET_BACKOFF_BASE = float(os.getenv("MET_BACKOFF_BASE", "0.5"))
+MET_TIMEOUT = float(os.getenv("MET_TIMEOUT", "15"))
+MET_CACHE_DIR = os.getenv("MET_CACHE_DIR", "../cache/met_api")
+MET_CACHE_TTL = float(os.getenv("MET_CACHE_TTL", str(7 * 24 * 3600)))
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "../cache/checkpoints")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class MetAPIError(Exception):
+    """A Met API call failed after all retries"""
+
+
+def _write_atomic(path: str, data: bytes):
+    # Per thread as well as per process: AsyncMetClient writes the cache from worker threads
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ResponseCache:
+    """Decoded JSON responses on disk, one file per URL+params, with validators for revalidation"""
+
+    def __init__(self, directory: str = MET_CACHE_DIR, ttl: float = MET_CACHE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def _path(self, url: str, params: Optional[Dict[str, Any]]) -> str:
+        full_url = f"{url}?{urlencode(sorted((params or {}).items()))}"
+        key = hashlib.sha256(full_url.encode("utf-8")).hexdigest()
+        # Two-level fan-out keeps directories small for 100k+ objects
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def load(self, url: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict]:
+        try:
+            with open(self._path(url, params), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, entry: Dict) -> bool:
+        return time.time() - entry.get("fetched_at", 0) < self.ttl
+
+    def store(self, url: str, params: Optional[Dict[str, Any]], status: int, body: Optional[Any],
+              etag: Optional[str] = None, last_modified: Optional[str] = None) -> Dict:
+        entry = {
+            "url": url,
+            "params": params,
+            "status": status,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time(),
+            "body": body,
+        }
+        path = self._path(url, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomic(path, json.dumps(entry).encode("utf-8"))
+        return entry
+
+    def touch(self, entry: Dict) -> Dict:
+        """Mark a stale entry as revalidated (the server answered 304)"""
+        return self.store(entry["url"], entry["params"], entry["status"], entry["body"],
+                          entry.get("etag"), entry.get("last_modified"))
+
+    @staticmethod
+    def conditional_headers(entry: Optional[Dict]) -> Dict[str, str]:
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def stats(self) -> str:
+        return f"{self.hits} cached, {self.revalidated} revalidated, {self.misses} fetched"
+
+
+def _backoff(base: float, attempt: int, retry_after: Optional[str] = None) -> float:
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    # Full jitter so many workers retrying at once don't come back in lockstep
+    return random.uniform(0, base * (2 ** attempt))
+
+
+def _cache_result(cache: Optional[ResponseCache], url: str, params, stale: Optional[Dict],
+                  status: int, headers, decode: Callable[[], Any]) -> Any:
+    """Decoded body of a final (non-retryable) response, recording it in the cache"""
+    if status == 304 and stale is not None:
+        if cache:
+            cache.revalidated += 1
+            cache.touch(stale)
+        return stale["body"]
+    if status == 404:
+        if cache:
+            cache.misses += 1
+            cache.store(url, params, 404, None)
+        return None
+    body = decode()
+    if cache:
+        cache.misses += 1
+        cache.store(url, params, status, body, headers.get("ETag"), headers.get("Last-Modified"))
+    return body
+
+
+class MetClient:
+    """Blocking Met API client with the response cache, rate limit and retries"""
+
+    def __init__(self, base_url: str = MET_API_BASE, rate: float = MET_RATE_PER_SECOND,
+                 max_retries: int = MET_MAX_RETRIES, backoff_base: float = MET_BACKOFF_BASE,
+                 timeout: float = MET_TIMEOUT, cache: Optional[ResponseCache] = None, use_cache: bool = True):
+        self.base_url = base_url.rstrip("/")
+        self.bucket = TokenBucket(rate, capacity=max(1.0, rate / 4))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        self.cache = (cache or ResponseCache()) if use_cache else None
+        self.session = requests.Session()
+        self.requests = 0
+        self.retries = 0
+
+    def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict]:
+        """GET base_url + path and decode JSON; None on 404, MetAPIError once retries run out"""
+        url = f"{self.base_url}{path}"
+        stale = self.cache.load(url, params) if self.cache else None
+        if stale is not None and self.cache.is_fresh(stale):
+            self.cache.hits += 1
+            return stale["body"]
+
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+            self.bucket.acquire()
+            self.requests += 1
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout,
+                                            headers=ResponseCache.conditional_headers(stale))
+            except requests.RequestException as e:
+                last_error = f"{type(e).__name__}: {e}"
+                delay = _backoff(self.backoff_base, attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    if response.status_code not in (200, 304, 404):
+                        response.raise_for_status()
+                    return _cache_result(self.cache, url, params, stale, response.status_code,
+                                         response.headers, response.json)
+                last_error = f"HTTP {response.status_code}"
+                delay = _backoff(self.backoff_base, attempt, response.headers.get("Retry-After"))
+            if attempt < self.max_retries:
+                time.sleep(delay)
+        raise MetAPIError(f"{url}: {last_error} after {self.max_retries + 1} attempts")
+
+    def search(self, query: str, **params) -> List[int]:
+        """Object ids matching a search; extra params are passed through (hasImages, departmentId, ...)"""
+        data = self.get_json("/search", {"q": query, **params})
+        return (data or {}).get("objectIDs") or []
+
+    def get_object(self, object_id: int) -> Optional[Dict]:
+        return self.get_json(f"/objects/{object_id}")
+
+
+class AsyncMetClient:
+    """Rate-limited, retrying Met API client; use as `async with AsyncMetClient() as met:`"""
+
+    def __init__(self, base_url: str = MET_API_BASE, rate: float = MET_RATE_PER_SECOND,
+                 concurrency: int = MET_CONCURRENCY, max_retries: int = MET_MAX_RETRIES,
+                 backoff_base: float = MET_BACKOFF_BASE, timeout: float = MET_TIMEOUT,
+                 cache: Optional[ResponseCache] = None, use_cache: bool = True):
+        self.base_url = base_url.rstrip("/")
+        # Capacity 1/4s worth of requests: short bursts are fine, sustained load is smoothed
+        self.bucket = TokenBucket(rate, capacity=max(1.0, rate / 4))
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        self.cache = (cache or ResponseCache()) if use_cache else None
+        self.client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.requests = 0
+        self.retries = 0
+
+    async def __aenter__(self) -> "AsyncMetClient":
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            timeout=httpx.Timeout(self.timeout),
+            follow_redirects=True,
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+        self.client = None
+
+    async def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict]:
+        """GET base_url + path and decode JSON; None on 404, MetAPIError once retries run out"""
+        url = f"{self.base_url}{path}"
+        stale = await asyncio.to_thread(self.cache.load, url, params) if self.cache else None
+        if stale is not None and self.cache.is_fresh(stale):
+            self.cache.hits += 1
+            return stale["body"]
+
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+            await self.bucket.acquire_async()
+            async with self._semaphore:
+                self.requests += 1
+                try:
+                    response = await self.client.get(url, params=params,
+                                                     headers=ResponseCache.conditional_headers(stale))
+                except httpx.TransportError as e:
+                    last_error = f"{type(e).__name__}: {e}"
+                    delay = _backoff(self.backoff_base, attempt)
+                else:
+                    if response.status_code not in RETRY_STATUSES:
+                        if response.status_code not in (200, 304, 404):
+                            response.raise_for_status()
+                        return await asyncio.to_thread(
+                            _cache_result, self.cache, url, params, stale, response.status_code,
+                            response.headers, response.json
+                        )
+                    last_error = f"HTTP {response.status_code}"
+                    delay = _backoff(self.backoff_base, attempt, response.headers.get("Retry-After"))
+            if attempt < self.max_retries:
+                await asyncio.sleep(delay)
+        raise MetAPIError(f"{url}: {last_error} after {self.max_retries + 1} attempts")
+
+    async def search(self, query: str, **params) -> List[int]:
+        """Object ids matching a search; extra params are passed through (hasImages, departmentId, ...)"""
+        data = await self.get_json("/search", {"q": query, **params})
+        return (data or {}).get("objectIDs") or []
+
+    async def get_object(self, object_id: int) -> Optional[Dict]:
+        return await self.get_json(f"/objects/{object_id}")
+
+
+class Checkpoint:
+    """Append-only JSONL progress log for resumable runs
+
+    Each processed item is one line {"key", "value"}, flushed and fsynced as it
+    is written, so after a crash every completed item is still there. Random
+    choices (e.g. which search results were sampled) should be recorded too,
+    so a resumed run works through the same list instead of drawing a new one.
+
+    Only the completed keys and the offsets of their lines are kept in memory;
+    recorded values are read back from the file when asked for.
+    """
+
+    def __init__(self, name: str, directory: str = CHECKPOINT_DIR, fresh: bool = False):
+        self.path = os.path.join(directory, f"{name}.jsonl")
+        os.makedirs(directory, exist_ok=True)
+        if fresh and os.path.exists(self.path):
+            os.remove(self.path)
+        # key -> offset of its latest line, or None when the value is None
+        self._offsets: Dict[str, Optional[int]] = {}
+        self._size = 0
+        self._load()
+        self.resumed = bool(self._offsets)
+        self._file = open(self.path, "ab")
+        self._reader = None
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._offsets[record["key"]] = None if record["value"] is None else self._size
+                self._size += len(line)
+        if self._size < os.path.getsize(self.path):
+            # Drop a line cut off by the crash so new records start on a clean line
+            with open(self.path, "r+b") as f:
+                f.truncate(self._size)
+
+    def _read(self, offset: int) -> Any:
+        if self._reader is None:
+            self._reader = open(self.path, "rb")
+        self._reader.seek(offset)
+        return json.loads(self._reader.readline())["value"]
+
+    def __contains__(self, key) -> bool:
+        return str(key) in self._offsets
+
+    def get(self, key, default=None):
+        key = str(key)
+        if key not in self._offsets:
+            return default
+        offset = self._offsets[key]
+        return None if offset is None else self._read(offset)
+
+    def record(self, key, value: Any):
+        """Mark `key` done with its result (None for items that were skipped or failed)"""
+        line = (json.dumps({"key": str(key), "value": value}, ensure_ascii=False) + "\n").encode("utf-8")
+        self._file.write(line)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._offsets[str(key)] = None if value is None else self._size
+        self._size += len(line)
+
+    def values(self, prefix: str = "") -> Iterator[Any]:
+        """Recorded results whose key starts with `prefix`, in the order processed, skipping None"""
+        for key, offset in list(self._offsets.items()):
+            if key.startswith(prefix) and offset is not None:
+                yield self._read(offset)
+
+    @property
+    def entries(self) -> int:
+        return len(self._offsets)
+
+    def close(self):
+        self._file.close()
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def complete(self):
+        """The run finished and its output is saved; drop the checkpoint"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
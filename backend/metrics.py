@@ -0,0 +1,251 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition
+
+Counters, gauges and histograms are plain Python objects guarded by a lock;
+timing spans use time.perf_counter so they are cheap enough to leave on in
+the hot path.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _callback_samples(name: str, callback: Callable[[], object]) -> List[str]:
+    try:
+        result = callback()
+    except Exception as e:
+        print(f"Error collecting metric {name}: {e}")
+        return []
+    if result is None:
+        return []
+    # A callback returns a number, or a {((label, value), ...): number} mapping
+    items = list(result.items()) if isinstance(result, dict) else [((), result)]
+    return [f"{name}{_format_labels(k)} {_format_value(v)}" for k, v in items]
+
+
+class Counter:
+    """Monotonic counter, optionally labelled; either incremented or read from a callback at scrape time"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, callback: Optional[Callable[[], object]] = None):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        if self.callback is not None:
+            return _callback_samples(self.name, self.callback)
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge:
+    """Point-in-time value; either set directly or read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, callback: Optional[Callable[[], object]] = None):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[str]:
+        if self.callback is not None:
+            return _callback_samples(self.name, self.callback)
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally labelled"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts, then +Inf count, then sum
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        lines = []
+        for key, series in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', _format_value(bound)))} {_format_value(cumulative)}")
+            cumulative += series[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {_format_value(cumulative)}")
+        return lines
+
+
+class Registry:
+    """Holds metric families and renders them in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, callback: Optional[Callable[[], object]] = None) -> Counter:
+        counter = self.register(Counter(name, help, callback))
+        if callback is not None:
+            counter.callback = callback
+        return counter
+
+    def gauge(self, name: str, help: str, callback: Optional[Callable[[], object]] = None) -> Gauge:
+        gauge = self.register(Gauge(name, help, callback))
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            samples = metric.samples()
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "artgallery_stage_duration_seconds",
+    "Time spent in each request-processing stage",
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "artgallery_stage_errors_total",
+    "Exceptions raised inside a timed stage",
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "artgallery_cache_requests_total",
+    "Cache lookups by cache name and result (hit/miss)",
+)
+
+
+def _cache_hit_ratios():
+    lookups: Dict[str, List[float]] = {}
+    for key, value in list(CACHE_REQUESTS._values.items()):
+        labels = dict(key)
+        totals = lookups.setdefault(labels.get("cache", ""), [0.0, 0.0])
+        totals[1] += value
+        if labels.get("result") == "hit":
+            totals[0] += value
+    return {(("cache", name),): hits / total for name, (hits, total) in lookups.items() if total}
+
+
+REGISTRY.gauge(
+    "artgallery_cache_hit_ratio",
+    "Hit ratio per cache since process start",
+    callback=_cache_hit_ratios,
+)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block of work into the stage histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        # Not BaseException: a cancelled request (client gone) isn't a stage error
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup for the hit-ratio metrics"""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
@@ -0,0 +1,432 @@
+"""
+Server-side PDF catalogue for recommended artworks
+
+A small PDF 1.4 writer that needs no third-party library: pages use the
+built-in Helvetica fonts and images are embedded as-is with DCTDecode, so
+JPEG derivatives from the image pipeline go into the file without being
+decoded or re-encoded. The document is produced by a generator one object
+at a time, so only one image is held in memory while it streams out.
+
+PdfExporter resolves each artwork's "pdf" derivative through the image
+pipeline, runs the writer in the threadpool straight into a disk cache keyed
+by the exact artwork data, and the file is then sent from there; exporting
+the same set again is just the file send.
+"""
+import asyncio
+import datetime
+import json
+import os
+import re
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from image_cache import CachedImage, DiskCache, cache_key
+from image_derivatives import DerivativeStore, DerivativeUnavailable
+from metrics import record_cache, span
+
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", "../cache/pdf")
+PDF_CACHE_DISK_MB = float(os.getenv("PDF_CACHE_DISK_MB", "256"))
+PDF_MAX_ARTWORKS = int(os.getenv("PDF_MAX_ARTWORKS", "30"))
+PDF_IMAGE_CONCURRENCY = int(os.getenv("PDF_IMAGE_CONCURRENCY", "6"))
+PDF_IMAGE_TIMEOUT = float(os.getenv("PDF_IMAGE_TIMEOUT", "20"))
+
+PAGE_WIDTH = 595.28   # A4 in points
+PAGE_HEIGHT = 841.89
+MARGIN = 56.7         # 20 mm
+IMAGE_BOX_HEIGHT = 283.5  # 100 mm, matching the browser export
+
+PURPLE = (124, 58, 237)
+TEAL = (20, 184, 166)
+DARK = (50, 50, 50)
+GREY = (100, 100, 100)
+SLATE = (100, 116, 139)
+LIGHT = (150, 150, 150)
+
+# Helvetica advance widths (per 1000 em) for ASCII 32-126, from the standard AFM
+_HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+
+FONTS = {
+    "F1": "Helvetica",
+    "F2": "Helvetica-Bold",
+    "F3": "Helvetica-Oblique",
+}
+
+
+def text_width(text: str, size: float, bold: bool = False) -> float:
+    """Approximate rendered width in points (bold glyphs run ~5% wider)"""
+    total = 0
+    for ch in text:
+        code = ord(ch)
+        total += _HELVETICA_WIDTHS[code - 32] if 32 <= code <= 126 else 556
+    return total * size / 1000 * (1.05 if bold else 1.0)
+
+
+def wrap_text(text: str, size: float, max_width: float, bold: bool = False) -> List[str]:
+    lines: List[str] = []
+    current = ""
+    for word in text.split():
+        candidate = f"{current} {word}" if current else word
+        if current and text_width(candidate, size, bold) > max_width:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+    return lines or [""]
+
+
+def _pdf_string(text: str) -> bytes:
+    """Encode text as a PDF literal string in WinAnsi (cp1252)"""
+    raw = text.encode("cp1252", errors="replace")
+    raw = raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+    return b"(" + raw + b")"
+
+
+def format_inr(amount: int) -> str:
+    """Indian digit grouping, e.g. 450000 -> 'INR 4,50,000' (the rupee sign isn't in WinAnsi)"""
+    digits = str(int(amount))
+    if len(digits) > 3:
+        head, tail = digits[:-3], digits[-3:]
+        groups = []
+        while len(head) > 2:
+            groups.insert(0, head[-2:])
+            head = head[:-2]
+        if head:
+            groups.insert(0, head)
+        digits = ",".join(groups) + "," + tail
+    return f"INR {digits}"
+
+
+def format_period(period: str) -> str:
+    """'ca. 1835' -> 'Since 1835', like formatPeriod() in the frontend"""
+    match = re.search(r"(\d{4})", period or "")
+    return f"Since {match.group(1)}" if match else (period or "")
+
+
+def jpeg_info(path: str) -> Optional[Tuple[int, int, int]]:
+    """(width, height, components) from a JPEG's SOF marker, or None if it isn't a usable JPEG"""
+    with open(path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            while marker[1] == 0xFF:
+                marker = marker[:1] + f.read(1)
+            code = marker[1]
+            if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+                continue
+            length_bytes = f.read(2)
+            if len(length_bytes) < 2:
+                return None
+            length = struct.unpack(">H", length_bytes)[0]
+            # SOF0-SOF15 except DHT (C4), JPG (C8) and DAC (CC)
+            if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+                data = f.read(6)
+                _, height, width, components = struct.unpack(">BHHB", data)
+                return width, height, components
+            f.seek(length - 2, 1)
+
+
+class _Page:
+    """Accumulates a page's content stream"""
+
+    def __init__(self):
+        self.ops: List[bytes] = []
+
+    def text(self, x: float, y_top: float, text: str, size: float, font: str = "F1", color=DARK):
+        r, g, b = (c / 255 for c in color)
+        # PDF's origin is bottom-left; callers work top-down like jsPDF
+        self.ops.append(
+            b"BT %.3f %.3f %.3f rg /%s %.1f Tf %.2f %.2f Td %s Tj ET" % (
+                r, g, b, font.encode(), size, x, PAGE_HEIGHT - y_top, _pdf_string(text)
+            )
+        )
+
+    def centered(self, y_top: float, text: str, size: float, font: str = "F1", color=DARK):
+        width = text_width(text, size, bold=font == "F2")
+        self.text((PAGE_WIDTH - width) / 2, y_top, text, size, font, color)
+
+    def image(self, name: str, x: float, y_top: float, width: float, height: float):
+        self.ops.append(b"q %.2f 0 0 %.2f %.2f %.2f cm /%s Do Q" % (
+            width, height, x, PAGE_HEIGHT - y_top - height, name.encode()
+        ))
+
+    def content(self) -> bytes:
+        return b"\n".join(self.ops)
+
+
+class PdfWriter:
+    """Streams PDF objects and records their offsets for the xref table"""
+
+    def __init__(self):
+        self.offsets: Dict[int, int] = {}
+        self.position = 0
+        self.next_id = 1
+
+    def reserve(self) -> int:
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def emit(self, data: bytes) -> bytes:
+        self.position += len(data)
+        return data
+
+    def obj(self, obj_id: int, body: bytes, stream: Optional[bytes] = None) -> bytes:
+        self.offsets[obj_id] = self.position
+        parts = [b"%d 0 obj\n" % obj_id, body]
+        if stream is not None:
+            parts += [b"\nstream\n", stream, b"\nendstream"]
+        parts.append(b"\nendobj\n")
+        return self.emit(b"".join(parts))
+
+    def trailer(self, root_id: int, info_id: int) -> bytes:
+        xref_at = self.position
+        lines = [b"xref\n0 %d\n" % self.next_id, b"0000000000 65535 f \n"]
+        for obj_id in range(1, self.next_id):
+            lines.append(b"%010d 00000 n \n" % self.offsets[obj_id])
+        lines.append(b"trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+            self.next_id, root_id, info_id, xref_at
+        ))
+        return self.emit(b"".join(lines))
+
+
+def _artwork_page(artwork: Dict, page_number: int, total_pages: int,
+                  image: Optional[Tuple[str, int, int]]) -> _Page:
+    """Lay out one artwork page; `image` is (xobject name, pixel width, pixel height)"""
+    page = _Page()
+    usable = PAGE_WIDTH - 2 * MARGIN
+    y = MARGIN
+
+    for line in wrap_text(artwork.get("title", "Untitled"), 18, usable):
+        page.text(MARGIN, y, line, 18, "F1", PURPLE)
+        y += 22.7
+    if artwork.get("artist"):
+        for line in wrap_text(f"by {artwork['artist']}", 13, usable):
+            page.text(MARGIN, y, line, 13, "F3", SLATE)
+            y += 19.8
+    y += 14.2
+
+    if image is not None:
+        name, px_w, px_h = image
+        # Fit inside the same box the browser export used, keeping the aspect ratio
+        scale = min(usable / px_w, IMAGE_BOX_HEIGHT / px_h)
+        width, height = px_w * scale, px_h * scale
+        page.image(name, MARGIN + (usable - width) / 2, y, width, height)
+        y += height + 28.3
+    else:
+        y += 14.2
+
+    page.text(MARGIN, y, format_inr(artwork.get("price", 0)), 16, "F1", TEAL)
+    y += 28.3
+
+    def field(label: str, value: str, indent: float):
+        nonlocal y
+        page.text(MARGIN, y, label, 11, "F2", DARK)
+        for line in wrap_text(value, 11, usable - indent):
+            page.text(MARGIN + indent, y, line, 11, "F1", GREY)
+            y += 17
+
+    field("Medium:", artwork.get("medium", ""), 62)
+    if artwork.get("dimensions"):
+        field("Dimensions:", artwork["dimensions"], 79)
+    if artwork.get("period"):
+        page.text(MARGIN, y, format_period(artwork["period"]), 11, "F1", GREY)
+        y += 17
+    for label, key, indent in (("Style:", "style", 45), ("Colors:", "colors", 51), ("Mood:", "mood", 45)):
+        if artwork.get(key):
+            field(label, ", ".join(artwork[key]), indent)
+
+    page.centered(PAGE_HEIGHT - 28.3, f"Page {page_number} of {total_pages}", 9, "F1", LIGHT)
+    return page
+
+
+def build_pdf(artworks: List[Dict], image_paths: List[Optional[str]],
+              generated_on: Optional[datetime.date] = None) -> Iterator[bytes]:
+    """Yield a complete PDF: a cover page, then one page per artwork.
+
+    image_paths[i] is a JPEG file for artworks[i] (or None to leave the image out).
+    """
+    writer = PdfWriter()
+    generated_on = generated_on or datetime.date.today()
+    total_pages = len(artworks) + 1
+
+    catalog_id = writer.reserve()
+    pages_id = writer.reserve()
+    info_id = writer.reserve()
+    font_ids = {name: writer.reserve() for name in FONTS}
+    page_ids: List[int] = []
+
+    yield writer.emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    yield writer.obj(catalog_id, b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+    yield writer.obj(info_id, b"<< /Title %s /Producer (Canvas Curator AI) >>" % _pdf_string("Artwork Recommendations"))
+    for name, base_font in FONTS.items():
+        yield writer.obj(font_ids[name], b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>" % base_font.encode())
+    font_resources = b" ".join(b"/%s %d 0 R" % (name.encode(), obj_id) for name, obj_id in font_ids.items())
+
+    def page_objects(page: _Page, xobjects: bytes = b"") -> Iterator[bytes]:
+        page_id = writer.reserve()
+        content_id = writer.reserve()
+        page_ids.append(page_id)
+        content = page.content()
+        yield writer.obj(content_id, b"<< /Length %d >>" % len(content), content)
+        yield writer.obj(page_id, b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] "
+                                  b"/Resources << /Font << %s >> %s>> /Contents %d 0 R >>" % (
+                                      pages_id, PAGE_WIDTH, PAGE_HEIGHT, font_resources, xobjects, content_id))
+
+    # Cover page
+    cover = _Page()
+    y = PAGE_HEIGHT / 2 - 85
+    cover.centered(y, "Canvas Curator AI", 28, "F1", PURPLE)
+    cover.centered(y + 34, "Artwork Recommendations", 16, "F1", GREY)
+    cover.centered(y + 76.5, f"Generated on: {generated_on.strftime('%d/%m/%Y')}", 12, "F1", GREY)
+    yield from page_objects(cover)
+
+    for index, artwork in enumerate(artworks):
+        image = None
+        xobjects = b""
+        path = image_paths[index] if index < len(image_paths) else None
+        try:
+            info = jpeg_info(path) if path else None
+            color_space = {1: b"/DeviceGray", 3: b"/DeviceRGB"}.get(info[2]) if info else None
+            data = None
+            if color_space:
+                with open(path, "rb") as f:
+                    data = f.read()
+        except OSError:
+            # Evicted from the cache since it was resolved - leave the image out
+            data = None
+        if data is not None:
+            width, height, _ = info
+            image_id = writer.reserve()
+            name = f"Im{index}"
+            yield writer.obj(image_id, b"<< /Type /XObject /Subtype /Image /Width %d /Height %d "
+                                       b"/ColorSpace %s /BitsPerComponent 8 /Filter /DCTDecode /Length %d >>" % (
+                                           width, height, color_space, len(data)), data)
+            image = (name, width, height)
+            xobjects = b"/XObject << /%s %d 0 R >> " % (name.encode(), image_id)
+            data = None
+        yield from page_objects(_artwork_page(artwork, index + 2, total_pages, image), xobjects)
+
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    yield writer.obj(pages_id, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids)))
+    yield writer.trailer(catalog_id, info_id)
+
+
+class PdfExporter:
+    """Builds catalogue PDFs from cached derivatives and caches the results on disk"""
+
+    def __init__(self, derivatives: DerivativeStore, directory: str = PDF_CACHE_DIR,
+                 disk_bytes: int = int(PDF_CACHE_DISK_MB * 1024 * 1024)):
+        self.derivatives = derivatives
+        self.images = derivatives.images
+        self.disk = DiskCache(directory, disk_bytes)
+        # key -> future resolving to the cached PDF path, or None if generation failed
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.generated = 0
+
+    def document_key(self, artworks: List[Dict], generated_on: datetime.date) -> str:
+        """Depends on the full artwork data, so a price or image change yields a new document"""
+        payload = json.dumps({"date": generated_on.isoformat(), "artworks": artworks}, sort_keys=True)
+        return cache_key(payload)
+
+    def cached_path(self, key: str) -> Optional[str]:
+        entry = self.disk.lookup(key)
+        if entry is not None and os.path.exists(self.disk.body_path(key)):
+            return self.disk.body_path(key)
+        return None
+
+    async def _image_path(self, url: str, semaphore: asyncio.Semaphore) -> Optional[str]:
+        """JPEG for a PDF page: the pdf derivative, or the original when Pillow isn't installed"""
+        if not url:
+            return None
+        async with semaphore:
+            try:
+                try:
+                    _, path = await asyncio.wait_for(self.derivatives.get(url, "pdf", "jpeg"), PDF_IMAGE_TIMEOUT)
+                except DerivativeUnavailable:
+                    # build_pdf skips anything that isn't a JPEG
+                    original = await asyncio.wait_for(self.images.get(url, load_body=False), PDF_IMAGE_TIMEOUT)
+                    path = self.images.disk_path(original)
+                return path
+            except Exception as e:
+                print(f"PDF export: image unavailable for {url}: {e}")
+                return None
+
+    async def export(self, artworks: List[Dict]) -> str:
+        """Path of the cached PDF for these artworks, generating it first if needed.
+
+        Concurrent requests for the same set share one generation. The document
+        is complete on disk before anyone is handed its path, so the
+        single-flight slot never outlives this call.
+        """
+        generated_on = datetime.date.today()
+        key = self.document_key(artworks, generated_on)
+
+        path = self.cached_path(key)
+        if path is None and key in self._inflight:
+            # Same set already being generated - wait for it rather than building twice
+            path = await asyncio.shield(self._inflight[key])
+        if path is not None:
+            record_cache("pdf_export", True)
+            return path
+        record_cache("pdf_export", False)
+
+        self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            semaphore = asyncio.Semaphore(PDF_IMAGE_CONCURRENCY)
+            with span("pdf_images"):
+                image_paths = await asyncio.gather(
+                    *(self._image_path(art.get("image_url"), semaphore) for art in artworks)
+                )
+            path = await self._generate(key, artworks, list(image_paths), generated_on)
+            return path
+        finally:
+            self._finish(key, path)
+
+    def _finish(self, key: str, path: Optional[str]):
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(path)
+
+    async def _generate(self, key: str, artworks: List[Dict], image_paths: List[Optional[str]],
+                        generated_on: datetime.date) -> str:
+        """Write the PDF into the cache from the threadpool, one object at a time; returns its path"""
+        tmp_path = self.disk.temp_path(key)
+        try:
+            with span("pdf_render"):
+                size = await asyncio.to_thread(_write_chunks, build_pdf(artworks, image_paths, generated_on), tmp_path)
+            entry = CachedImage(key, f"pdf:{key}", "application/pdf", size)
+            await asyncio.to_thread(self.disk.commit, entry, tmp_path)
+            self.generated += 1
+            return self.disk.body_path(key)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def stats(self) -> Dict:
+        return {
+            "items": len(self.disk),
+            "bytes": self.disk.bytes,
+            "generated": self.generated,
+            "inflight": len(self._inflight),
+        }
+
+
+def _write_chunks(chunks: Iterator[bytes], path: str) -> int:
+    size = 0
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+            size += len(chunk)
+    return size
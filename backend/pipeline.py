@@ -0,0 +1,446 @@
+"""
+Streaming ingestion pipeline shared by the catalog scripts
+
+A pipeline is a source, a list of stages and a sink:
+
+    source (search / curated ids / local dump) -> fetch -> verify image
+        -> transform -> enrich -> sink
+
+Items are dicts that flow through the stages. Each has a "key" (e.g.
+"object:436535") and an "index" (its position in the source). A stage is a
+function, sync or async, that returns the item to pass on or None to drop it.
+Stages are connected by bounded asyncio queues and each runs with its own
+concurrency, so a slow step (fetching) can be wide while a cheap one
+(transforming) stays single. Memory stays bounded by the queue sizes
+whatever the catalog size.
+
+With a Checkpoint, each item that reaches the sink (or is dropped by a stage)
+is recorded under its key. A resumed run replays recorded items straight
+into the sink and skips dropped ones, so only unfinished work is redone.
+"""
+import asyncio
+import inspect
+import json
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Union
+
+from catalog_io import CatalogWriter
+from image_verify import ImageVerifier
+from met_api import AsyncMetClient, Checkpoint
+
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "64"))
+
+_END = object()
+
+Item = Dict[str, Any]
+
+
+class Stage:
+    """One pipeline step: func(item) returns the item to pass on, or None to drop it"""
+
+    def __init__(self, name: str, func: Callable[[Item], Any], concurrency: int = 1):
+        self.name = name
+        self.func = func
+        self.concurrency = max(1, concurrency)
+        self.seen = 0
+        self.passed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.busy = 0.0
+
+    async def process(self, item: Item) -> Optional[Item]:
+        self.seen += 1
+        start = time.perf_counter()
+        try:
+            result = self.func(item)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        finally:
+            self.busy += time.perf_counter() - start
+
+    def summary(self) -> str:
+        return (f"{self.name:10} x{self.concurrency:<3} {self.seen:6} in, {self.passed:6} out, "
+                f"{self.dropped:5} dropped, {self.failed:4} failed, {self.busy:7.1f}s busy")
+
+
+class Pipeline:
+    """Runs items from `source` through `stages` into `sink`.
+
+    `sink(item)` may return False to reject an item (e.g. a quota is full);
+    anything else counts as delivered. The run stops early once `limit` items
+    have been delivered.
+    """
+
+    def __init__(self, source: Union[Iterable[Item], AsyncIterator[Item]], stages: List[Stage],
+                 sink: Callable[[Item], Any], checkpoint: Optional[Checkpoint] = None,
+                 limit: Optional[int] = None, queue_size: int = PIPELINE_QUEUE_SIZE):
+        self.source = source
+        self.stages = stages
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.limit = limit
+        self.queue_size = queue_size
+        self.delivered = 0
+        self.resumed = 0
+
+    async def _source_items(self) -> AsyncIterator[Item]:
+        if hasattr(self.source, "__aiter__"):
+            async for item in self.source:
+                yield item
+        else:
+            for item in self.source:
+                yield item
+
+    def _record(self, item: Item, delivered: bool):
+        if self.checkpoint is not None and item.get("key") is not None:
+            # Raw API payloads are re-fetchable from the response cache; keep the checkpoint small
+            self.checkpoint.record(item["key"], {k: v for k, v in item.items() if k != "data"} if delivered else None)
+
+    async def run(self) -> int:
+        """Run to completion (or `limit`); returns the number of items delivered to the sink"""
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+
+        async def feed():
+            cancelled = False
+            try:
+                async for item in self._source_items():
+                    key = item.get("key")
+                    if self.checkpoint is not None and key is not None and key in self.checkpoint:
+                        stored = self.checkpoint.get(key)
+                        if stored is not None:
+                            self.resumed += 1
+                            await queues[-1].put(dict(stored, resumed=True))
+                        continue
+                    await queues[0].put(item)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            finally:
+                # A failing source still ends the stream, so the stages wind down; run() re-raises its error
+                if not cancelled:
+                    for _ in range(self.stages[0].concurrency if self.stages else 1):
+                        await queues[0].put(_END)
+
+        async def worker(index: int):
+            stage, inbox, outbox = self.stages[index], queues[index], queues[index + 1]
+            while True:
+                item = await inbox.get()
+                if item is _END:
+                    return
+                try:
+                    result = await stage.process(item)
+                except Exception as e:
+                    # Transient failures aren't checkpointed, so a resumed run retries them
+                    stage.failed += 1
+                    print(f"  ✗ {stage.name} {item.get('key')}: {str(e)[:80]}")
+                    continue
+                if result is None:
+                    stage.dropped += 1
+                    self._record(item, False)
+                    continue
+                stage.passed += 1
+                await outbox.put(result)
+
+        async def run_stage(index: int):
+            await asyncio.gather(*(worker(index) for _ in range(self.stages[index].concurrency)))
+            following = self.stages[index + 1].concurrency if index + 1 < len(self.stages) else 1
+            for _ in range(following):
+                await queues[index + 1].put(_END)
+
+        async def drain():
+            while True:
+                item = await queues[-1].get()
+                if item is _END:
+                    return
+                accepted = self.sink(item)
+                if inspect.isawaitable(accepted):
+                    accepted = await accepted
+                if accepted is False:
+                    continue
+                if not item.get("resumed"):
+                    self._record(item, True)
+                self.delivered += 1
+                if self.limit is not None and self.delivered >= self.limit:
+                    return
+
+        tasks = [asyncio.ensure_future(feed())]
+        tasks += [asyncio.ensure_future(run_stage(i)) for i in range(len(self.stages))]
+        draining = asyncio.ensure_future(drain())
+        try:
+            # The first task to fail (source, stage loop or sink) stops the run with its error
+            pending = {draining, *tasks}
+            while not draining.done():
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is not None:
+                        raise task.exception()
+            for task in tasks:
+                if task.done() and not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+        finally:
+            draining.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return self.delivered
+
+    def summary(self) -> str:
+        lines = [stage.summary() for stage in self.stages]
+        lines.append(f"{'sink':10}      {self.delivered:6} delivered ({self.resumed} from checkpoint)")
+        return "\n".join(lines)
+
+
+# --- Sources ---------------------------------------------------------------
+
+def object_item(index: int, object_id: int, **extra) -> Item:
+    return {"key": f"object:{object_id}", "index": index, "object_id": object_id, **extra}
+
+
+async def search_source(met: AsyncMetClient, queries: List[str], per_query: int,
+                        checkpoint: Optional[Checkpoint] = None, sample: bool = True,
+                        **search_params) -> AsyncIterator[Item]:
+    """Object ids from Met searches: a random sample (or the first `per_query`) of each query's results.
+
+    The searches run concurrently; the chosen ids are checkpointed as the
+    "plan" so a resumed run works through the same list. A plan with failed
+    searches isn't checkpointed, so a resumed run searches again.
+    """
+    plan = checkpoint.get("plan") if checkpoint is not None else None
+    if plan is None:
+        failed = []
+
+        async def search(query):
+            print(f"Searching for: {query}")
+            try:
+                return await met.search(query, **search_params)
+            except Exception as e:
+                print(f"Error searching for {query}: {e}")
+                failed.append(query)
+                return []
+
+        seen, plan = set(), []
+        for query, object_ids in zip(queries, await asyncio.gather(*(search(q) for q in queries))):
+            chosen = random.sample(object_ids, min(per_query, len(object_ids))) if sample else object_ids[:per_query]
+            for obj_id in chosen:
+                if obj_id not in seen:
+                    seen.add(obj_id)
+                    plan.append([obj_id, query])
+        if checkpoint is not None and not failed:
+            checkpoint.record("plan", plan)
+
+    for index, (obj_id, query) in enumerate(plan):
+        yield object_item(index, obj_id, query=query)
+
+
+def id_source(configs: List[Dict], id_field: str = "met_id") -> Iterable[Item]:
+    """Items for a curated list of configs, each carrying its config; duplicate ids are skipped"""
+    seen = set()
+    for index, config in enumerate(configs):
+        obj_id = config[id_field]
+        if obj_id in seen:
+            continue
+        seen.add(obj_id)
+        yield object_item(index, obj_id, config=config)
+
+
+def dump_source(path: str) -> Iterable[Item]:
+    """Met object records from a local JSON array or JSONL file; they skip the fetch stage"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            records = (json.loads(line) for line in f if line.strip())
+            for index, data in enumerate(records):
+                yield object_item(index, data["objectID"], data=data)
+            return
+        for index, data in enumerate(json.load(f)):
+            yield object_item(index, data["objectID"], data=data)
+
+
+# MetObjects.csv column -> Met API field, for the columns the transforms read
+CSV_COLUMNS = {
+    "Object ID": "objectID",
+    "Is Public Domain": "isPublicDomain",
+    "Department": "department",
+    "Object Name": "objectName",
+    "Title": "title",
+    "Culture": "culture",
+    "Period": "period",
+    "Artist Display Name": "artistDisplayName",
+    "Artist End Date": "artistEndDate",
+    "Object Date": "objectDate",
+    "Medium": "medium",
+    "Dimensions": "dimensions",
+    "Credit Line": "creditLine",
+    "Classification": "classification",
+    "Tags": "tags",
+}
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "20000"))
+
+
+def pandas_available() -> bool:
+    try:
+        import pandas  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _csv_chunks_pandas(path: str, chunk_rows: int, public_domain: bool, classifications: List[str],
+                       departments: List[str], keywords: Optional[str]) -> Iterable[List[Dict]]:
+    import pandas as pd
+
+    reader = pd.read_csv(path, chunksize=chunk_rows, usecols=list(CSV_COLUMNS), dtype=str,
+                         keep_default_na=False, encoding="utf-8-sig")
+    for chunk in reader:
+        mask = pd.Series(True, index=chunk.index)
+        if public_domain:
+            mask &= chunk["Is Public Domain"].str.lower() == "true"
+        if classifications:
+            mask &= chunk["Classification"].str.lower().isin(classifications)
+        if departments:
+            mask &= chunk["Department"].str.lower().isin(departments)
+        if keywords:
+            text = chunk["Title"] + " " + chunk["Object Name"] + " " + chunk["Tags"]
+            mask &= text.str.contains(keywords, case=False, regex=True)
+        yield chunk[mask].rename(columns=CSV_COLUMNS).to_dict("records")
+
+
+def _csv_chunks_stdlib(path: str, chunk_rows: int, public_domain: bool, classifications: List[str],
+                       departments: List[str], keywords: Optional[str]) -> Iterable[List[Dict]]:
+    import csv
+    import re
+
+    csv.field_size_limit(1 << 24)
+    pattern = re.compile(keywords, re.IGNORECASE) if keywords else None
+
+    def keep(row):
+        return ((not public_domain or row["Is Public Domain"].lower() == "true")
+                and (not classifications or row["Classification"].lower() in classifications)
+                and (not departments or row["Department"].lower() in departments)
+                and (pattern is None or pattern.search(f"{row['Title']} {row['Object Name']} {row['Tags']}")))
+
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        chunk = []
+        for row in csv.DictReader(f):
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                yield [{CSV_COLUMNS[c]: row.get(c) or "" for c in CSV_COLUMNS} for row in chunk if keep(row)]
+                chunk = []
+        yield [{CSV_COLUMNS[c]: row.get(c) or "" for c in CSV_COLUMNS} for row in chunk if keep(row)]
+
+
+async def csv_source(path: str, public_domain: bool = True, classifications: Iterable[str] = (),
+                     departments: Iterable[str] = (), keywords: Optional[str] = None,
+                     chunk_rows: int = CSV_CHUNK_ROWS) -> AsyncIterator[Item]:
+    """Met records from a local copy of the Met's open-access MetObjects.csv dump.
+
+    The file is read `chunk_rows` rows at a time, off the event loop, so memory
+    stays at one chunk whatever the file size. pandas is an optional dependency:
+    when it is installed each chunk is filtered vectorized, otherwise row by row
+    with the csv module. Rows are kept when they are public domain
+    (only those have images), in one of `classifications`/`departments` if given,
+    and match the `keywords` regex in title, object name or tags. The dump has no
+    image URLs; add the image_lookup stage to fill them in.
+    """
+    read = _csv_chunks_pandas if pandas_available() else _csv_chunks_stdlib
+    chunks = iter(read(path, chunk_rows, public_domain, [c.lower() for c in classifications],
+                       [d.lower() for d in departments], keywords))
+    index = 0
+    while True:
+        records = await asyncio.to_thread(next, chunks, None)
+        if records is None:
+            return
+        for data in records:
+            data["objectID"] = int(data["objectID"])
+            yield object_item(index, data["objectID"], data=data)
+            index += 1
+
+
+# --- Stages ----------------------------------------------------------------
+
+def met_fetch(met: AsyncMetClient) -> Callable[[Item], Any]:
+    """Fetch stage: attach the Met object record as item["data"]; drops objects that don't exist"""
+    async def fetch(item: Item) -> Optional[Item]:
+        if item.get("data") is None:
+            item["data"] = await met.get_object(item["object_id"])
+        return item if item["data"] else None
+    return fetch
+
+
+def image_lookup(met: AsyncMetClient) -> Callable[[Item], Any]:
+    """Fill in primaryImage/primaryImageSmall for records that came without them (e.g. the CSV dump)"""
+    async def lookup(item: Item) -> Optional[Item]:
+        if not item["data"].get("primaryImage"):
+            record = await met.get_object(item["object_id"])
+            if not record:
+                return None
+            for field in ("primaryImage", "primaryImageSmall"):
+                item["data"][field] = record.get(field, "")
+        return item
+    return lookup
+
+
+def require_image(item: Item) -> Optional[Item]:
+    """Drop objects without a primary image before spending a request on verifying it"""
+    return item if item["data"].get("primaryImage") else None
+
+
+def image_verifier(verifier: ImageVerifier) -> Callable[[Item], Any]:
+    """Verify stage: keep items whose primaryImage loads (recently verified URLs aren't rechecked)"""
+    async def verify(item: Item) -> Optional[Item]:
+        result = await verifier.check(item["data"]["primaryImage"])
+        return item if result["ok"] else None
+    return verify
+
+
+def transformer(transform: Callable[[Item], Optional[Dict]]) -> Callable[[Item], Optional[Item]]:
+    """Transform (or enrich) stage: item["record"] = transform(item); drops the item when it returns None"""
+    def apply(item: Item) -> Optional[Item]:
+        record = transform(item)
+        if record is None:
+            return None
+        item["record"] = record
+        return item
+    return apply
+
+
+# --- Sinks -----------------------------------------------------------------
+
+class CollectSink:
+    """Collects delivered items, optionally appending each record to a JSONL file as it arrives.
+
+    Given a CatalogWriter, records go straight into the catalog being written
+    (in arrival order) instead of being held in memory.
+    """
+
+    def __init__(self, jsonl_path: Optional[str] = None, accept: Optional[Callable[[Item], bool]] = None,
+                 writer: Optional[CatalogWriter] = None):
+        self.items: List[Item] = []
+        self.accept = accept
+        self.writer = writer
+        self.count = 0
+        self.jsonl = open(jsonl_path, "a", encoding="utf-8") if jsonl_path else None
+
+    def __call__(self, item: Item) -> bool:
+        if self.accept is not None and not self.accept(item):
+            return False
+        self.count += 1
+        if self.writer is not None:
+            self.writer.write(item["record"])
+        else:
+            self.items.append(item)
+        if self.jsonl is not None and not item.get("resumed"):
+            self.jsonl.write(json.dumps(item["record"], ensure_ascii=False) + "\n")
+            self.jsonl.flush()
+        return True
+
+    def records(self, ordered: bool = True) -> List[Dict]:
+        """Collected records, in source order unless ordered=False (arrival order)"""
+        items = sorted(self.items, key=lambda item: item["index"]) if ordered else self.items
+        return [item["record"] for item in items]
+
+    def close(self):
+        if self.jsonl is not None:
+            self.jsonl.close()
@@ -0,0 +1,180 @@
+"""
+Background pre-warming of the image cache for the whole catalog
+
+Without it, the first visitor to see an artwork waits for a cold fetch from
+the Met image servers. CatalogPrewarmer walks every image_url and
+thumbnail_url in the catalog and loads it into the proxy's ImageCache (plus
+the card derivative the frontend shows), a few at a time and under a token
+bucket so the Met servers aren't hammered. It runs as a background task at
+startup and after each catalog reload, so it never delays readiness, and
+records which URLs are dead.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional, Set
+
+import httpx
+
+from image_cache import ImageCache
+from image_derivatives import DerivativeStore, DerivativeUnavailable
+from ratelimit import TokenBucket
+
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "true").lower() in ("1", "true", "yes")
+PREWARM_CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", "4"))
+PREWARM_RATE_PER_SECOND = float(os.getenv("PREWARM_RATE_PER_SECOND", "5"))
+PREWARM_TIMEOUT = float(os.getenv("PREWARM_TIMEOUT", "60"))
+# size.fmt derivatives to render for each image_url, e.g. "card.webp,thumb.jpeg"; empty to skip
+PREWARM_DERIVATIVES = [d for d in os.getenv("PREWARM_DERIVATIVES", "card.webp").split(",") if d]
+PREWARM_REPORT = os.getenv("PREWARM_REPORT", "../cache/prewarm.json")
+
+
+def catalog_urls(artworks: List[Dict]) -> Dict[str, List[str]]:
+    """Distinct image URLs in catalog order -> ids of the artworks that use them"""
+    urls: Dict[str, List[str]] = {}
+    for art in artworks:
+        for field in ("image_url", "thumbnail_url"):
+            url = art.get(field)
+            if url:
+                ids = urls.setdefault(url, [])
+                if art.get("id") not in ids:
+                    ids.append(art.get("id"))
+    return urls
+
+
+def _describe_error(e: Exception) -> str:
+    if isinstance(e, httpx.HTTPStatusError):
+        return f"HTTP {e.response.status_code}"
+    if isinstance(e, (httpx.TimeoutException, asyncio.TimeoutError)):
+        return "timeout"
+    return f"{type(e).__name__}: {e}"
+
+
+class CatalogPrewarmer:
+    """Loads every catalog image into the cache in a background task"""
+
+    def __init__(self, images: ImageCache, derivatives: Optional[DerivativeStore] = None,
+                 concurrency: int = PREWARM_CONCURRENCY, rate: float = PREWARM_RATE_PER_SECOND,
+                 timeout: float = PREWARM_TIMEOUT, derivative_specs: List[str] = PREWARM_DERIVATIVES,
+                 report_path: Optional[str] = PREWARM_REPORT):
+        self.images = images
+        self.derivatives = derivatives
+        self.concurrency = concurrency
+        self.rate = rate
+        self.timeout = timeout
+        self.derivative_specs = [tuple(spec.split(".", 1)) for spec in derivative_specs]
+        self.report_path = report_path
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self._reset("idle", 0)
+
+    def _reset(self, state: str, total: int):
+        self.state = state
+        self.total = total
+        self.cached = 0     # already fresh in the cache
+        self.fetched = 0    # loaded from upstream by this run
+        self.failed = 0
+        self.dead: Dict[str, Dict] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    async def start(self, artworks: List[Dict]) -> asyncio.Task:
+        """(Re)start warming for this catalog in the background; a run in progress is cancelled first"""
+        await self.stop()
+        urls = catalog_urls(artworks)
+        image_urls = {art["image_url"] for art in artworks if art.get("image_url")}
+        self.runs += 1
+        self._reset("running", len(urls))
+        self.started_at = time.time()
+        self._task = asyncio.ensure_future(self._run(urls, image_urls))
+        return self._task
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self, urls: Dict[str, List[str]], image_urls: Set[str]):
+        print(f"Pre-warming {len(urls)} catalog images (concurrency {self.concurrency}, {self.rate}/s)")
+
+        bucket = TokenBucket(self.rate, capacity=self.concurrency)
+        queue: asyncio.Queue = asyncio.Queue()
+        for url in urls:
+            queue.put_nowait(url)
+
+        async def worker():
+            while True:
+                try:
+                    url = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await self._warm(url, urls[url], bucket, url in image_urls)
+                done = self.cached + self.fetched + self.failed
+                if done % 25 == 0 or done == self.total:
+                    print(f"  pre-warm {done}/{self.total} ({self.fetched} fetched, {self.failed} dead)")
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, self.concurrency))))
+            self.state = "done"
+        except asyncio.CancelledError:
+            self.state = "cancelled"
+            raise
+        finally:
+            self.finished_at = time.time()
+            await asyncio.to_thread(self._write_report)
+        print(f"✓ Pre-warm finished: {self.cached} already cached, {self.fetched} fetched, "
+              f"{self.failed} dead in {self.finished_at - self.started_at:.1f}s")
+
+    async def _warm(self, url: str, artwork_ids: List[str], bucket: TokenBucket, derive: bool):
+        try:
+            if self.images.lookup_fresh(url) is not None:
+                self.cached += 1
+            else:
+                await bucket.acquire_async()
+                await asyncio.wait_for(self.images.get(url, load_body=False), self.timeout)
+                self.fetched += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            self.dead[url] = {"error": _describe_error(e), "artwork_ids": artwork_ids, "checked_at": time.time()}
+            return
+
+        if derive and self.derivatives is not None:
+            for size, fmt in self.derivative_specs:
+                try:
+                    await asyncio.wait_for(self.derivatives.get(url, size, fmt), self.timeout)
+                except DerivativeUnavailable:
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"  pre-warm: {size}.{fmt} derivative failed for {url}: {e}")
+
+    def _write_report(self):
+        if not self.report_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.report_path)), exist_ok=True)
+        tmp_path = f"{self.report_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({**self.status(), "dead": self.dead}, f, indent=2)
+        os.replace(tmp_path, self.report_path)
+
+    def status(self) -> Dict:
+        done = self.cached + self.fetched + self.failed
+        return {
+            "state": self.state,
+            "runs": self.runs,
+            "total": self.total,
+            "done": done,
+            "cached": self.cached,
+            "fetched": self.fetched,
+            "failed": self.failed,
+            "progress": round(done / self.total, 3) if self.total else 1.0,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
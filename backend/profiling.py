@@ -0,0 +1,209 @@
+"""
+Opt-in per-request profiling
+
+When PROFILING_ENABLED is set, ProfilingMiddleware profiles selected requests
+with cProfile - those carrying the X-Profile header, plus a random
+PROFILE_SAMPLE_RATE fraction - and keeps the most recent reports in memory for
+the /admin/profiles endpoints. When the flag is off the middleware isn't
+installed at all, so there's no per-request cost.
+
+cProfile only sees the thread it is enabled on. The middleware profiles the
+event-loop thread; sync work that runs in the threadpool is captured by
+wrapping it with run_profiled(). Other coroutines interleaved on the loop
+while a profiled request awaits I/O also show up in its report.
+
+From Python 3.12 cProfile is built on sys.monitoring, which allows one
+active profiler per process, and that profiler sees every thread. There a
+second profiler can't be enabled, so run_profiled() leaves the function to
+the one already running.
+"""
+import cProfile
+import contextvars
+import io
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILE_PATHS = tuple(p.strip() for p in os.getenv("PROFILE_PATHS", "/chat,/proxy-image").split(",") if p.strip())
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "50"))
+
+_current: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar("request_profile", default=None)
+
+
+class RequestProfile:
+    """cProfile data collected for one request, possibly across several threads"""
+
+    def __init__(self, method: str, path: str, query: str, trigger: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.query = query
+        self.trigger = trigger
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.status: Optional[int] = None
+        self.profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def add(self, profile: cProfile.Profile):
+        with self._lock:
+            self.profiles.append(profile)
+
+    def stats(self) -> pstats.Stats:
+        with self._lock:
+            profiles = list(self.profiles)
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def report(self, sort: str = "cumulative", limit: int = 40) -> str:
+        """Human-readable pstats report"""
+        out = io.StringIO()
+        stats = self.stats()
+        stats.stream = out
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def dump(self) -> bytes:
+        """Raw pstats data, loadable with pstats/snakeviz"""
+        return marshal.dumps(self.stats().stats)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "query": self.query,
+            "trigger": self.trigger,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2),
+        }
+
+
+class ProfileStore:
+    """Bounded in-memory store of recent request profiles"""
+
+    def __init__(self, max_items: int = PROFILE_MAX_STORED):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, RequestProfile]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self._items[profile.id] = profile
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        with self._lock:
+            return self._items.get(profile_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = list(self._items.values())
+        return [p.summary() for p in reversed(items)]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+store = ProfileStore()
+
+# cProfile hooks are per thread and the event loop is one thread, so only one
+# request at a time can be profiled there
+_loop_busy = False
+
+
+def run_profiled(func: Callable, *args, **kwargs):
+    """Call func, profiling it on the current thread if the request is being profiled"""
+    request_profile = _current.get()
+    if request_profile is None:
+        return func(*args, **kwargs)
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # "Another profiling tool is already active" (3.12+): the request's profiler covers this thread too
+        return func(*args, **kwargs)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profile.disable()
+        request_profile.add(profile)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles header-triggered or sampled requests"""
+
+    def __init__(self, app, token: Optional[str] = None, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 paths=PROFILE_PATHS, header: str = PROFILE_HEADER):
+        self.app = app
+        self.token = token
+        self.sample_rate = sample_rate
+        self.paths = tuple(paths)
+        self.header = header.lower().encode("latin-1")
+
+    def _trigger(self, scope) -> Optional[str]:
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return None
+        for name, value in scope.get("headers", ()):
+            if name == self.header:
+                # With an admin token configured only callers who know it can trigger a profile
+                if value and (not self.token or value.decode("latin-1") == self.token):
+                    return "header"
+                break
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        global _loop_busy
+        trigger = self._trigger(scope)
+        if trigger is None or _loop_busy:
+            await self.app(scope, receive, send)
+            return
+        _loop_busy = True
+
+        request_profile = RequestProfile(
+            scope.get("method", ""), scope["path"], scope.get("query_string", b"").decode("latin-1"), trigger
+        )
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                request_profile.status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", request_profile.id.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # A threadpool call of an earlier profiled request is still running (3.12+)
+            _loop_busy = False
+            await self.app(scope, receive, send)
+            return
+        token = _current.set(request_profile)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile.disable()
+            _loop_busy = False
+            request_profile.duration = time.perf_counter() - start
+            _current.reset(token)
+            request_profile.add(profile)
+            store.add(request_profile)
@@ -0,0 +1,69 @@
+"""
+Rate limiting primitives shared by the API and the data scripts
+"""
+import asyncio
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Token bucket: refills `rate` tokens per second, holds at most `capacity`"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """Take `tokens` if available and return 0, otherwise return seconds to wait"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """Block until `tokens` are taken; False if that would exceed `timeout` seconds"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0.0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or wait > remaining:
+                    return False
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """acquire() for coroutines: waits with asyncio.sleep instead of blocking the loop"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0.0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or wait > remaining:
+                    return False
+            await asyncio.sleep(wait)
+
+    @property
+    def available(self) -> float:
+        """Tokens currently in the bucket"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
@@ -1,49 +1,247 @@
-import json
-from typing import List, Dict, Any
+import heapq
+import os
+import threading
+from collections import Counter
+import numpy as np
+from typing import Iterable, List, Dict, Any, Optional
+from catalog_io import CATALOG_PATH, CatalogReader, CatalogUpdates, iter_catalog
+from metrics import span
+from serialization import dumps
+
+# "json" loads the catalog file into memory; "sqlite" queries CATALOG_DB
+CATALOG_BACKEND = os.getenv("CATALOG_BACKEND", "json").lower()
+
+# Values PATCH /artworks/{id} accepts; only "available" works are recommended
+AVAILABILITY = ("available", "reserved", "sold")
+
+
+def is_available(artwork: Dict) -> bool:
+    return artwork.get('availability', 'available') == 'available'
+
+
+class PriceRange:
+    """Min and max of a changing multiset of prices, with O(log n) add/remove.
+
+    A count per price plus a min-heap and a max-heap of the distinct prices.
+    Removed prices are dropped lazily when they reach the top of a heap, and a
+    heap is rebuilt once it holds twice as many entries as there are live
+    prices, so its size and the cost per update stay bounded.
+    """
+
+    def __init__(self, prices: Iterable[float] = ()):
+        self._counts = Counter(prices)
+        self._rebuild()
+
+    def _rebuild(self):
+        self._low = list(self._counts)
+        self._high = [-price for price in self._counts]
+        heapq.heapify(self._low)
+        heapq.heapify(self._high)
+
+    def add(self, price: float):
+        self._counts[price] += 1
+        if self._counts[price] == 1:
+            heapq.heappush(self._low, price)
+            heapq.heappush(self._high, -price)
+
+    def remove(self, price: float):
+        self._counts[price] -= 1
+        if self._counts[price] <= 0:
+            del self._counts[price]
+            while self._low and self._low[0] not in self._counts:
+                heapq.heappop(self._low)
+            while self._high and -self._high[0] not in self._counts:
+                heapq.heappop(self._high)
+            if len(self._low) > 2 * len(self._counts) + 64:
+                self._rebuild()
+
+    def min(self) -> float:
+        return self._low[0] if self._low else 0
+
+    def max(self) -> float:
+        return -self._high[0] if self._high else 0
+
 
 class ArtworkRecommender:
-    def __init__(self, artworks_path: str = "../data/artworks.json"):
-        with open(artworks_path, 'r', encoding='utf-8') as f:
-            self.artworks = json.load(f)
+    def __init__(self, artworks_path: str = CATALOG_PATH):
+        self.artworks_path = artworks_path
+        self._lock = threading.Lock()
+        self.updates = CatalogUpdates(artworks_path)
+        self.reload()
 
-    def filter_artworks(self, filters: Dict[str, Any]) -> List[Dict]:
-        """Filter artworks based on user preferences"""
-        results = self.artworks.copy()
+    def count(self) -> int:
+        return len(self.artworks)
+
+    def reload(self):
+        """Re-read the artworks file; the new catalog replaces the old one only once fully loaded.
+
+        A .jsonl catalog is streamed line by line, and changes recorded by
+        update_artwork are applied on top. version is the published manifest
+        version (see catalog_io.py), or a checksum if there is none, plus the
+        number of changes applied since.
+        """
+        # Held throughout so an update can't land between reading the change log and swapping catalogs
+        with self._lock:
+            reader = CatalogReader(self.artworks_path)
+            artworks = list(reader)
+            changes = self.updates.load()
+            for i, art in enumerate(artworks):
+                if art['id'] in changes:
+                    artworks[i] = {**art, **changes[art['id']]}
+
+            facets = {'style': set(), 'colors': set(), 'mood': set()}
+            for art in artworks:
+                for field, values in facets.items():
+                    values.update(art[field])
+
+            self.artworks, self.by_id, self._columns = artworks, {art['id']: art for art in artworks}, self._build_columns(artworks)
+            self._positions = {art['id']: i for i, art in enumerate(artworks)}
+            # Prices of available works, so the price range stays current under updates
+            self._prices = PriceRange(art['price'] for art in artworks if is_available(art))
+            self._facets = {field: sorted(values) for field, values in facets.items()}
+            self._json: Dict[str, tuple] = {}
+            self._base_version, self._revision = reader.version(), self.updates.count
+            self.version = f"{self._base_version}+{self._revision}" if self._revision else self._base_version
+
+    @staticmethod
+    def _build_columns(artworks: List[Dict]) -> tuple:
+        """Numpy columns that filter_artworks scans instead of the records.
+
+        (artworks, available flags, prices, {field: [(lowercased value, mask)]}).
+        Scans never touch the record objects, so in forked workers (serve.py)
+        the pages holding the catalog stay shared.
+        """
+        available = np.array([is_available(art) for art in artworks], dtype=bool)
+        prices = np.array([art['price'] for art in artworks], dtype=np.float64)
+        facets = {}
+        for field in ('style', 'colors', 'mood'):
+            positions: Dict[str, List[int]] = {}
+            for i, art in enumerate(artworks):
+                for value in art[field]:
+                    positions.setdefault(value, []).append(i)
+            masks = []
+            for value in sorted(positions):
+                mask = np.zeros(len(artworks), dtype=bool)
+                mask[positions[value]] = True
+                masks.append((value.lower(), mask))
+            facets[field] = masks
+        return artworks, available, prices, facets
+
+    def _apply(self, artwork_id: str, changes: Dict[str, Any]) -> Optional[Dict]:
+        # Caller holds the lock
+        old = self.by_id.get(artwork_id)
+        if old is None:
+            return None
+        new = {**old, **changes}
+        if is_available(old):
+            self._prices.remove(old['price'])
+        if is_available(new):
+            self._prices.add(new['price'])
+        position = self._positions[artwork_id]
+        _, available, prices, _ = self._columns
+        available[position], prices[position] = is_available(new), new['price']
+        self.artworks[position] = new
+        self.by_id[artwork_id] = new
+        return new
+
+    def update_artwork(self, artwork_id: str, changes: Dict[str, Any]) -> Optional[Dict]:
+        """Change an artwork's price and/or availability in place; returns the updated artwork, None if unknown.
+
+        The artwork is replaced by an updated copy rather than mutated, so
+        concurrent readers see either the old or the new record, never a mix.
+        Costs a dict lookup plus O(log n) heap updates in the price index. Changes
+        other processes logged first are applied before this one.
+        """
+        with self._lock, self.updates.locked():
+            for other_id, other_changes in self.updates.read_new():
+                self._apply(other_id, other_changes)
+            new = self._apply(artwork_id, changes)
+            if new is not None:
+                self.updates.record(artwork_id, changes)
+            self._revision = self.updates.count
+            self.version = f"{self._base_version}+{self._revision}" if self._revision else self._base_version
+        return new
+
+    def sync_updates(self) -> int:
+        """Apply changes other processes have appended to the updates log; returns how many.
+
+        One stat when there is nothing new, so it is cheap enough to call per request.
+        """
+        if not self.updates.has_new():
+            return 0
+        with self._lock:
+            entries = self.updates.read_new()
+            for artwork_id, changes in entries:
+                self._apply(artwork_id, changes)
+            self._revision = self.updates.count
+            self.version = f"{self._base_version}+{self._revision}" if self._revision else self._base_version
+        return len(entries)
+
+    def warm(self):
+        """Serialize every record now, so processes forked afterwards share the bytes instead of each making their own"""
+        for art in self.artworks:
+            self.artwork_bytes(art)
+
+    def get_artwork(self, artwork_id: str) -> Optional[Dict]:
+        """Look up a single artwork by id"""
+        return self.by_id.get(artwork_id)
+
+    def artwork_bytes(self, artwork: Dict) -> bytes:
+        """The artwork as JSON, serialized once per record.
+
+        Cached with the record it was made from: update_artwork and reload put
+        new objects in place, so a stale entry never matches. Records that are
+        rebuilt per query (SQLite) are matched by value instead.
+        """
+        entry = self._json.get(artwork['id'])
+        if entry is None or (entry[0] is not artwork and entry[0] != artwork):
+            entry = (artwork, dumps(artwork))
+            self._json[artwork['id']] = entry
+        return entry[1]
+
+    @staticmethod
+    def _any_of(columns: tuple, field: str, match) -> np.ndarray:
+        """Mask of artworks with at least one `field` value (lowercased) for which match(value) holds"""
+        artworks, _, _, facets = columns
+        combined = np.zeros(len(artworks), dtype=bool)
+        for value, column in facets[field]:
+            if match(value):
+                combined |= column
+        return combined
+
+    def _match(self, columns: tuple, filters: Dict[str, Any]) -> np.ndarray:
+        """Mask of available artworks that pass every filter"""
+        _, available, prices, _ = columns
+        mask = available.copy()
 
         # Filter by style
         if filters.get('style'):
             style = filters['style'].lower()
-            results = [
-                art for art in results
-                if any(style in s.lower() for s in art['style'])
-            ]
+            mask &= self._any_of(columns, 'style', lambda value: style in value)
 
         # Filter by colors
         if filters.get('colors'):
-            user_colors = [c.lower() for c in filters['colors']]
-            results = [
-                art for art in results
-                if any(uc in [ac.lower() for ac in art['colors']] for uc in user_colors)
-            ]
+            user_colors = {c.lower() for c in filters['colors']}
+            mask &= self._any_of(columns, 'colors', lambda value: value in user_colors)
 
         # Filter by mood
         if filters.get('mood'):
             mood = filters['mood'].lower()
-            results = [
-                art for art in results
-                if any(mood in m.lower() for m in art['mood'])
-            ]
+            mask &= self._any_of(columns, 'mood', lambda value: mood in value)
 
         # Filter by price range
         if filters.get('max_price'):
-            max_price = filters['max_price']
-            results = [art for art in results if art['price'] <= max_price]
+            mask &= prices <= filters['max_price']
 
         if filters.get('min_price'):
-            min_price = filters['min_price']
-            results = [art for art in results if art['price'] >= min_price]
+            mask &= prices >= filters['min_price']
 
-        return results
+        return mask
+
+    def filter_artworks(self, filters: Dict[str, Any]) -> List[Dict]:
+        """Filter available artworks based on user preferences, in catalog order"""
+        columns = self._columns
+        return [columns[0][i] for i in np.flatnonzero(self._match(columns, filters)).tolist()]
 
     def score_artwork(self, artwork: Dict, filters: Dict[str, Any]) -> float:
         """Score artwork based on how well it matches filters"""
@@ -78,42 +276,137 @@ class ArtworkRecommender:
 
         return score
 
+    def recommend(self, filters: Dict[str, Any], limit: int = 5) -> List[Dict]:
+        """Get top N recommended artworks.
+
+        Same filters, weights and tie order as score_artwork, computed over
+        the columns so that only the returned records are touched.
+        """
+        columns = self._columns
+        artworks, _, prices, _ = columns
+        with span("recommend_filter"):
+            positions = np.flatnonzero(self._match(columns, filters))
+
+        # If no matches, return empty list (chatbot will handle with apology message)
+        if not len(positions):
+            return []
+
+        with span("recommend_score"):
+            scores = np.zeros(len(positions))
+            # Every match already passed the style and mood filters
+            if filters.get('style'):
+                scores += 3.0
+            for user_color in [c.lower() for c in filters.get('colors') or []]:
+                scores += 2.0 * self._any_of(columns, 'colors', lambda value: value == user_color)[positions]
+            if filters.get('mood'):
+                scores += 1.5
+            if filters.get('max_price'):
+                scores += prices[positions] <= filters['max_price'] * 0.8
+            top = positions[np.argsort(-scores, kind='stable')[:limit]]
+
+        return [artworks[i] for i in top.tolist()]
+
+    def get_available_filters(self) -> Dict[str, List[str]]:
+        """Get all available filter options; the price range covers available works only"""
+        min_price = self._prices.min()
+        max_price = self._prices.max()
+
+        return {
+            'styles': list(self._facets['style']),
+            'colors': list(self._facets['colors']),
+            'moods': list(self._facets['mood']),
+            'price_range': {
+                'min': min_price,
+                'max': max_price,
+                'min_lakhs': round(min_price / 100000, 1),
+                'max_lakhs': round(max_price / 100000, 1)
+            }
+        }
+
+
+class SQLiteArtworkRecommender(ArtworkRecommender):
+    """ArtworkRecommender over the SQLite catalog store: filters run as SQL, scoring is shared.
+
+    If the database doesn't exist yet it is built from the JSON catalog.
+    """
+
+    def __init__(self, artworks_path: str = CATALOG_PATH, db_path: Optional[str] = None):
+        from catalog_db import CATALOG_DB, CatalogDB
+
+        db_path = db_path or CATALOG_DB
+        created = not os.path.exists(db_path)
+        self.db = CatalogDB(db_path)
+        if created:
+            self.db.replace_all(iter_catalog(artworks_path))
+        super().__init__(artworks_path)
+
+    def reload(self):
+        """Drop the cached full list and serialized records; queries always read the database"""
+        self._artworks: Optional[List[Dict]] = None
+        self._json: Dict[str, tuple] = {}
+
+    @property
+    def version(self) -> str:
+        """Changes with every write to the database, including writes from other processes"""
+        return f"db-{self.db.version()}"
+
+    @property
+    def artworks(self) -> List[Dict]:
+        """The whole catalog, loaded on first use (pre-warming needs every image URL)"""
+        if self._artworks is None:
+            self._artworks = self.db.all()
+        return self._artworks
+
+    def count(self) -> int:
+        return self.db.count()
+
+    def get_artwork(self, artwork_id: str) -> Optional[Dict]:
+        return self.db.get(artwork_id)
+
+    def sync_updates(self) -> int:
+        """Every process reads the same database; there is nothing to catch up on"""
+        return 0
+
+    def warm(self):
+        """Queries build fresh records, so there is nothing worth serializing ahead of time"""
+
+    def update_artwork(self, artwork_id: str, changes: Dict[str, Any]) -> Optional[Dict]:
+        """Update one row in place (an indexed lookup); the change is persisted by the database itself"""
+        artwork = self.db.update(artwork_id, changes)
+        if artwork is not None:
+            self._artworks = None
+            self._json.pop(artwork_id, None)
+        return artwork
+
+    def filter_artworks(self, filters: Dict[str, Any]) -> List[Dict]:
+        return self.db.query(filters)
+
     def recommend(self, filters: Dict[str, Any], limit: int = 5) -> List[Dict]:
         """Get top N recommended artworks"""
         # First filter
-        filtered = self.filter_artworks(filters)
+        with span("recommend_filter"):
+            filtered = self.filter_artworks(filters)
 
         # If no matches, return empty list (chatbot will handle with apology message)
         if not filtered:
             return []
 
         # Score and sort
-        scored = [(art, self.score_artwork(art, filters)) for art in filtered]
-        scored.sort(key=lambda x: x[1], reverse=True)
+        with span("recommend_score"):
+            scored = [(art, self.score_artwork(art, filters)) for art in filtered]
+            scored.sort(key=lambda x: x[1], reverse=True)
 
         # Return top N
         return [art for art, score in scored[:limit]]
 
     def get_available_filters(self) -> Dict[str, List[str]]:
-        """Get all available filter options"""
-        styles = set()
-        colors = set()
-        moods = set()
-        prices = []
-
-        for art in self.artworks:
-            styles.update(art['style'])
-            colors.update(art['colors'])
-            moods.update(art['mood'])
-            prices.append(art['price'])
-
-        min_price = min(prices) if prices else 0
-        max_price = max(prices) if prices else 0
-
+        min_price, max_price = self.db.price_range()
+        min_price = min_price or 0
+        max_price = max_price or 0
         return {
-            'styles': sorted(list(styles)),
-            'colors': sorted(list(colors)),
-            'moods': sorted(list(moods)),
+            'styles': sorted(self.db.facet_values("style")),
+            'colors': sorted(self.db.facet_values("color")),
+            'moods': sorted(self.db.facet_values("mood")),
             'price_range': {
                 'min': min_price,
                 'max': max_price,
@@ -121,3 +414,10 @@ class ArtworkRecommender:
                 'max_lakhs': round(max_price / 100000, 1)
             }
         }
+
+
+def create_recommender(artworks_path: str = CATALOG_PATH, db_path: Optional[str] = None) -> ArtworkRecommender:
+    """The recommender for CATALOG_BACKEND"""
+    if CATALOG_BACKEND == "sqlite":
+        return SQLiteArtworkRecommender(artworks_path, db_path)
+    return ArtworkRecommender(artworks_path)
@@ -2,159 +2,177 @@
 Fetch fresh artworks from Met Museum API with working images
 Create a balanced collection across different categories
 """
-import json
-import requests
-from time import sleep
+import random
+import asyncio
+import argparse
+from typing import Optional
+
+import httpx
+
+from catalog_io import write_catalog
+from image_verify import ImageVerifier, VerificationLog, VERIFY_CONCURRENCY
+from met_api import AsyncMetClient, Checkpoint, MET_CONCURRENCY
+from pipeline import (CollectSink, Pipeline, Stage, image_verifier, met_fetch,
+                      object_item, require_image, transformer)
+
+# Define search criteria for balanced collection
+SEARCHES = [
+    # Portraits (5 artworks)
+    {"q": "portrait", "hasImages": "true", "departmentId": 11, "count": 5},  # European Paintings
+
+    # Landscapes (5 artworks)
+    {"q": "landscape", "hasImages": "true", "departmentId": 11, "count": 5},
+
+    # Abstract/Modern (5 artworks)
+    {"q": "abstract", "hasImages": "true", "departmentId": 21, "count": 5},  # Modern Art
+]
+
+# Price ranges for variety
+PRICE_RANGES = [
+    (180000, 220000),
+    (220000, 280000),
+    (280000, 350000),
+    (350000, 420000),
+    (420000, 500000),
+]
+
+SEARCH_DEPTH = 50  # first results considered per search
+
+async def balanced_source(met, searches, taken):
+    """The first SEARCH_DEPTH results of each search, until that search's count is filled"""
+    seen = set()
+    for group, search_config in enumerate(searches):
+        print(f"\nSearching for {search_config['q']} artworks...")
+        try:
+            object_ids = await met.search(search_config['q'], hasImages='true',
+                                          departmentId=search_config['departmentId'])
+        except Exception:
+            continue
+
+        for position, obj_id in enumerate(object_ids[:SEARCH_DEPTH]):
+            if taken[group] >= search_config['count']:
+                break
+            if obj_id in seen:
+                continue
+            seen.add(obj_id)
+            yield object_item(group * SEARCH_DEPTH + position, obj_id, group=group)
 
-MET_API_BASE = "https://collectionapi.metmuseum.org/public/collection/v1"
+def classify_style(artwork_data):
+    """Basic style classification"""
+    title = artwork_data.get('title', 'Untitled')
+    classification = artwork_data.get('classification', '').lower()
+    object_name = artwork_data.get('objectName', '').lower()
 
-def fetch_artwork_details(object_id):
-    """Fetch detailed artwork information"""
+    # Safe year extraction
     try:
-        response = requests.get(f"{MET_API_BASE}/objects/{object_id}", timeout=10)
-        if response.status_code == 200:
-            return response.json()
-    except:
-        pass
-    return None
-
-def create_balanced_collection():
+        artist_end = int(artwork_data.get('artistEndDate', 0)) if artwork_data.get('artistEndDate') else 0
+    except (ValueError, TypeError):
+        artist_end = 0
+
+    if 'portrait' in title.lower() or 'portrait' in object_name:
+        return ['portrait', 'classical']
+    elif 'landscape' in title.lower() or 'landscape' in object_name:
+        return ['landscape', 'classical']
+    elif 'abstract' in classification or artist_end > 1900:
+        return ['abstract', 'contemporary']
+    return ['classical', 'fine-art']
+
+def demo_artwork(item):
+    """Artwork record from the Met object (id and price are assigned at the end)"""
+    artwork_data = item["data"]
+
+    # Extract metadata
+    title = artwork_data.get('title', 'Untitled')
+    artist = artwork_data.get('artistDisplayName', 'Unknown Artist')
+
+    return {
+        "title": title[:60],  # Limit title length
+        "artist": artist if artist != "Unknown Artist" else "",
+        "currency": "INR",
+        "style": classify_style(artwork_data),
+        "colors": ["multicolor"],  # Will be enriched later
+        "medium": artwork_data.get('medium', 'Oil on canvas'),
+        "mood": ["contemplative"],  # Will be enriched later
+        "dimensions": artwork_data.get('dimensions', 'N/A'),
+        "period": artwork_data.get('objectDate', 'Unknown'),
+        "availability": "available",
+        "image_url": artwork_data['primaryImage'],
+        "thumbnail_url": artwork_data.get('primaryImageSmall', artwork_data['primaryImage']),
+        "description": artwork_data.get('title', ''),
+        "department": artwork_data.get('department', ''),
+        "culture": artwork_data.get('culture', '')
+    }
+
+def create_balanced_collection(checkpoint: Optional[Checkpoint] = None, searches=SEARCHES):
     """Create a balanced collection of artworks"""
 
-    # Define search criteria for balanced collection
-    searches = [
-        # Portraits (5 artworks)
-        {"q": "portrait", "hasImages": "true", "departmentId": 11, "count": 5},  # European Paintings
-
-        # Landscapes (5 artworks)
-        {"q": "landscape", "hasImages": "true", "departmentId": 11, "count": 5},
-
-        # Abstract/Modern (5 artworks)
-        {"q": "abstract", "hasImages": "true", "departmentId": 21, "count": 5},  # Modern Art
-    ]
-
-    artworks = []
-    artwork_id = 1
-
-    # Price ranges for variety
-    price_ranges = [
-        (180000, 220000),
-        (220000, 280000),
-        (280000, 350000),
-        (350000, 420000),
-        (420000, 500000),
-    ]
-
     print("Fetching fresh artworks from Met Museum API...")
     print("=" * 80)
 
-    for search_config in searches:
-        query = search_config['q']
-        dept_id = search_config['departmentId']
-        target_count = search_config['count']
-
-        print(f"\nSearching for {query} artworks...")
-
-        # Search for artworks
-        search_url = f"{MET_API_BASE}/search?hasImages=true&q={query}&departmentId={dept_id}"
-        response = requests.get(search_url)
+    taken = [0] * len(searches)
+
+    def accept(item):
+        # Counted so the source stops feeding a search once its quota is met
+        taken[item["group"]] += 1
+        record = item["record"]
+        print(f"  ✓ {record['title'][:50]:50} - {record['artist'][:30]}")
+        return True
+
+    sink = CollectSink(accept=accept)
+
+    async def run():
+        async with AsyncMetClient() as met, httpx.AsyncClient(follow_redirects=True) as http:
+            verifier = ImageVerifier(http, images)
+            # Small queues keep the source close to the quota check, so few extras are fetched
+            pipeline = Pipeline(balanced_source(met, searches, taken), [
+                Stage("fetch", met_fetch(met), MET_CONCURRENCY),
+                Stage("image", require_image),
+                Stage("verify", image_verifier(verifier), VERIFY_CONCURRENCY),
+                Stage("transform", transformer(demo_artwork)),
+            ], sink, checkpoint=checkpoint, queue_size=VERIFY_CONCURRENCY)
+            await pipeline.run()
+            print("\n" + "=" * 80)
+            print(pipeline.summary())
+            print(f"Met API: {met.requests} requests ({met.cache.stats()})")
+            print(f"Images: {verifier.stats()}")
+
+    images = VerificationLog()
+    try:
+        asyncio.run(run())
+    finally:
+        images.close()
 
-        if response.status_code != 200:
+    # Fetches run ahead of the quota check, so keep the first `count` of each search in
+    # search order (whatever order the fetches finished in), then number and price them
+    kept = [0] * len(searches)
+    artworks = []
+    for item in sorted(sink.items, key=lambda item: item["index"]):
+        group = item["group"]
+        if kept[group] >= searches[group]['count']:
             continue
-
-        data = response.json()
-        object_ids = data.get('objectIDs', [])[:50]  # Get first 50 results
-
-        found_count = 0
-        for obj_id in object_ids:
-            if found_count >= target_count:
-                break
-
-            artwork_data = fetch_artwork_details(obj_id)
-            if not artwork_data:
-                continue
-
-            # Check if it has a valid image
-            if not artwork_data.get('primaryImage'):
-                continue
-
-            # Verify image URL works
-            try:
-                img_response = requests.head(artwork_data['primaryImage'], timeout=5)
-                if img_response.status_code != 200:
-                    continue
-            except:
-                continue
-
-            # Extract metadata
-            title = artwork_data.get('title', 'Untitled')
-            artist = artwork_data.get('artistDisplayName', 'Unknown Artist')
-
-            # Assign price from range
-            price_range = price_ranges[len(artworks) % len(price_ranges)]
-            import random
-            price = random.randint(price_range[0], price_range[1])
-
-            # Basic style classification
-            classification = artwork_data.get('classification', '').lower()
-            object_name = artwork_data.get('objectName', '').lower()
-
-            # Safe year extraction
-            try:
-                artist_end = int(artwork_data.get('artistEndDate', 0)) if artwork_data.get('artistEndDate') else 0
-            except (ValueError, TypeError):
-                artist_end = 0
-
-            if 'portrait' in title.lower() or 'portrait' in object_name:
-                style = ['portrait', 'classical']
-            elif 'landscape' in title.lower() or 'landscape' in object_name:
-                style = ['landscape', 'classical']
-            elif 'abstract' in classification or artist_end > 1900:
-                style = ['abstract', 'contemporary']
-            else:
-                style = ['classical', 'fine-art']
-
-            artwork = {
-                "id": f"demo_{artwork_id}",
-                "title": title[:60],  # Limit title length
-                "artist": artist if artist != "Unknown Artist" else "",
-                "price": price,
-                "currency": "INR",
-                "style": style,
-                "colors": ["multicolor"],  # Will be enriched later
-                "medium": artwork_data.get('medium', 'Oil on canvas'),
-                "mood": ["contemplative"],  # Will be enriched later
-                "dimensions": artwork_data.get('dimensions', 'N/A'),
-                "period": artwork_data.get('objectDate', 'Unknown'),
-                "availability": "available",
-                "image_url": artwork_data['primaryImage'],
-                "thumbnail_url": artwork_data.get('primaryImageSmall', artwork_data['primaryImage']),
-                "description": artwork_data.get('title', ''),
-                "department": artwork_data.get('department', ''),
-                "culture": artwork_data.get('culture', '')
-            }
-
-            artworks.append(artwork)
-            artwork_id += 1
-            found_count += 1
-
-            print(f"  ✓ {title[:50]:50} - {artist[:30]}")
-
-            sleep(0.5)  # Rate limiting
-
-    print("\n" + "=" * 80)
+        kept[group] += 1
+        price_range = PRICE_RANGES[len(artworks) % len(PRICE_RANGES)]
+        artworks.append(dict(item["record"], id=f"demo_{len(artworks) + 1}",
+                             price=random.randint(price_range[0], price_range[1])))
     print(f"Total artworks fetched: {len(artworks)}")
 
     return artworks
 
 if __name__ == "__main__":
-    artworks = create_balanced_collection()
+    parser = argparse.ArgumentParser(description="Fetch a fresh balanced demo collection")
+    parser.add_argument("--fresh", action="store_true", help="Ignore the checkpoint of an interrupted run and start over")
+    args = parser.parse_args()
+
+    checkpoint = Checkpoint("refresh_demo_artworks", fresh=args.fresh)
+    if checkpoint.resumed:
+        print(f"Resuming from checkpoint {checkpoint.path} ({checkpoint.entries} entries)")
+    artworks = create_balanced_collection(checkpoint)
 
     # Save to file
-    with open('../data/artworks_demo_new.json', 'w', encoding='utf-8') as f:
-        json.dump(artworks, f, indent=2, ensure_ascii=False)
+    write_catalog('../data/artworks_demo_new.json', artworks)
 
     print(f"\n✓ Saved {len(artworks)} artworks to artworks_demo_new.json")
+    checkpoint.complete()
 
     # Print category distribution
     styles = {}
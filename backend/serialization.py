@@ -0,0 +1,54 @@
+"""
+Fast JSON for API responses
+
+dumps() uses orjson when it is installed (several times faster than the json
+module, and it writes bytes directly) and falls back to json otherwise.
+FastJSONResponse sends bytes as they are, so payloads that don't change
+between requests are serialized once: each artwork record is cached as JSON
+by the recommender, and the chatbot keeps its filters and greeting as bytes.
+encode_chat_response() joins those cached artwork bytes into a /chat body
+without re-serializing or re-validating them.
+"""
+import json
+from typing import Any, Callable, Dict
+
+from fastapi.responses import Response
+
+
+def orjson_available() -> bool:
+    try:
+        import orjson  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+if orjson_available():
+    import orjson
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSON response serialized with dumps(); bytes content is taken as already-serialized JSON"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return bytes(content)
+        return dumps(content)
+
+
+def encode_chat_response(response: Dict[str, Any], artwork_bytes: Callable[[Dict], bytes]) -> bytes:
+    """A /chat (or /ws/chat) response as JSON, with each artwork taken from artwork_bytes(artwork)"""
+    artworks = response.get("artworks")
+    if artworks is None:
+        return dumps(response)
+    head = dumps({key: value for key, value in response.items() if key != "artworks"})
+    separator = b"," if len(head) > 2 else b""
+    return b"".join([head[:-1], separator, b'"artworks":[', b",".join(artwork_bytes(art) for art in artworks), b"]}"])
@@ -0,0 +1,228 @@
+"""
+Multi-worker production server
+
+    python serve.py --workers 4        # or: WORKERS=4 ./start.sh
+
+`python app.py` is one process. Running N uvicorn workers the usual way has
+each of them parse the catalog and build its own indexes, filters and
+system prompt, so memory grows by a full catalog per worker. Here the parent
+imports the app, loads the galleries in PRELOAD_GALLERIES and serializes
+their records once, then forks the workers, which all accept on one
+listening socket.
+
+The catalog then lives in pages every worker shares copy-on-write, and the
+request path leaves them alone. The collector is disabled while loading and
+everything is gc.freeze()d before the fork, as the gc docs recommend, so
+collections in the workers never write to those objects. The parent turns
+it back on after each load. Filtering scans the
+recommender's numpy columns rather than the records. A worker only copies
+the pages of the records it actually returns or changes. See "Multi-worker
+Deployment" in the README for measured numbers.
+
+- A PATCH lands in one worker and goes into the catalog's updates log. The
+  other workers apply it before their next request.
+- SIGHUP reloads the catalogs in the parent and replaces the workers.
+- SIGTERM / SIGINT shut the workers down gracefully.
+- A worker that dies is restarted.
+- The Gemini rate limit and the image worker pool are split between workers,
+  so LLM_RATE_PER_MINUTE and IMAGE_WORKERS still hold for the whole server.
+"""
+import gc
+
+# Before anything is loaded, so the objects that will be shared are packed together (see gc.freeze docs)
+gc.disable()
+
+import argparse
+import os
+import signal
+import socket
+import time
+from typing import Dict, List, Set
+
+# The recommender's numpy scans are single-threaded; don't start a BLAS thread pool in every worker
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+
+import uvicorn
+
+import app as server
+from ratelimit import TokenBucket
+from tenants import DEFAULT_GALLERY
+
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 1)))
+# Comma-separated gallery ids to load before forking, or "all"
+PRELOAD_GALLERIES = os.getenv("PRELOAD_GALLERIES", DEFAULT_GALLERY)
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+
+
+def preload(reload: bool = False) -> List[str]:
+    """Load (or re-read) the preloaded galleries and serialize their records, then freeze the heap.
+
+    The collector is off only while loading. On a reload the previous freeze is
+    undone and collected first, so the replaced catalogs don't stay pinned in
+    the parent.
+    """
+    gc.disable()
+    try:
+        gallery_ids: List[str] = []
+        if server.galleries:
+            if PRELOAD_GALLERIES.strip() == "all":
+                gallery_ids = server.galleries.gallery_ids()
+            else:
+                gallery_ids = [gallery_id.strip() for gallery_id in PRELOAD_GALLERIES.split(",") if gallery_id.strip()]
+            for gallery_id in gallery_ids:
+                if reload:
+                    chatbot = server.galleries.reload(gallery_id).chatbot
+                else:
+                    chatbot = server.galleries.get(gallery_id)
+                chatbot.recommender.warm()
+        if reload:
+            gc.unfreeze()
+            gc.collect()
+        gc.freeze()
+    finally:
+        gc.enable()
+    return gallery_ids
+
+
+def run_worker(sock: socket.socket, slot: int, workers: int):
+    """Body of a forked worker: adjust per-process limits, then serve until told to stop"""
+    gc.enable()
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)  # reloads are the parent's business
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    if server.galleries:
+        gateway = server.galleries.gateway
+        gateway.bucket = TokenBucket(gateway.bucket.rate / workers, max(1.0, gateway.bucket.capacity / workers))
+    server.derivatives.workers = max(1, server.derivatives.workers // workers)
+    if slot:
+        server.PREWARM_ENABLED = False  # one worker pre-warms the shared disk cache
+
+    uvicorn.Server(uvicorn.Config(server.app, log_level="info")).run(sockets=[sock])
+
+
+class Supervisor:
+    """Forks the workers, restarts any that die, replaces them all on SIGHUP"""
+
+    def __init__(self, sock: socket.socket, workers: int):
+        self.sock = sock
+        self.workers = workers
+        self.children: Dict[int, int] = {}  # pid -> slot
+        self.started: Dict[int, float] = {}
+        self.retiring: Set[int] = set()
+        self.reload_requested = False
+        self.stopping = False
+
+    def spawn(self, slot: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.sock, slot, self.workers)
+            except BaseException as e:
+                print(f"✗ Worker {slot} failed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = slot
+        self.started[pid] = time.time()
+
+    def reap(self):
+        while self.children or self.retiring:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            started = self.started.pop(pid, 0.0)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            slot = self.children.pop(pid, None)
+            if slot is None or self.stopping:
+                continue
+            print(f"✗ Worker {slot} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}; restarting")
+            if time.time() - started < 1:
+                time.sleep(1)  # don't spin if it dies on startup
+            self.spawn(slot)
+
+    def reload(self):
+        self.reload_requested = False
+        started = time.time()
+        try:
+            gallery_ids = preload(reload=True)
+        except (KeyError, OSError, ValueError) as e:
+            print(f"✗ Reload failed, keeping the current workers: {e}")
+            return
+        old = list(self.children)
+        self.children.clear()
+        for slot in range(self.workers):
+            self.spawn(slot)
+        for pid in old:
+            self.retiring.add(pid)
+            os.kill(pid, signal.SIGTERM)
+        print(f"✓ Reloaded {', '.join(gallery_ids) or 'nothing'} in {time.time() - started:.2f}s; "
+              f"replaced {len(old)} workers")
+
+    def run(self):
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, "reload_requested", True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "stopping", True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, "stopping", True))
+        for slot in range(self.workers):
+            self.spawn(slot)
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload()
+            self.reap()
+            time.sleep(0.2)
+        self.stop()
+
+    def stop(self, timeout: float = 30):
+        for pid in [*self.children, *self.retiring]:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + timeout
+        while (self.children or self.retiring) and time.time() < deadline:
+            for pid in [*self.children, *self.retiring]:
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done:
+                    self.children.pop(pid, None)
+                    self.retiring.discard(pid)
+            time.sleep(0.1)
+        for pid in [*self.children, *self.retiring]:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        print("✓ Stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API from several forked workers sharing one catalog")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    started = time.time()
+    gallery_ids = preload()
+    print(f"✓ Preloaded {', '.join(gallery_ids) or 'nothing'} in {time.time() - started:.2f}s; "
+          f"forking {args.workers} workers on http://{args.host}:{args.port}")
+    Supervisor(sock, max(1, args.workers)).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Several galleries served from one process
+
+Each gallery has its own catalog, and so its own recommender indexes, filter
+metadata and system prompt, in one ArtGalleryChatbot:
+
+    DEFAULT_GALLERY            CATALOG_PATH (data/artworks.json)
+    <id>                       GALLERY_DIR/<id>/artworks.jsonl or artworks.json
+
+GalleryRegistry loads a gallery on its first request and keeps loaded
+galleries in an LRU bounded by GALLERY_MEMORY_MB. A gallery's footprint is
+measured by walking its in-memory catalog once it has loaded. When the total
+goes over budget the least recently used galleries are dropped; their next
+request loads them again. All galleries share one LLMGateway, so the Gemini
+rate limit and circuit breaker cover the whole process.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from catalog_io import CATALOG_PATH
+from chatbot import GEMINI_URL, ArtGalleryChatbot, LLMGateway
+
+GALLERY_DIR = os.getenv("GALLERY_DIR", "../data/galleries")
+DEFAULT_GALLERY = os.getenv("DEFAULT_GALLERY", "default")
+GALLERY_MEMORY_MB = float(os.getenv("GALLERY_MEMORY_MB", "512"))
+
+GALLERY_ID = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+CATALOG_NAMES = ("artworks.jsonl", "artworks.json")
+
+
+class UnknownGallery(KeyError):
+    """No catalog exists for this gallery id"""
+
+
+def deep_size(root) -> int:
+    """Approximate bytes held by an object graph of dicts, lists, tuples, sets and scalars"""
+    seen = set()
+    total = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return total
+
+
+class Gallery:
+    """A loaded gallery and its bookkeeping"""
+
+    def __init__(self, gallery_id: str, chatbot: ArtGalleryChatbot, size: int, load_seconds: float):
+        self.gallery_id = gallery_id
+        self.chatbot = chatbot
+        self.size = size
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        self.requests = 0
+
+    def status(self) -> Dict:
+        return {
+            "gallery": self.gallery_id,
+            "artworks": self.chatbot.recommender.count(),
+            "catalog_version": self.chatbot.recommender.version,
+            "memory_mb": round(self.size / 2**20, 2),
+            "load_seconds": round(self.load_seconds, 3),
+            "loaded_at": self.loaded_at,
+            "requests": self.requests,
+        }
+
+
+class GalleryRegistry:
+    """Gallery id -> chatbot, loaded lazily and kept in a memory-bounded LRU; thread-safe"""
+
+    def __init__(self, api_key: str, gateway: Optional[LLMGateway] = None, gallery_dir: str = GALLERY_DIR,
+                 memory_mb: float = GALLERY_MEMORY_MB, default_path: str = CATALOG_PATH):
+        self.api_key = api_key
+        self.gateway = gateway or LLMGateway(GEMINI_URL.format(api_key=api_key))
+        self.gallery_dir = gallery_dir
+        self.memory_budget = int(memory_mb * 2**20)
+        self.default_path = default_path
+        self._galleries: "OrderedDict[str, Gallery]" = OrderedDict()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def catalog_path(self, gallery_id: str) -> str:
+        if gallery_id == DEFAULT_GALLERY:
+            return self.default_path
+        if GALLERY_ID.match(gallery_id):
+            for name in CATALOG_NAMES:
+                path = os.path.join(self.gallery_dir, gallery_id, name)
+                if os.path.exists(path):
+                    return path
+        raise UnknownGallery(gallery_id)
+
+    def _db_path(self, gallery_id: str) -> Optional[str]:
+        # The default gallery keeps CATALOG_DB; the others keep theirs next to their catalog
+        return None if gallery_id == DEFAULT_GALLERY else os.path.join(self.gallery_dir, gallery_id, "artworks.db")
+
+    def gallery_ids(self) -> List[str]:
+        """Every gallery with a catalog, loaded or not"""
+        ids = [DEFAULT_GALLERY]
+        if os.path.isdir(self.gallery_dir):
+            for name in sorted(os.listdir(self.gallery_dir)):
+                if name != DEFAULT_GALLERY and GALLERY_ID.match(name) and any(
+                        os.path.exists(os.path.join(self.gallery_dir, name, catalog)) for catalog in CATALOG_NAMES):
+                    ids.append(name)
+        return ids
+
+    def get(self, gallery_id: str = DEFAULT_GALLERY) -> ArtGalleryChatbot:
+        """The gallery's chatbot, loading its catalog on first use. Blocks while loading, so call it off the event loop"""
+        with self._lock:
+            gallery = self._galleries.get(gallery_id)
+            if gallery is not None:
+                self._galleries.move_to_end(gallery_id)
+                gallery.requests += 1
+                return gallery.chatbot
+            path = self.catalog_path(gallery_id)
+            loading = self._loading.setdefault(gallery_id, threading.Lock())
+
+        # One load per gallery however many requests arrive for it at once; other galleries aren't held up
+        with loading:
+            with self._lock:
+                gallery = self._galleries.get(gallery_id)
+                if gallery is not None:
+                    self._galleries.move_to_end(gallery_id)
+                    gallery.requests += 1
+                    return gallery.chatbot
+            gallery = self._load(gallery_id, path)
+            gallery.requests += 1
+            with self._lock:
+                self._loading.pop(gallery_id, None)
+            return gallery.chatbot
+
+    def reload(self, gallery_id: str = DEFAULT_GALLERY) -> Gallery:
+        """Re-read a gallery's catalog (loading it if it isn't loaded) and re-measure it"""
+        with self._lock:
+            gallery = self._galleries.get(gallery_id)
+        if gallery is None:
+            self.get(gallery_id)
+            with self._lock:
+                return self._galleries[gallery_id]
+        gallery.chatbot.reload_catalog()
+        with self._lock:
+            gallery.size = self._measure(gallery.chatbot)
+            self._evict(keep=gallery_id)
+        return gallery
+
+    def _load(self, gallery_id: str, path: str) -> Gallery:
+        started = time.time()
+        chatbot = ArtGalleryChatbot(self.api_key, gateway=self.gateway, artworks_path=path,
+                                    db_path=self._db_path(gallery_id))
+        gallery = Gallery(gallery_id, chatbot, self._measure(chatbot), time.time() - started)
+        with self._lock:
+            self._galleries[gallery_id] = gallery
+            self.loads += 1
+            self._evict(keep=gallery_id)
+        print(f"✓ Loaded gallery {gallery_id}: {chatbot.recommender.count()} artworks, "
+              f"{gallery.size / 2**20:.1f} MB in {gallery.load_seconds:.2f}s")
+        return gallery
+
+    @staticmethod
+    def _measure(chatbot: ArtGalleryChatbot) -> int:
+        return deep_size([vars(chatbot.recommender), chatbot.available_filters, chatbot.system_prompt])
+
+    def _evict(self, keep: str):
+        """Drop least recently used galleries until the rest fit the budget (caller holds the lock)"""
+        while self.memory_used() > self.memory_budget:
+            victim = next((gallery_id for gallery_id in self._galleries if gallery_id != keep), None)
+            if victim is None:
+                break  # a single gallery bigger than the budget still gets served
+            gallery = self._galleries.pop(victim)
+            self.evictions += 1
+            print(f"  evicted gallery {victim} ({gallery.size / 2**20:.1f} MB, {gallery.requests} requests)")
+
+    def memory_used(self) -> int:
+        return sum(gallery.size for gallery in self._galleries.values())
+
+    def loaded(self) -> List[Gallery]:
+        """Loaded galleries, least recently used first"""
+        with self._lock:
+            return list(self._galleries.values())
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "loaded": len(self._galleries),
+                "memory_mb": round(self.memory_used() / 2**20, 2),
+                "memory_budget_mb": round(self.memory_budget / 2**20, 2),
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
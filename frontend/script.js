@@ -1,6 +1,101 @@
 const API_URL = 'http://localhost:8000';
+// Gallery to talk to: ?gallery=<id> on this page, or the server's default gallery
+const GALLERY_ID = new URLSearchParams(window.location.search).get('gallery');
 let conversationHistory = [];
 let currentArtworks = [];
+// Open /ws/chat connection, or null to send each turn as POST /chat
+let chatSocket = null;
+// The turn waiting on the socket: {bubble, text, resolve, reject}
+let pendingTurn = null;
+
+function galleryUrl(path) {
+    if (!GALLERY_ID) return `${API_URL}${path}`;
+    const separator = path.includes('?') ? '&' : '?';
+    return `${API_URL}${path}${separator}gallery=${encodeURIComponent(GALLERY_ID)}`;
+}
+
+function chatSocketUrl() {
+    const url = `${API_URL.replace(/^http/, 'ws')}/ws/chat`;
+    return GALLERY_ID ? `${url}?gallery=${encodeURIComponent(GALLERY_ID)}` : url;
+}
+
+// Open the chat socket; resolves with the greeting once the server has sent it
+function connectChatSocket() {
+    return new Promise((resolve, reject) => {
+        const socket = new WebSocket(chatSocketUrl());
+        let greeted = false;
+
+        socket.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            if (data.event === 'greeting') {
+                greeted = true;
+                chatSocket = socket;
+                resolve(data.message);
+            } else {
+                handleSocketEvent(data);
+            }
+        };
+
+        socket.onclose = () => {
+            // Later turns fall back to POST /chat, which carries the whole history
+            chatSocket = null;
+            if (!greeted) reject(new Error('Chat socket closed before greeting'));
+            if (pendingTurn) {
+                pendingTurn.reject(new Error('Chat connection lost'));
+                pendingTurn = null;
+            }
+        };
+    });
+}
+
+function handleSocketEvent(data) {
+    if (!pendingTurn) return;
+    if (data.event === 'token') {
+        // Show the reply as it streams in
+        if (!pendingTurn.bubble) {
+            hideTyping();
+            pendingTurn.bubble = addMessage('assistant', '');
+        }
+        pendingTurn.text += data.text;
+        pendingTurn.bubble.innerHTML = formatMessage(pendingTurn.text);
+        const chatContainer = document.getElementById('chatContainer');
+        chatContainer.scrollTop = chatContainer.scrollHeight;
+    } else if (data.event === 'response') {
+        const turn = pendingTurn;
+        pendingTurn = null;
+        turn.resolve({ data, bubble: turn.bubble });
+    } else if (data.event === 'error') {
+        const turn = pendingTurn;
+        pendingTurn = null;
+        turn.reject(new Error(data.detail));
+    }
+}
+
+// Send only the new message; the server keeps the conversation
+function sendOverSocket(message) {
+    return new Promise((resolve, reject) => {
+        pendingTurn = { bubble: null, text: '', resolve, reject };
+        chatSocket.send(JSON.stringify({ content: message }));
+    });
+}
+
+async function postMessage() {
+    const response = await fetch(galleryUrl('/chat'), {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            messages: conversationHistory
+        })
+    });
+
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    return { data: await response.json(), bubble: null };
+}
 
 // Initialize chat on page load
 window.addEventListener('DOMContentLoaded', async () => {
@@ -28,11 +123,17 @@ async function initChat() {
         // Add instruction message first (centered)
         addInstructionMessage();
 
-        // Then add the greeting message (left-aligned)
-        const response = await fetch(`${API_URL}/greeting`);
-        const data = await response.json();
+        // Then add the greeting message (left-aligned), over the chat socket when it connects
+        let greeting;
+        try {
+            greeting = await connectChatSocket();
+        } catch (socketError) {
+            const response = await fetch(galleryUrl('/greeting'));
+            const data = await response.json();
+            greeting = data.message;
+        }
 
-        addMessage('assistant', data.message);
+        addMessage('assistant', greeting);
 
         // Scroll to top after loading initial messages
         const chatContainer = document.getElementById('chatContainer');
@@ -118,6 +219,7 @@ function addMessage(role, content) {
 
     // Scroll to bottom
     chatContainer.scrollTop = chatContainer.scrollHeight;
+    return contentDiv;
 }
 
 function formatMessage(content) {
@@ -149,11 +251,14 @@ function addArtworkCards(artworks) {
         // Format period as "Since YEAR"
         const periodFormatted = artwork.period ? formatPeriod(artwork.period) : '';
 
+        // Card-sized rendition from the backend; fall back to the original, then a placeholder
+        const cardImageUrl = `${API_URL}/proxy-image?mode=binary&size=card&fmt=webp&url=${encodeURIComponent(artwork.image_url)}`;
+
         card.innerHTML = `
-            <img src="${artwork.image_url}"
+            <img src="${cardImageUrl}"
                  alt="${artwork.title}"
                  onclick="window.open('${artwork.image_url}', '_blank')"
-                 onerror="this.src='https://via.placeholder.com/400x300?text=Image+Not+Available'">
+                 onerror="if (this.src !== '${artwork.image_url}') { this.src = '${artwork.image_url}'; } else { this.src = 'https://via.placeholder.com/400x300?text=Image+Not+Available'; }">
             <div class="artwork-title">${artwork.title}</div>
             ${artwork.artist ? `<div style="font-size: 15px; color: #64748b; margin-bottom: 8px; font-style: italic;">by ${artwork.artist}</div>` : ''}
             <div class="artwork-price">${priceFormatted}</div>
@@ -273,27 +378,17 @@ async function sendMessage() {
 
     try {
         // Send to backend
-        const response = await fetch(`${API_URL}/chat`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                messages: conversationHistory
-            })
-        });
-
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-
-        const data = await response.json();
+        const { data, bubble } = chatSocket ? await sendOverSocket(message) : await postMessage();
 
         // Hide typing indicator
         hideTyping();
 
-        // Add assistant message
-        addMessage('assistant', data.message);
+        // Add assistant message; a streamed reply is replaced by the complete one
+        if (bubble) {
+            bubble.innerHTML = formatMessage(data.message);
+        } else {
+            addMessage('assistant', data.message);
+        }
 
         // Add to conversation history
         conversationHistory.push({
@@ -331,8 +426,49 @@ function formatPeriod(period) {
     return period; // Return as-is if no year found
 }
 
-// Export artworks to PDF
+// Export artworks to PDF - the backend builds and streams the document
 async function exportToPDF(artworks) {
+    const chatContainer = document.getElementById('chatContainer');
+    const loadingDiv = document.createElement('div');
+    loadingDiv.className = 'message assistant';
+    loadingDiv.id = 'pdf-loading';
+    loadingDiv.innerHTML = '<div class="message-content">Generating PDF with all images... This may take a moment.</div>';
+    chatContainer.appendChild(loadingDiv);
+    chatContainer.scrollTop = chatContainer.scrollHeight;
+
+    try {
+        const ids = artworks.map(artwork => artwork.id).join(',');
+        const response = await fetch(galleryUrl(`/export/pdf?ids=${encodeURIComponent(ids)}`));
+        if (!response.ok) {
+            throw new Error(`PDF export failed: ${response.status}`);
+        }
+        const blob = await response.blob();
+
+        // Trigger the download
+        const link = document.createElement('a');
+        link.href = URL.createObjectURL(blob);
+        link.download = 'Canvas-Curator-AI-Artworks.pdf';
+        document.body.appendChild(link);
+        link.click();
+        link.remove();
+        URL.revokeObjectURL(link.href);
+
+        loadingDiv.remove();
+
+        const successDiv = document.createElement('div');
+        successDiv.className = 'message assistant';
+        successDiv.innerHTML = `<div class="message-content">PDF exported successfully with ${artworks.length} artworks!</div>`;
+        chatContainer.appendChild(successDiv);
+        chatContainer.scrollTop = chatContainer.scrollHeight;
+    } catch (error) {
+        console.error('Server-side PDF export failed, building it in the browser instead:', error);
+        loadingDiv.remove();
+        await exportToPDFInBrowser(artworks);
+    }
+}
+
+// Fallback: build the PDF in the browser with jsPDF
+async function exportToPDFInBrowser(artworks) {
     // Show loading message
     const chatContainer = document.getElementById('chatContainer');
     const loadingDiv = document.createElement('div');
@@ -358,48 +494,63 @@ async function exportToPDF(artworks) {
         const pageHeight = pdf.internal.pageSize.getHeight();
         const margin = 20;
 
-        // Function to get image as base64 via backend proxy with retry logic
-        const getBase64Image = async (url, retries = 3) => {
-            for (let attempt = 1; attempt <= retries; attempt++) {
-                try {
-                    console.log(`Fetching image via backend proxy (attempt ${attempt}/${retries}):`, url);
-
-                    // Use backend proxy endpoint to avoid CORS issues
-                    const proxyUrl = `${API_URL}/proxy-image?url=${encodeURIComponent(url)}`;
-
-                    const response = await fetch(proxyUrl);
-
-                    if (!response.ok) {
-                        throw new Error(`Proxy request failed: ${response.status}`);
-                    }
-
-                    const data = await response.json();
-
-                    if (data.success && data.data_url) {
-                        console.log('✓ Successfully loaded image via proxy:', url);
-                        return data.data_url;
-                    } else {
-                        console.error('Proxy returned unsuccessful response:', data);
-                        if (attempt < retries) {
-                            console.log(`Retrying... (${attempt + 1}/${retries})`);
-                            await new Promise(resolve => setTimeout(resolve, 1000 * attempt)); // Exponential backoff
-                            continue;
-                        }
-                        return null;
-                    }
-                } catch (error) {
-                    console.error(`Error loading image via proxy (attempt ${attempt}/${retries}):`, url, error);
-                    if (attempt < retries) {
-                        console.log(`Retrying... (${attempt + 1}/${retries})`);
-                        await new Promise(resolve => setTimeout(resolve, 1000 * attempt)); // Exponential backoff
-                    } else {
-                        return null;
-                    }
+        // Fetch every image in one batch request; the backend loads them concurrently
+        // and streams back one NDJSON line per image as each finishes
+        const loadImages = async (urls) => {
+            const images = new Array(urls.length).fill(null);
+            let received = 0;
+
+            const response = await fetch(`${API_URL}/proxy-images`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({ urls, size: 'pdf', fmt: 'jpeg' })
+            });
+
+            if (!response.ok) {
+                throw new Error(`Batch image request failed: ${response.status}`);
+            }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            const handleLine = (line) => {
+                if (!line.trim()) return;
+                const item = JSON.parse(line);
+                if (item.done) return;
+                if (item.success && item.data_url) {
+                    images[item.index] = item.data_url;
+                    console.log('✓ Successfully loaded image via proxy:', item.url);
+                } else {
+                    console.warn('✗ Image failed to load:', item.url, item.error);
                 }
+                received++;
+                updateLoadingMessage(received, urls.length);
+            };
+
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                lines.forEach(handleLine);
             }
-            return null;
+            handleLine(buffer);
+
+            return images;
         };
 
+        let imageData = [];
+        try {
+            imageData = await loadImages(artworks.map(artwork => artwork.image_url));
+        } catch (error) {
+            console.error('Error loading images via proxy:', error);
+            imageData = new Array(artworks.length).fill(null);
+        }
+
         // Add cover page
         let yPosition = pageHeight / 2 - 30;
         pdf.setFontSize(28);
@@ -452,10 +603,9 @@ async function exportToPDF(artworks) {
 
             yPosition += 5;
 
-            // Add image - load each image individually
+            // Add image
             try {
-                console.log(`Loading image ${i + 1}/${artworks.length}:`, artwork.image_url);
-                const imgData = await getBase64Image(artwork.image_url);
+                const imgData = imageData[i];
                 if (imgData) {
                     const imgWidth = pageWidth - 2 * margin;
                     const imgHeight = 100; // Increased height for better visibility
@@ -463,18 +613,14 @@ async function exportToPDF(artworks) {
                     pdf.addImage(imgData, 'JPEG', margin, yPosition, imgWidth, imgHeight);
                     yPosition += imgHeight + 10;
                     imagesLoaded++;
-                    updateLoadingMessage(imagesLoaded + imagesFailed, artworks.length);
-                    console.log(`✓ Image ${i + 1} loaded successfully`);
                 } else {
                     console.warn(`✗ Image ${i + 1} failed to load`);
                     imagesFailed++;
-                    updateLoadingMessage(imagesLoaded + imagesFailed, artworks.length);
                     yPosition += 5;
                 }
             } catch (error) {
                 console.error('Error adding image to PDF:', error);
                 imagesFailed++;
-                updateLoadingMessage(imagesLoaded + imagesFailed, artworks.length);
                 yPosition += 5;
             }
 
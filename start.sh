@@ -39,4 +39,9 @@ echo "Press Ctrl+C to stop the server"
 echo ""
 
 cd backend
-python app.py
+# WORKERS=4 ./start.sh forks several workers that share one preloaded catalog
+if [ "${WORKERS:-1}" -gt 1 ]; then
+    python serve.py --workers "$WORKERS"
+else
+    python app.py
+fi